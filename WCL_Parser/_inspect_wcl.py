@@ -1,14 +1,9 @@
-import os,json,urllib.request,urllib.parse
+from wcl_client import get_token, gql as _gql
 code='Fr1v4QhXNtg8HmTP';fight=1
-cid=os.environ['WCL_CLIENT_ID'];sec=os.environ['WCL_CLIENT_SECRET']
-body=urllib.parse.urlencode({'grant_type':'client_credentials','client_id':cid,'client_secret':sec}).encode()
-req=urllib.request.Request('https://www.warcraftlogs.com/oauth/token',data=body,headers={'Content-Type':'application/x-www-form-urlencoded'})
-tok=json.loads(urllib.request.urlopen(req).read().decode())['access_token']
+tok=get_token()
 
 def gql(q,v=None):
- p={'query':q,'variables':v or {}}
- r=urllib.request.Request('https://www.warcraftlogs.com/api/v2/client',data=json.dumps(p).encode(),headers={'Content-Type':'application/json','Authorization':'Bearer '+tok})
- return json.loads(urllib.request.urlopen(r).read().decode())
+ return _gql(tok,q,v)
 
 q='''query($code:String!,$fightIDs:[Int]){reportData{report(code:$code){fights(fightIDs:$fightIDs){startTime endTime} playerDetails(fightIDs:$fightIDs,includeCombatantInfo:true)}}}'''
 res=gql(q,{'code':code,'fightIDs':[fight]})
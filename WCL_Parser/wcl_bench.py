@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from wcl_timers import (
+    aggregate_majority_cluster_per_index,
+    build_dsl_table,
+    choose_representative_log_index,
+    lua_dsl_table,
+    snap_close_toggle_pairs,
+    upsert_specs_into_main,
+)
+from wcl_verify import ROUNDS_DEFAULT, report_checks, run_checks
+
+# Offline micro-benchmarks for the timers aggregation and Lua emission paths. Inputs
+# come from seeded generators, so two runs with the same flags time the same work.
+BENCH_VERSION = 1
+TOGGLES = ("Ramp", "Cooldowns", "MiniCooldowns")
+FIGHT_SECONDS = 360.0
+
+Timings = Dict[str, Any]
+# (run, setup): setup (untimed) runs before every call when given.
+Case = Tuple[Callable[[], Any], Optional[Callable[[], Any]]]
+
+
+def parse_int_csv(value: str) -> List[int]:
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def gen_log_times(rng: random.Random, n_logs: int, casts_per_fight: int, n_spells: int) -> List[Dict[int, List[float]]]:
+    # Per-log cast times (seconds from pull) by spell id. Logs follow one shared plan
+    # with jitter, dropped and extra casts; a quarter run the plan late, so clustering
+    # has a minority to reject.
+    per_spell = max(1, casts_per_fight // n_spells)
+    plan = {100 + k: sorted(rng.uniform(0.0, FIGHT_SECONDS) for _ in range(per_spell)) for k in range(n_spells)}
+    logs = []
+    for _ in range(n_logs):
+        shift = 15.0 if rng.random() < 0.25 else 0.0
+        log: Dict[int, List[float]] = {}
+        for sid, times in plan.items():
+            out = [max(0.0, t + shift + rng.gauss(0.0, 3.0)) for t in times if rng.random() >= 0.1]
+            out.extend(rng.uniform(0.0, FIGHT_SECONDS) for _ in range(per_spell // 10))
+            log[sid] = sorted(out)
+        logs.append(log)
+    return logs
+
+
+def gen_actions(rng: random.Random, n_actions: int) -> List[Tuple[int, Dict[str, Any]]]:
+    # A cell's (second, action) list: mostly toggles, some spell casts.
+    actions = []
+    for _ in range(n_actions):
+        t = int(rng.uniform(0.0, FIGHT_SECONDS))
+        if rng.random() < 0.7:
+            action = {"method": None, "ID": None, "occurrence": None, "spellId": None, "toggle": rng.choice(TOGGLES)}
+        else:
+            action = {"method": None, "ID": None, "occurrence": None, "spellId": rng.randint(1000, 500000), "toggle": None}
+        actions.append((t, action))
+    return actions
+
+
+def gen_spec_data(rng: random.Random, n_specs: int, bosses: int, casts_per_fight: int, prefix: str = "Spec"):
+    # {spec: {npcId: dsl table}} and matching boss names, like one upsert bucket.
+    data: Dict[str, Dict[int, Dict[int, List[Dict[str, Any]]]]] = {}
+    names: Dict[str, Dict[int, str]] = {}
+    for k in range(n_specs):
+        spec = f"{prefix} {k}"
+        data[spec] = {}
+        names[spec] = {}
+        for b in range(bosses):
+            npc_id = 200000 + b
+            data[spec][npc_id] = build_dsl_table(gen_actions(rng, casts_per_fight))
+            names[spec][npc_id] = f"Boss {b}"
+    return data, names
+
+
+def gen_main_lua(rng: random.Random, n_specs: int, bosses: int, casts_per_fight: int) -> str:
+    # A LorrgsTimers.lua with both buckets, plus the comments and strings a hand-edited
+    # file has (braces and markers included).
+    parts = [
+        "LorrgsTimers = LorrgsTimers or {}\n",
+        "-- LorrgsTimers.dynamicTimers = { old layout }\n",
+        "--[[ notes: } { [\"Spec 0\"] = { ]]\n",
+    ]
+    for bucket in ("dynamicTimers", "dynamicMythic"):
+        data, names = gen_spec_data(rng, n_specs, bosses, casts_per_fight)
+        parts.append(f"LorrgsTimers.{bucket} = {{\n")
+        for spec, by_boss in data.items():
+            parts.append(f'    ["{spec}"] = {{\n')
+            for npc_id, tbl in by_boss.items():
+                parts.append(f"        [{npc_id}] = {lua_dsl_table(tbl)}, -- {names[spec][npc_id]}\n")
+            parts.append('        note = "}",\n')
+            parts.append("    },\n")
+        parts.append("}\n")
+    parts.append("return LorrgsTimers\n")
+    return "".join(parts)
+
+
+def case_aggregate(rng: random.Random, logs: int, casts: int, spells: int) -> Case:
+    columns = [[log[sid] for log in gen_log_times(rng, logs, casts, spells)] for sid in range(100, 100 + spells)]
+
+    def run():
+        for lists in columns:
+            aggregate_majority_cluster_per_index(lists, 10.0)
+    return run, None
+
+
+def case_representative(rng: random.Random, logs: int, casts: int, spells: int) -> Case:
+    per_log = gen_log_times(rng, logs, casts, spells)
+    consensus = {sid: aggregate_majority_cluster_per_index([log[sid] for log in per_log], 10.0) for sid in per_log[0]}
+    return (lambda: choose_representative_log_index(per_log, consensus, 10.0)), None
+
+
+def case_snap(rng: random.Random, casts: int) -> Case:
+    actions = gen_actions(rng, casts)
+    return (lambda: snap_close_toggle_pairs(actions, 5.0)), None
+
+
+def case_lua_dsl_table(rng: random.Random, casts: int) -> Case:
+    tbl = build_dsl_table(gen_actions(rng, casts))
+    return (lambda: lua_dsl_table(tbl)), None
+
+
+def case_upsert(rng: random.Random, specs: int, casts: int, bosses: int, tmp_dir: str) -> Case:
+    # Half of the existing specs are rebuilt and a tenth are new, in both buckets.
+    text = gen_main_lua(rng, specs, bosses, casts)
+    path = os.path.join(tmp_dir, f"LorrgsTimers-{specs}-{casts}.lua")
+    data_by_bucket = {}
+    names_by_bucket = {}
+    for bucket in ("dynamicTimers", "dynamicMythic"):
+        data, names = gen_spec_data(rng, specs // 2, bosses, casts)
+        new_data, new_names = gen_spec_data(rng, max(1, specs // 10), bosses, casts, prefix="New Spec")
+        data.update(new_data)
+        names.update(new_names)
+        data_by_bucket[bucket] = data
+        names_by_bucket[bucket] = names
+
+    def setup():
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    return (lambda: upsert_specs_into_main(path, data_by_bucket, names_by_bucket)), setup
+
+
+def measure(run: Callable[[], Any], setup: Optional[Callable[[], Any]], repeat: int, min_time: float) -> Timings:
+    # Seconds per call: `repeat` samples, each of enough calls to take min_time.
+    def sample(n: int) -> float:
+        total = 0.0
+        for _ in range(n):
+            if setup is not None:
+                setup()
+            t0 = time.perf_counter()
+            run()
+            total += time.perf_counter() - t0
+        return total
+
+    n = 1
+    while sample(n) < min_time and n < 1 << 20:
+        n *= 2
+    per_call = [sample(n) / n for _ in range(repeat)]
+    return {"calls": n, "best_s": min(per_call), "median_s": statistics.median(per_call)}
+
+
+def plan_cases(args: argparse.Namespace, tmp_dir: str) -> List[Tuple[str, Dict[str, int], Callable[[random.Random], Case]]]:
+    logs, casts, specs = parse_int_csv(args.logs), parse_int_csv(args.casts), parse_int_csv(args.specs)
+    cases = []
+    for n_logs in logs:
+        for n_casts in casts:
+            params = {"logs": n_logs, "casts": n_casts, "spells": args.spells}
+            cases.append(("aggregate_majority_cluster_per_index", params,
+                          lambda rng, p=params: case_aggregate(rng, p["logs"], p["casts"], p["spells"])))
+            cases.append(("choose_representative_log_index", params,
+                          lambda rng, p=params: case_representative(rng, p["logs"], p["casts"], p["spells"])))
+    for n_casts in casts:
+        params = {"casts": n_casts}
+        cases.append(("snap_close_toggle_pairs", params, lambda rng, p=params: case_snap(rng, p["casts"])))
+        cases.append(("lua_dsl_table", params, lambda rng, p=params: case_lua_dsl_table(rng, p["casts"])))
+    for n_specs in specs:
+        params = {"specs": n_specs, "casts": casts[0], "bosses": args.bosses}
+        cases.append(("upsert_specs_into_main", params,
+                      lambda rng, p=params: case_upsert(rng, p["specs"], p["casts"], p["bosses"], tmp_dir)))
+    if args.only:
+        wanted = {name.strip() for name in args.only.split(",") if name.strip()}
+        cases = [case for case in cases if case[0] in wanted]
+    return cases
+
+
+def result_key(row: Dict[str, Any]) -> Tuple[str, str]:
+    return row["bench"], json.dumps(row["params"], sort_keys=True)
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    # best_s ratio against the baseline row with the same bench and params.
+    base_rows = {result_key(row): row for row in baseline.get("results", [])}
+    out = []
+    for row in results:
+        base = base_rows.get(result_key(row))
+        if base is None or base["best_s"] <= 0:
+            continue
+        ratio = row["best_s"] / base["best_s"]
+        out.append({"bench": row["bench"], "params": row["params"], "ratio": round(ratio, 3), "regression": ratio > tolerance})
+    return out
+
+
+def format_params(params: Dict[str, int]) -> str:
+    return " ".join(f"{k}={v}" for k, v in params.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for wcl_timers aggregation and Lua emission")
+    parser.add_argument("--logs", default="5,25,100", help="Comma-separated log counts to sweep")
+    parser.add_argument("--casts", default="20,100,400", help="Comma-separated casts-per-fight values to sweep")
+    parser.add_argument("--specs", default="10,40,160", help="Comma-separated spec counts for the LorrgsTimers.lua upsert")
+    parser.add_argument("--spells", type=int, default=6, help="Tracked spells per log")
+    parser.add_argument("--bosses", type=int, default=8, help="Bosses per spec in generated LorrgsTimers.lua files")
+    parser.add_argument("--only", default="", help="Comma-separated benchmark names to run")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the synthetic inputs")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed samples per case")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Minimum seconds per sample")
+    parser.add_argument("--quick", action="store_true", help="Smallest sweep value of each dimension, fewer samples")
+    parser.add_argument("--out", default="", help="Write JSON results here")
+    parser.add_argument("--baseline", default="", help="Compare against a previous --out file")
+    parser.add_argument("--tolerance", type=float, default=1.10, help="best_s ratio above which a case counts as a regression")
+    parser.add_argument("--verify", action="store_true",
+                        help="Compare the rewritten hot paths with their reference versions instead of timing (see wcl_verify.py)")
+    args = parser.parse_args()
+    if args.verify:
+        sys.exit(0 if report_checks(run_checks(args.seed, ROUNDS_DEFAULT)) else 1)
+    if args.quick:
+        args.logs, args.casts, args.specs = (value.split(",")[0] for value in (args.logs, args.casts, args.specs))
+        args.repeat = min(args.repeat, 3)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="wcl_bench_") as tmp_dir:
+        for name, params, make in plan_cases(args, tmp_dir):
+            run, setup = make(random.Random(f"{args.seed}:{name}:{json.dumps(params, sort_keys=True)}"))
+            row = {"bench": name, "params": params}
+            row.update(measure(run, setup, args.repeat, args.min_time))
+            results.append(row)
+            print(f"{name:40s} {format_params(params):32s} best {row['best_s'] * 1e3:10.3f} ms  "
+                  f"median {row['median_s'] * 1e3:10.3f} ms", file=sys.stderr)
+
+    output: Dict[str, Any] = {
+        "version": BENCH_VERSION,
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "min_time": args.min_time,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            comparison = compare(results, json.load(f), args.tolerance)
+        output["baseline"] = args.baseline
+        output["comparison"] = comparison
+        for row in comparison:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"{row['bench']:40s} {format_params(row['params']):32s} x{row['ratio']:.3f} vs baseline{flag}", file=sys.stderr)
+        regressions = [row for row in comparison if row["regression"]]
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+CACHE_DIR_DEFAULT = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".wcl_cache")
+CACHE_MAX_MB_DEFAULT = 512
+# Separate budget for the columnar event store under <cache dir>/events.
+EVENTS_MAX_MB_DEFAULT = 512
+
+# TTL per policy in seconds; None means the entry never expires.
+# Finished reports never change, rankings move daily, zone/class data changes with patches.
+POLICY_TTLS: Dict[str, Optional[float]] = {
+    "report": None,
+    "rankings": 6 * 3600.0,
+    "world": 7 * 24 * 3600.0,
+}
+
+# Refresh OAuth tokens this long before WCL says they expire.
+TOKEN_REFRESH_MARGIN_SECONDS = 600.0
+
+# GraphQL string literals (block strings first); normalize_query leaves them as written.
+STRING_LITERAL_RE = re.compile(r'("""(?:[^"\\]|\\.|"(?!""))*"""|"(?:[^"\\]|\\.)*")')
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    # Exclusive advisory lock shared between processes; blocks until acquired.
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10 seconds; keep waiting.
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def write_atomic(path: str, raw: bytes, mode: Optional[int] = None):
+    # `mode` creates the temp file with those permissions before anything is written,
+    # so a secret is never readable by others, not even briefly.
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if mode is None:
+        with open(tmp, "wb") as f:
+            f.write(raw)
+    else:
+        try:
+            # A temp file left by a crashed run may have other permissions.
+            os.remove(tmp)
+        except OSError:
+            pass
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), mode)
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+    os.replace(tmp, path)
+
+
+def text_digest(path: str) -> Optional[str]:
+    # sha256 of a text file's content as read in text mode (so CRLF/LF files compare
+    # equal to the same text), or None if it is missing or not UTF-8.
+    digest = hashlib.sha256()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for chunk in iter(lambda: f.read(1 << 20), ""):
+                digest.update(chunk.encode("utf-8"))
+    except (OSError, UnicodeDecodeError):
+        return None
+    return digest.hexdigest()
+
+
+def write_text_if_changed(path: str, chunks: Iterable[str]) -> bool:
+    # Streams text to a temp file next to `path` and swaps it in only when the content
+    # differs, so an unchanged file keeps its mtime. Returns whether it was replaced.
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    digest = hashlib.sha256()
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            for chunk in chunks:
+                digest.update(chunk.encode("utf-8"))
+                f.write(chunk)
+        if digest.hexdigest() == text_digest(path):
+            os.remove(tmp)
+            return False
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return True
+
+
+def scan_files(root: str, suffix: str) -> List[Tuple[float, str, int]]:
+    # (mtime, path, size) of every root/<dir>/<file> ending in suffix.
+    out: List[Tuple[float, str, int]] = []
+    if not os.path.isdir(root):
+        return out
+    for shard in os.listdir(root):
+        shard_dir = os.path.join(root, shard)
+        if not os.path.isdir(shard_dir):
+            continue
+        for name in os.listdir(shard_dir):
+            if not name.endswith(suffix):
+                continue
+            path = os.path.join(shard_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            out.append((st.st_mtime, path, st.st_size))
+    return out
+
+
+def evict_lru(entries: List[Tuple[float, str, int]], max_bytes: int) -> int:
+    # Drops least recently used files until we are back under 90% of the budget;
+    # returns the bytes left. Files that cannot be removed (mapped on Windows) stay.
+    total = sum(size for _, _, size in entries)
+    target = int(max_bytes * 0.9)
+    for _, path, size in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+    return total
+
+
+def normalize_query(query: str) -> str:
+    # Whitespace is collapsed and dropped around punctuation outside string literals only,
+    # so queries that differ inside a quoted argument keep different keys.
+    parts = STRING_LITERAL_RE.split(query)
+    for i in range(0, len(parts), 2):
+        text = re.sub(r"\s+", " ", parts[i])
+        parts[i] = re.sub(r" ?([{}()\[\]:,!$=]) ?", r"\1", text)
+    return "".join(parts).strip()
+
+
+def cache_key(query: str, variables: Optional[Dict[str, Any]] = None) -> str:
+    # null and missing GraphQL variables are equivalent, so drop them from the key.
+    clean = {k: v for k, v in (variables or {}).items() if v is not None}
+    raw = normalize_query(query) + "\n" + json.dumps(clean, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def query_policy(query: str) -> Optional[str]:
+    # Rankings are checked first because they embed report codes but are not immutable.
+    if "rateLimitData" in query:
+        return None
+    if "characterRankings" in query:
+        return "rankings"
+    if "reportData" in query:
+        return "report"
+    if "worldData" in query or "gameData" in query:
+        return "world"
+    return None
+
+
+class DiskCache:
+    # Content-addressed GraphQL response cache. Each entry is one gzip JSON file;
+    # file mtime doubles as the last-access time for LRU eviction.
+    def __init__(self, root: str = CACHE_DIR_DEFAULT, max_bytes: int = CACHE_MAX_MB_DEFAULT * 1024 * 1024,
+                 ttls: Optional[Dict[str, Optional[float]]] = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttls = dict(POLICY_TTLS if ttls is None else ttls)
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+
+    @classmethod
+    def from_env(cls, root: Optional[str] = None) -> Optional["DiskCache"]:
+        if os.environ.get("WCL_NO_CACHE"):
+            return None
+        root = root or os.environ.get("WCL_CACHE_DIR") or CACHE_DIR_DEFAULT
+        max_mb = float(os.environ.get("WCL_CACHE_MAX_MB") or CACHE_MAX_MB_DEFAULT)
+        return cls(root, int(max_mb * 1024 * 1024))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".json.gz")
+
+    def get(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        policy = query_policy(query)
+        if policy is None:
+            return None
+        path = self._path(cache_key(query, variables))
+        try:
+            with open(path, "rb") as f:
+                entry = json.loads(gzip.decompress(f.read()).decode("utf-8"))
+        except (OSError, ValueError, EOFError):
+            return None
+        ttl = self.ttls.get(policy)
+        if ttl is not None and time.time() - float(entry.get("stored", 0)) > ttl:
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry.get("response")
+
+    def put(self, query: str, variables: Optional[Dict[str, Any]], response: Dict[str, Any]):
+        policy = query_policy(query)
+        if policy is None:
+            return
+        path = self._path(cache_key(query, variables))
+        entry = {"stored": time.time(), "policy": policy, "response": response}
+        raw = gzip.compress(json.dumps(entry, separators=(",", ":")).encode("utf-8"))
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        write_atomic(path, raw)
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, _, size in self._scan())
+            else:
+                self._total_bytes += len(raw) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self) -> List[Tuple[float, str, int]]:
+        return scan_files(self.root, ".json.gz")
+
+    def _evict(self):
+        self._total_bytes = evict_lru(self._scan(), self.max_bytes)
+
+    def clear(self):
+        with self._lock:
+            for _, path, _ in self._scan():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._total_bytes = 0
+
+
+class TokenStore:
+    # OAuth tokens shared by every script and process using the same client id.
+    # The lock file serializes refreshes so concurrent cron runs do one exchange.
+    def __init__(self, root: str, scope: str):
+        name = hashlib.sha256(scope.encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(root, f"token-{name}.json")
+        self.lock_path = self.path + ".lock"
+
+    @classmethod
+    def from_env(cls, scope: str) -> "TokenStore":
+        return cls(os.environ.get("WCL_CACHE_DIR") or CACHE_DIR_DEFAULT, scope)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not entry.get("access_token"):
+            return None
+        if time.time() >= float(entry.get("expires_at", 0)) - TOKEN_REFRESH_MARGIN_SECONDS:
+            return None
+        return entry
+
+    def save(self, access_token: str, expires_in: float) -> Dict[str, Any]:
+        entry = {"access_token": access_token, "expires_at": time.time() + float(expires_in)}
+        write_atomic(self.path, json.dumps(entry).encode("utf-8"), mode=0o600)
+        return entry
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class ResponseLog:
+    # Every GraphQL exchange of a run, query text included, written when WCL_RECORD_DIR
+    # is set and served back by wcl_stub_server. Same layout as DiskCache, no expiry.
+    def __init__(self, root: str):
+        self.root = root
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseLog"]:
+        root = os.environ.get("WCL_RECORD_DIR")
+        return cls(root) if root else None
+
+    def put(self, query: str, variables: Optional[Dict[str, Any]], response: Dict[str, Any]):
+        key = cache_key(query, variables)
+        entry = {"query": query, "variables": variables or {}, "response": response}
+        raw = gzip.compress(json.dumps(entry, separators=(",", ":")).encode("utf-8"))
+        write_atomic(os.path.join(self.root, key[:2], key + ".json.gz"), raw)
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        if not os.path.isdir(self.root):
+            return
+        for shard in sorted(os.listdir(self.root)):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in sorted(os.listdir(shard_dir)):
+                if not name.endswith(".json.gz"):
+                    continue
+                try:
+                    with open(os.path.join(shard_dir, name), "rb") as f:
+                        yield json.loads(gzip.decompress(f.read()).decode("utf-8"))
+                except (OSError, ValueError, EOFError):
+                    continue
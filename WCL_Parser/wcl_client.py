@@ -0,0 +1,776 @@
+import gzip
+import http.client
+import json
+import math
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from wcl_cache import TOKEN_REFRESH_MARGIN_SECONDS, DiskCache, ResponseLog, TokenStore, file_lock
+
+# Overridable with WCL_BASE_URL or --base-url, for example to point at wcl_stub_server.
+BASE_URL = "https://www.warcraftlogs.com"
+TOKEN_PATH = "/oauth/token"
+API_PATH = "/api/v2/client"
+
+MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 1.0
+RETRY_STATUSES = {500, 502, 503, 504}
+
+# Used when the token endpoint omits expires_in.
+TOKEN_LIFETIME_DEFAULT_SECONDS = 3600.0
+
+RATE_LIMIT_QUERY = "query { rateLimitData { limitPerHour pointsSpentThisHour pointsResetIn } }"
+# Poll rateLimitData after this many requests or seconds, whichever comes first.
+RATE_POLL_REQUESTS = 50
+RATE_POLL_SECONDS = 60.0
+# Start spreading requests out once this share of the hourly budget is spent,
+# and never plan to spend more than RATE_TARGET_FRACTION of it.
+RATE_PACE_FRACTION = 0.5
+RATE_TARGET_FRACTION = 0.95
+# Fallback wait when WCL answers 429 and rateLimitData cannot be read.
+RATE_LIMITED_WAIT_SECONDS = 60.0
+RATE_LIMITED_MAX_WAITS = 90
+
+# Time slices paged concurrently by paginate_events once a fetch needs more than one page.
+EVENT_SLICES_DEFAULT = 1
+# Event windows requested per aliased query by fetch_event_windows.
+EVENT_WINDOW_BATCH_SIZE = 20
+
+_stage = threading.local()
+
+
+@contextmanager
+def rate_stage(name: str) -> Iterator[None]:
+    # Labels requests made on this thread so points can be reported per stage.
+    prev = getattr(_stage, "name", None)
+    _stage.name = name
+    try:
+        yield
+    finally:
+        _stage.name = prev
+
+
+def current_stage() -> str:
+    return getattr(_stage, "name", None) or "other"
+
+
+# wcl_client functions a request passes through on its way from the code that asked for it.
+PASS_THROUGH_FUNCS = {"gql", "paginate_events"}
+
+
+@contextmanager
+def gql_site(name: str) -> Iterator[None]:
+    # Attributes requests made on this thread to `name`, for worker threads whose
+    # stack no longer shows who asked.
+    prev = getattr(_stage, "site", None)
+    _stage.site = name
+    try:
+        yield
+    finally:
+        _stage.site = prev
+
+
+def call_site() -> str:
+    # "module.function" of the innermost caller outside the request plumbing in this
+    # module, e.g. wcl_timers.fetch_casts; used to group telemetry.
+    site = getattr(_stage, "site", None)
+    if site:
+        return site
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename != _THIS_FILE or not (code.co_name in PASS_THROUGH_FUNCS or code.co_name.startswith("_")):
+            return f"{os.path.splitext(os.path.basename(code.co_filename))[0]}.{code.co_name}"
+        frame = frame.f_back
+    return "other"
+
+
+_THIS_FILE = call_site.__code__.co_filename
+
+
+def get_env(name: str) -> str:
+    val = os.environ.get(name)
+    if not val:
+        raise RuntimeError(f"Missing env var {name}")
+    return val
+
+
+class WclHttpError(RuntimeError):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class WclGraphQLError(RuntimeError):
+    # The API answered, but rejected the query (complexity, unknown report, ...).
+    def __init__(self, errors: List[Dict[str, Any]]):
+        super().__init__(f"GraphQL error: {errors}")
+        self.errors = errors
+
+
+def decode_body(raw: bytes, encoding: Optional[str]) -> bytes:
+    encoding = (encoding or "").strip().lower()
+    if encoding == "gzip":
+        return gzip.decompress(raw)
+    if encoding == "deflate":
+        return zlib.decompress(raw)
+    return raw
+
+
+class ConnectionPool:
+    # Keep-alive connections to a single host. Each connection is used by one
+    # thread at a time; idle ones are parked here for the next request.
+    def __init__(self, base_url: str, max_idle: int = 8, timeout: float = 120.0):
+        parts = urllib.parse.urlsplit(base_url)
+        if parts.scheme not in ("http", "https"):
+            raise RuntimeError(f"Unsupported URL scheme in {base_url}")
+        self.scheme = parts.scheme
+        self.host = parts.hostname or ""
+        self.port = parts.port
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> http.client.HTTPConnection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def release(self, conn: http.client.HTTPConnection, reusable: bool):
+        if reusable:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class RateLimiter:
+    # Tracks WCL's points-per-hour budget from rateLimitData and spaces requests
+    # out so the remaining budget lasts until the hourly reset. Points are only
+    # reported in aggregate, so each poll's delta is split across stages by
+    # request count; per-stage numbers are estimates.
+    def __init__(self):
+        self.limit: Optional[float] = None
+        self.spent: Optional[float] = None
+        self.reset_at = 0.0
+        self.last_poll = 0.0
+        self.requests_since_poll = 0
+        self.points_per_request: Optional[float] = None
+        self.next_slot = 0.0
+        self.stage_requests: Dict[str, int] = {}
+        self.stage_points: Dict[str, float] = {}
+        self.site_points: Dict[str, float] = {}
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._polling = False
+        # Set while rateLimitData polls fail; the next try waits for the normal interval.
+        self.poll_failed_at: Optional[float] = None
+        self.requests_since_failure = 0
+        self._lock = threading.Lock()
+
+    def claim_poll(self) -> bool:
+        # True when a poll is due; only one thread at a time gets to do it.
+        with self._lock:
+            if self._polling:
+                return False
+            now = time.monotonic()
+            if self.poll_failed_at is not None:
+                due = (self.requests_since_failure >= RATE_POLL_REQUESTS
+                       or now - self.poll_failed_at >= RATE_POLL_SECONDS)
+            else:
+                due = (self.limit is None or now >= self.reset_at
+                       or (self.requests_since_poll > 0
+                           and (self.requests_since_poll >= RATE_POLL_REQUESTS or now - self.last_poll >= RATE_POLL_SECONDS)))
+            self._polling = due
+            return due
+
+    def release_poll(self):
+        with self._lock:
+            self._polling = False
+
+    def poll_failed(self):
+        with self._lock:
+            self.poll_failed_at = time.monotonic()
+            self.requests_since_failure = 0
+
+    def update(self, data: Dict[str, Any]):
+        now = time.monotonic()
+        with self._lock:
+            limit = float(data["limitPerHour"])
+            spent = float(data["pointsSpentThisHour"])
+            if self.spent is not None:
+                # A drop means the hour rolled over between polls.
+                delta = spent - self.spent if spent >= self.spent else spent
+                requests = sum(self._pending.values())
+                if requests:
+                    self.points_per_request = delta / requests
+                    for (stage, site), count in self._pending.items():
+                        share = delta * count / requests
+                        self.stage_points[stage] = self.stage_points.get(stage, 0.0) + share
+                        self.site_points[site] = self.site_points.get(site, 0.0) + share
+            self.limit = limit
+            self.spent = spent
+            self.reset_at = now + float(data["pointsResetIn"])
+            self.last_poll = now
+            self.requests_since_poll = 0
+            self._pending = {}
+            self.poll_failed_at = None
+
+    def wait_time(self) -> float:
+        # Reserves the next request slot and returns how long to sleep for it.
+        now = time.monotonic()
+        with self._lock:
+            if self.limit is None or self.spent is None:
+                return 0.0
+            if now >= self.reset_at:
+                # The hour rolled over; the next poll will pick up the fresh budget.
+                return max(0.0, self.next_slot - now)
+            if self.spent < self.limit * RATE_PACE_FRACTION:
+                return 0.0
+            time_left = max(self.reset_at - now, 1.0)
+            remaining = self.limit * RATE_TARGET_FRACTION - self.spent
+            cost = self.points_per_request or 1.0
+            remaining -= cost * self.requests_since_poll
+            if remaining <= 0:
+                slot = max(self.reset_at, self.next_slot)
+            else:
+                slot = max(now, self.next_slot)
+                self.next_slot = slot + cost * time_left / remaining
+            return max(0.0, slot - now)
+
+    def record(self, stage: str, site: str = "other"):
+        with self._lock:
+            self.requests_since_poll += 1
+            self.requests_since_failure += 1
+            self._pending[(stage, site)] = self._pending.get((stage, site), 0) + 1
+            self.stage_requests[stage] = self.stage_requests.get(stage, 0) + 1
+
+    def rate_limited(self):
+        # WCL refused the request; nothing more can be spent until the reset.
+        now = time.monotonic()
+        with self._lock:
+            if self.limit is not None:
+                self.spent = self.limit
+            self.next_slot = max(self.next_slot, self.reset_at if self.reset_at > now else now + RATE_LIMITED_WAIT_SECONDS)
+
+    def points_by_site(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.site_points)
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "limitPerHour": self.limit,
+                "pointsSpentThisHour": self.spent,
+                "pointsResetIn": max(0.0, self.reset_at - time.monotonic()) if self.limit is not None else None,
+                "stages": {
+                    stage: {"requests": count, "points": round(self.stage_points.get(stage, 0.0), 1)}
+                    for stage, count in sorted(self.stage_requests.items())
+                },
+            }
+
+
+def percentile(sorted_vals: List[float], p: float) -> float:
+    # Nearest-rank percentile of a non-empty sorted list.
+    return sorted_vals[min(len(sorted_vals) - 1, max(0, math.ceil(p * len(sorted_vals)) - 1))]
+
+
+def count_pages(res: Dict[str, Any]) -> int:
+    # events fields (aliased windows included) in a reportData.report response.
+    report = ((res.get("data") or {}).get("reportData") or {}).get("report")
+    if not isinstance(report, dict):
+        return 0
+    return sum(1 for v in report.values() if isinstance(v, dict) and "nextPageTimestamp" in v)
+
+
+class Telemetry:
+    # Per call site (see call_site) request counts, latency, bytes, event pages,
+    # retries and 429s. Latency covers retries and backoff but not pacing waits,
+    # which are counted separately; cache hits are only counted.
+    def __init__(self):
+        self.started = time.monotonic()
+        self.sites: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _site(self, site: str) -> Dict[str, Any]:
+        entry = self.sites.get(site)
+        if entry is None:
+            entry = self.sites[site] = {
+                "requests": 0, "cached": 0, "errors": 0, "pages": 0, "retries": 0, "rate_limited": 0,
+                "bytes_out": 0, "bytes_in": 0, "bytes_decoded": 0, "wait": 0.0, "latencies": [],
+            }
+        return entry
+
+    def cached(self, site: str):
+        with self._lock:
+            self._site(site)["cached"] += 1
+
+    def record(self, site: str, seconds: float, bytes_decoded: int, pages: int, stats: Dict[str, float],
+               error: bool = False):
+        with self._lock:
+            entry = self._site(site)
+            entry["requests"] += 1
+            entry["errors"] += int(error)
+            entry["pages"] += pages
+            entry["bytes_decoded"] += bytes_decoded
+            for key in ("retries", "rate_limited", "bytes_out", "bytes_in", "wait"):
+                entry[key] += stats[key]
+            entry["latencies"].append(seconds - stats["wait"])
+
+    def report(self, points: Dict[str, float]) -> Dict[str, Any]:
+        # `points` is the per-site split of WCL's point total from the RateLimiter.
+        sites: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for site, entry in self.sites.items():
+                out = {k: v for k, v in entry.items() if k not in ("wait", "latencies")}
+                lat = sorted(entry["latencies"])
+                out["latency_ms"] = {
+                    "p50": round(percentile(lat, 0.50) * 1000, 1) if lat else None,
+                    "p95": round(percentile(lat, 0.95) * 1000, 1) if lat else None,
+                    "max": round(lat[-1] * 1000, 1) if lat else None,
+                    "total": round(sum(lat) * 1000, 1),
+                }
+                out["wait_ms"] = round(entry["wait"] * 1000, 1)
+                out["points"] = round(points.get(site, 0.0), 1)
+                sites[site] = out
+        order = sorted(sites, key=lambda s: -sites[s]["latency_ms"]["total"])
+        totals = {k: sum(sites[s][k] for s in order) for k in (
+            "requests", "cached", "errors", "pages", "retries", "rate_limited", "bytes_out", "bytes_in", "bytes_decoded", "points")}
+        totals["points"] = round(totals["points"], 1)
+        return {
+            "seconds": round(time.monotonic() - self.started, 3),
+            "totals": totals,
+            "sites": {s: sites[s] for s in order},
+        }
+
+
+class WclClient:
+    def __init__(self, base_url: str = BASE_URL, max_idle: int = 8, timeout: float = 120.0,
+                 cache: Optional[DiskCache] = None, event_slices: int = EVENT_SLICES_DEFAULT,
+                 recorder: Optional[ResponseLog] = None):
+        self.base_url = base_url.rstrip("/")
+        self.pool = ConnectionPool(self.base_url, max_idle=max_idle, timeout=timeout)
+        self.cache = cache
+        self.recorder = recorder
+        self.event_slices = max(1, int(event_slices))
+        self.token_store: Optional[TokenStore] = None
+        self._token: Optional[Dict[str, Any]] = None
+        self._token_lock = threading.Lock()
+        self._retired_tokens: set = set()
+        self.limiter = RateLimiter()
+        self.telemetry = Telemetry()
+
+    def request(self, path: str, body: bytes, headers: Dict[str, str],
+                stats: Optional[Dict[str, float]] = None) -> bytes:
+        headers = dict(headers)
+        headers.setdefault("Accept-Encoding", "gzip")
+        headers.setdefault("Connection", "keep-alive")
+        last_error: Optional[Exception] = None
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(RETRY_BACKOFF_SECONDS * (2 ** (attempt - 1)))
+                if stats is not None:
+                    stats["retries"] += 1
+            if stats is not None:
+                stats["bytes_out"] += len(body)
+            conn = self.pool.acquire()
+            try:
+                conn.request("POST", path, body=body, headers=headers)
+                resp = conn.getresponse()
+                raw = resp.read()
+            except (http.client.HTTPException, OSError) as exc:
+                # Usually a keep-alive connection the server already dropped.
+                conn.close()
+                last_error = exc
+                continue
+            self.pool.release(conn, not resp.will_close)
+            if stats is not None:
+                stats["bytes_in"] += len(raw)
+            data = decode_body(raw, resp.getheader("Content-Encoding"))
+            if resp.status in RETRY_STATUSES:
+                last_error = RuntimeError(f"HTTP {resp.status} from {path}")
+                continue
+            if resp.status >= 400:
+                detail = data.decode("utf-8", "replace")[:300]
+                raise WclHttpError(resp.status, f"HTTP {resp.status} from {path}: {detail}")
+            return data
+        raise RuntimeError(f"Request to {path} failed after {MAX_RETRIES + 1} attempts: {last_error}")
+
+    def fetch_token(self) -> Dict[str, Any]:
+        body = urllib.parse.urlencode({
+            "grant_type": "client_credentials",
+            "client_id": get_env("WCL_CLIENT_ID"),
+            "client_secret": get_env("WCL_CLIENT_SECRET"),
+        }).encode("utf-8")
+        data = self.request(TOKEN_PATH, body, {"Content-Type": "application/x-www-form-urlencoded"})
+        return json.loads(data.decode("utf-8"))
+
+    def get_token(self, force_refresh: bool = False) -> str:
+        with self._token_lock:
+            entry = self._token
+            if entry is not None and not force_refresh and time.time() < entry["refresh_at"]:
+                return entry["access_token"]
+            if self.token_store is None:
+                self.token_store = TokenStore.from_env(f"{self.base_url}|{get_env('WCL_CLIENT_ID')}")
+            store = self.token_store
+            with file_lock(store.lock_path):
+                stored = None if force_refresh else store.load()
+                if stored is None:
+                    res = self.fetch_token()
+                    stored = store.save(res["access_token"], res.get("expires_in") or TOKEN_LIFETIME_DEFAULT_SECONDS)
+            refresh_at = float(stored["expires_at"]) - TOKEN_REFRESH_MARGIN_SECONDS
+            if entry is not None and entry["access_token"] != stored["access_token"]:
+                self._retired_tokens.add(entry["access_token"])
+            self._token = {"access_token": stored["access_token"], "refresh_at": refresh_at}
+            return stored["access_token"]
+
+    def _authorize(self, token: str) -> str:
+        # Scripts fetch one token at startup and pass it to every call. Swap in the
+        # current token once it is close to expiry or has been replaced.
+        entry = self._token
+        if token in self._retired_tokens:
+            return self.get_token()
+        if entry is not None and token == entry["access_token"] and time.time() >= entry["refresh_at"]:
+            return self.get_token()
+        return token
+
+    def _post_gql(self, token: str, body: bytes, site: str, stats: Dict[str, float]) -> bytes:
+        token = self._authorize(token)
+        if self.limiter.claim_poll():
+            try:
+                self.poll_rate_limit(token)
+            finally:
+                self.limiter.release_poll()
+        waits = 0
+        reauthorized = False
+        while True:
+            delay = self.limiter.wait_time()
+            if delay > 0:
+                time.sleep(delay)
+                stats["wait"] += delay
+            try:
+                data = self.request(API_PATH, body, {"Content-Type": "application/json", "Authorization": f"Bearer {token}"},
+                                    stats)
+            except WclHttpError as exc:
+                if exc.status == 401 and not reauthorized:
+                    # The token was revoked mid-run; force a new exchange unless
+                    # another thread already replaced it.
+                    reauthorized = True
+                    if token not in self._retired_tokens:
+                        self.get_token(force_refresh=True)
+                    token = self._authorize(token)
+                    continue
+                if exc.status != 429 or waits >= RATE_LIMITED_MAX_WAITS:
+                    raise
+                waits += 1
+                stats["rate_limited"] += 1
+                self.poll_rate_limit(token)
+                self.limiter.rate_limited()
+                continue
+            self.limiter.record(current_stage(), site)
+            return data
+
+    def poll_rate_limit(self, token: str) -> Optional[Dict[str, Any]]:
+        body = json.dumps({"query": RATE_LIMIT_QUERY, "variables": {}}).encode("utf-8")
+        try:
+            data = self.request(API_PATH, body, {"Content-Type": "application/json", "Authorization": f"Bearer {token}"})
+            rate = json.loads(data.decode("utf-8"))["data"]["rateLimitData"]
+            self.limiter.update(rate)
+        except (RuntimeError, KeyError, TypeError, ValueError):
+            self.limiter.poll_failed()
+            return None
+        return rate
+
+    def gql(self, token: str, query: str, variables: Optional[Dict[str, Any]] = None,
+            use_cache: bool = True, allow_errors: bool = False) -> Dict[str, Any]:
+        # allow_errors returns partial data (for example one private report in an
+        # aliased batch) instead of raising; such responses are never cached.
+        cache = self.cache if use_cache else None
+        site = call_site()
+        if cache is not None:
+            cached = cache.get(query, variables)
+            if cached is not None:
+                if self.recorder is not None:
+                    self.recorder.put(query, variables, cached)
+                self.telemetry.cached(site)
+                return cached
+        body = json.dumps({"query": query, "variables": variables or {}}).encode("utf-8")
+        stats = {"retries": 0, "rate_limited": 0, "wait": 0.0, "bytes_out": 0, "bytes_in": 0}
+        started = time.monotonic()
+        try:
+            data = self._post_gql(token, body, site, stats)
+        except Exception:
+            self.telemetry.record(site, time.monotonic() - started, 0, 0, stats, error=True)
+            raise
+        res = json.loads(data.decode("utf-8"))
+        self.telemetry.record(site, time.monotonic() - started, len(data), count_pages(res), stats,
+                              error=bool(res.get("errors")))
+        if self.recorder is not None:
+            self.recorder.put(query, variables, res)
+        if res.get("errors"):
+            if allow_errors and res.get("data"):
+                return res
+            raise WclGraphQLError(res["errors"])
+        if cache is not None:
+            cache.put(query, variables, res)
+        return res
+
+    def close(self):
+        self.pool.close()
+
+
+_default_client: Optional[WclClient] = None
+_default_lock = threading.Lock()
+
+
+def default_client() -> WclClient:
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = WclClient(env_base_url(), cache=DiskCache.from_env(), event_slices=env_event_slices(),
+                                        recorder=ResponseLog.from_env())
+        return _default_client
+
+
+def env_base_url() -> str:
+    return os.environ.get("WCL_BASE_URL") or BASE_URL
+
+
+def env_event_slices() -> int:
+    return int(os.environ.get("WCL_EVENT_SLICES") or EVENT_SLICES_DEFAULT)
+
+
+def configure(use_cache: bool = True, cache_dir: Optional[str] = None, event_slices: Optional[int] = None,
+              base_url: Optional[str] = None) -> WclClient:
+    # Replaces the shared client; call once from main() before any requests.
+    global _default_client
+    cache = DiskCache.from_env(cache_dir) if use_cache else None
+    if event_slices is None:
+        event_slices = env_event_slices()
+    with _default_lock:
+        if _default_client is not None:
+            _default_client.close()
+        _default_client = WclClient(base_url or env_base_url(), cache=cache, event_slices=event_slices,
+                                    recorder=ResponseLog.from_env())
+        return _default_client
+
+
+def get_token() -> str:
+    return default_client().get_token()
+
+
+def gql(token: str, query: str, variables: Optional[Dict[str, Any]] = None,
+        use_cache: bool = True, allow_errors: bool = False) -> Dict[str, Any]:
+    return default_client().gql(token, query, variables, use_cache=use_cache, allow_errors=allow_errors)
+
+
+def cache_lookup(query: str, variables: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    cache = default_client().cache
+    return cache.get(query, variables) if cache is not None else None
+
+
+def cache_store(query: str, variables: Optional[Dict[str, Any]], response: Dict[str, Any]):
+    # Also recorded, so a replay can answer the query even if this run never sent it.
+    client = default_client()
+    if client.cache is not None:
+        client.cache.put(query, variables, response)
+    if client.recorder is not None:
+        client.recorder.put(query, variables, response)
+
+
+def rate_limit_report(token: Optional[str] = None) -> Dict[str, Any]:
+    # Final poll so the last batch of requests is attributed before reporting;
+    # skipped when every response came from the cache.
+    client = default_client()
+    if token is not None and client.limiter.stage_requests:
+        client.poll_rate_limit(token)
+    return client.limiter.report()
+
+
+def format_rate_report(report: Dict[str, Any]) -> str:
+    if report.get("limitPerHour") is None:
+        return "WCL points: no rate limit data (all responses cached?)"
+    lines = [
+        f"WCL points: {report['pointsSpentThisHour']:.0f}/{report['limitPerHour']:.0f} this hour, "
+        f"reset in {report['pointsResetIn'] / 60:.0f} min"
+    ]
+    for stage, info in report["stages"].items():
+        lines.append(f"  {stage}: {info['requests']} requests, ~{info['points']} points")
+    return "\n".join(lines)
+
+
+def metrics_report() -> Dict[str, Any]:
+    # Call after rate_limit_report(token) so its final poll has attributed points.
+    client = default_client()
+    return client.telemetry.report(client.limiter.points_by_site())
+
+
+def write_metrics_report(path: str) -> Dict[str, Any]:
+    report = metrics_report()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def format_metrics_report(report: Dict[str, Any]) -> str:
+    totals = report["totals"]
+    lines = [
+        f"GraphQL: {totals['requests']} requests ({totals['cached']} cached), {totals['pages']} event pages, "
+        f"{totals['bytes_in'] / 1e6:.1f} MB in, {totals['retries']} retries, {totals['rate_limited']} rate limited "
+        f"in {report['seconds']:.1f}s"
+    ]
+    for site, info in report["sites"].items():
+        lat = info["latency_ms"]
+        timing = f"p50 {lat['p50']} ms, p95 {lat['p95']} ms, max {lat['max']} ms" if info["requests"] else "cache only"
+        lines.append(f"  {site}: {info['requests']} requests, {info['pages']} pages, {timing}, "
+                     f"{info['bytes_in'] / 1e6:.2f} MB, ~{info['points']} points")
+    return "\n".join(lines)
+
+
+def _events_page(token: str, query: str, variables: Dict[str, Any], start: Optional[float]) -> Tuple[List[Dict[str, Any]], Optional[float]]:
+    res = gql(token, query, dict(variables, start=start))
+    ev = res["data"]["reportData"]["report"]["events"]
+    return ev.get("data") or [], ev.get("nextPageTimestamp")
+
+
+# Turns one page of raw events into whatever the caller keeps (FightEvents.from_events
+# for columns); the page's JSON is dropped right after.
+PageDecoder = Callable[[List[Dict[str, Any]]], Any]
+
+
+def _walk_events(token: str, query: str, variables: Dict[str, Any], start: Optional[float],
+                 stage: Optional[str] = None, site: Optional[str] = None, before: Optional[float] = None,
+                 decode: Optional[PageDecoder] = None) -> List[Any]:
+    # Decoded pages in order; `before` drops events at or after that time from each page.
+    pages: List[Any] = []
+    with rate_stage(stage) if stage else nullcontext(), gql_site(site) if site else nullcontext():
+        while True:
+            data, start = _events_page(token, query, variables, start)
+            if before is not None:
+                data = [e for e in data if "timestamp" not in e or e["timestamp"] < before]
+            pages.append(decode(data) if decode else data)
+            if not start:
+                break
+    return pages
+
+
+def _joined(pages: List[Any], decode: Optional[PageDecoder]) -> List[Any]:
+    return pages if decode else [e for page in pages for e in page]
+
+
+def slice_bounds(start: float, end: float, first_page_span: Optional[float], slices: int) -> List[float]:
+    # Splits [start, end] into at most `slices` pieces, no more than the remaining pages
+    # suggest at the density of the first page. Returns the slice starts plus `end`.
+    count = slices
+    if first_page_span and first_page_span > 0:
+        count = min(count, math.ceil((end - start) / first_page_span))
+    count = max(1, count)
+    bounds: List[float] = []
+    for k in range(count):
+        b = start + (end - start) * k // count
+        if not bounds or b > bounds[-1]:
+            bounds.append(b)
+    return bounds + [end]
+
+
+def paginate_events(token: str, query: str, variables: Dict[str, Any], start: Optional[float] = None,
+                    end: Optional[float] = None, slices: Optional[int] = None,
+                    decode: Optional[PageDecoder] = None) -> List[Any]:
+    # Follows nextPageTimestamp for a reportData.report.events query that takes $start
+    # (and $end when `end` is given). If the first page is not the last and the end is
+    # known, the rest of the range is split into time slices paged concurrently. Slice k
+    # keeps only events before slice k+1 starts, which is exactly the part the serial
+    # walk would have read from it, so the merged list is identical. With `decode`, the
+    # decoded pages are returned in order instead of the events.
+    if end is not None:
+        variables = dict(variables, end=end)
+    if slices is None:
+        slices = default_client().event_slices
+    data, next_start = _events_page(token, query, variables, start)
+    pages = [decode(data) if decode else data]
+    if not next_start:
+        return _joined(pages, decode)
+    if slices <= 1 or end is None or next_start >= end:
+        return _joined(pages + _walk_events(token, query, variables, next_start, decode=decode), decode)
+
+    span = next_start - start if start is not None else None
+    bounds = slice_bounds(next_start, end, span, slices)
+    stage, site = current_stage(), call_site()
+    jobs = [(bounds[k], bounds[k + 1], k == len(bounds) - 2) for k in range(len(bounds) - 1)]
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        futs = [
+            pool.submit(
+                _walk_events, token, query, variables if last else dict(variables, end=hi), lo, stage, site,
+                None if last else hi, decode,
+            )
+            for lo, hi, last in jobs
+        ]
+        for fut in futs:
+            pages.extend(fut.result())
+    return _joined(pages, decode)
+
+
+def merge_windows(times: List[float], before: float, after: float,
+                  lo: Optional[float] = None, hi: Optional[float] = None) -> List[Tuple[float, float]]:
+    # [t - before, t + after] around every time, clamped to [lo, hi], with overlapping
+    # or touching intervals merged. Returned sorted and disjoint.
+    out: List[Tuple[float, float]] = []
+    for t in sorted(times):
+        start, end = t - before, t + after
+        if lo is not None:
+            start = max(start, lo)
+        if hi is not None:
+            end = min(end, hi)
+        if start > end:
+            continue
+        if out and start <= out[-1][1]:
+            if end > out[-1][1]:
+                out[-1] = (out[-1][0], end)
+        else:
+            out.append((start, end))
+    return out
+
+
+def fetch_event_windows(token: str, report_code: str, fight_id: int, data_type: str,
+                        windows: List[Tuple[float, float]], extra_args: str = "useAbilityIDs: true",
+                        batch_size: int = EVENT_WINDOW_BATCH_SIZE, decode: Optional[PageDecoder] = None) -> List[Any]:
+    # Events of one fight restricted to disjoint [start, end] windows (see merge_windows),
+    # in timestamp order. Windows are requested as aliased events fields, batch_size per
+    # query; a window that spans several pages is continued in a later batch. `decode`
+    # works as in paginate_events.
+    per_window: List[List[Any]] = [[] for _ in windows]
+    pending = [(i, start, end) for i, (start, end) in enumerate(windows)]
+    while pending:
+        batch, pending = pending[:batch_size], pending[batch_size:]
+        fields = " ".join(
+            f"w{n}: events(dataType: {data_type}, fightIDs: [{int(fight_id)}], "
+            f"startTime: {start}, endTime: {end}, {extra_args}) {{ data nextPageTimestamp }}"
+            for n, (_, start, end) in enumerate(batch)
+        )
+        query = f"query {{ reportData {{ report(code: {json.dumps(report_code)}) {{ {fields} }} }} }}"
+        report = gql(token, query)["data"]["reportData"]["report"]
+        for n, (i, _, end) in enumerate(batch):
+            ev = report.get(f"w{n}") or {}
+            data = ev.get("data") or []
+            per_window[i].append(decode(data) if decode else data)
+            next_start = ev.get("nextPageTimestamp")
+            if next_start:
+                pending.append((i, next_start, end))
+    return _joined([page for pages in per_window for page in pages], decode)
@@ -0,0 +1,278 @@
+import abc
+import argparse
+import json
+import os
+import sys
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+
+import wcl_client
+from wcl_client import (
+    fetch_event_windows, format_metrics_report, format_rate_report, get_token, merge_windows, rate_limit_report, rate_stage,
+    write_metrics_report,
+)
+from wcl_event_store import MISSING, EventStore, FightEvents, load_fight_events
+from wcl_timers import fetch_casts, get_fight_info, get_fight_infos
+
+# HP samples are fetched with the target's resources so hit points are on every event.
+HP_EVENT_ARGS = "useAbilityIDs: true, includeResources: true"
+
+# (sourceID, spell ids); an empty spell list means every cast of the source.
+CastRequest = Tuple[int, List[int]]
+# Run when --analyses is not given; followups/transitions need their own options.
+DEFAULT_ANALYSES = ("hp-at-cast", "lod-party-context")
+
+
+class Fight:
+    # Everything downloaded for one (report, fight), shared by every analyzer.
+    def __init__(self, code: str, fight_id: int, report: Dict[str, Any]):
+        self.code = code
+        self.fight_id = fight_id
+        self.report = report
+        self.info = report["fights"][0]
+        self.details = report["playerDetails"]["data"]["playerDetails"]
+        self.casts: Optional[FightEvents] = None
+        self.healing: Optional[FightEvents] = None
+        self.damage_taken: Optional[FightEvents] = None
+
+    def casts_for(self, source_id: int, spell_ids: List[int]) -> FightEvents:
+        # The casts one request asked for, out of the union downloaded for the fight.
+        spells = set(spell_ids)
+        rows = self.casts.rows("sourceID", "abilityGameID")
+        if not spells:
+            return self.casts.select(i for i, (src, _) in enumerate(rows) if src == source_id)
+        return self.casts.select(i for i, (src, sid) in enumerate(rows) if src == source_id and sid in spells)
+
+
+class Analyzer(abc.ABC):
+    # One analysis over many fights. Per fight the engine asks for the casts it needs,
+    # downloads the union for all analyzers once, then calls consume() per request.
+    name = ""
+    # > 0: also wants Healing/DamageTaken samples within this many ms of its casts.
+    hp_window_ms = 0
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "Analyzer":
+        return cls()
+
+    def cast_requests(self, fight: Fight) -> List[CastRequest]:
+        return []
+
+    def hp_times(self, casts: FightEvents) -> List[int]:
+        return [ts for ts in casts["timestamp"] if ts != MISSING]
+
+    @abc.abstractmethod
+    def consume(self, fight: Fight, source_id: int, casts: FightEvents):
+        pass
+
+    def fail(self, code: str, fight_id: int, source_id: Optional[int], exc: Exception):
+        # Default is to stop the run; analyzers that report per-log failures override this.
+        raise exc
+
+    @abc.abstractmethod
+    def result(self) -> Dict[str, Any]:
+        pass
+
+
+ANALYZERS: Dict[str, Type[Analyzer]] = {}
+
+
+def register(cls: Type[Analyzer]) -> Type[Analyzer]:
+    ANALYZERS[cls.name] = cls
+    return cls
+
+
+def union_windows(windows: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    out: List[Tuple[float, float]] = []
+    for start, end in sorted(windows):
+        if out and start <= out[-1][1]:
+            out[-1] = (out[-1][0], max(out[-1][1], end))
+        else:
+            out.append((start, end))
+    return out
+
+
+def sorted_samples(pairs: List[Tuple[int, float]]) -> Tuple[array, List[float]]:
+    # (timestamp, value) pairs as parallel columns sorted by time (stable for equal times).
+    pairs.sort(key=lambda x: x[0])
+    return array("q", (t for t, _ in pairs)), [v for _, v in pairs]
+
+
+def nearest_batch(times: Sequence[int], queries: Sequence[int]) -> List[Tuple[int, int]]:
+    # Index of the closest sample in sorted `times` and its distance, for every query;
+    # (-1, -1) when there are no samples. Ties go to the later sample, like min() over
+    # [times[bisect_left(q)], times[bisect_left(q) - 1]]. One merge pass over the queries
+    # in time order instead of a bisect (and list rebuild) per lookup.
+    n = len(times)
+    out = [(-1, -1)] * len(queries)
+    if n == 0:
+        return out
+    i = 0
+    for q_idx in sorted(range(len(queries)), key=queries.__getitem__):
+        q = queries[q_idx]
+        while i < n and times[i] < q:
+            i += 1
+        if i == n:
+            out[q_idx] = (n - 1, q - times[n - 1])
+        elif i > 0 and q - times[i - 1] < times[i] - q:
+            out[q_idx] = (i - 1, q - times[i - 1])
+        else:
+            out[q_idx] = (i, times[i] - q)
+    return out
+
+
+def load_fight(token: str, code: str, fight_id: int, infos: Dict[Tuple[str, int], Dict[str, Any]]) -> Fight:
+    report = infos.get((code, fight_id))
+    if report is None:
+        with rate_stage("metadata"):
+            report = get_fight_info(token, code, fight_id)
+    return Fight(code, fight_id, report)
+
+
+def download_fight(token: str, fight: Fight, requests: Dict[Analyzer, List[CastRequest]], store: Optional[EventStore]):
+    # One casts download covering every request (filtered by source when they agree),
+    # then one windowed HP download covering every analyzer that wants samples.
+    sources = {src for reqs in requests.values() for src, _ in reqs}
+    spells = list(dict.fromkeys(sid for reqs in requests.values() for _, ids in reqs for sid in ids))
+    if any(not ids for reqs in requests.values() for _, ids in reqs):
+        spells = []
+    source = next(iter(sources)) if len(sources) == 1 else None
+    start_time, end_time = int(fight.info["startTime"]), int(fight.info["endTime"])
+    with rate_stage("casts"):
+        fight.casts = load_fight_events(
+            store, fight.code, fight.fight_id, "Casts",
+            lambda: FightEvents.concat(fetch_casts(
+                token, fight.code, fight.fight_id, source, spells, start_time, end_time, decode=FightEvents.from_events,
+            )),
+            variant=f"source={source};spells={spells}",
+        )
+
+    windows: List[Tuple[float, float]] = []
+    for analyzer, reqs in requests.items():
+        if analyzer.hp_window_ms <= 0:
+            continue
+        w = analyzer.hp_window_ms
+        for src, ids in reqs:
+            times = analyzer.hp_times(fight.casts_for(src, ids))
+            # +1 so a sample exactly w ms after a cast is kept whether endTime is inclusive or not.
+            windows.extend(merge_windows(times, w, w + 1, start_time, end_time))
+    windows = union_windows(windows)
+    if not windows:
+        fight.healing = fight.damage_taken = FightEvents.from_events([])
+        return
+    variant = f"windows={windows}"
+    with rate_stage("events"):
+        fight.healing = load_fight_events(
+            store, fight.code, fight.fight_id, "Healing",
+            lambda: FightEvents.concat(fetch_event_windows(
+                token, fight.code, fight.fight_id, "Healing", windows, extra_args=HP_EVENT_ARGS, decode=FightEvents.from_events,
+            )),
+            variant=variant,
+        )
+        fight.damage_taken = load_fight_events(
+            store, fight.code, fight.fight_id, "DamageTaken",
+            lambda: FightEvents.concat(fetch_event_windows(
+                token, fight.code, fight.fight_id, "DamageTaken", windows, extra_args=HP_EVENT_ARGS, decode=FightEvents.from_events,
+            )),
+            variant=variant,
+        )
+
+
+def run_engine(token: str, fights: List[Tuple[str, int]], analyzers: List[Analyzer], store: Optional[EventStore] = None):
+    # Fights are visited in order (duplicates once); each is downloaded at most once
+    # no matter how many analyzers use it.
+    fights = list(dict.fromkeys((str(code), int(fight_id)) for code, fight_id in fights))
+    with rate_stage("metadata"):
+        infos = get_fight_infos(token, fights)
+
+    for code, fight_id in fights:
+        try:
+            fight = load_fight(token, code, fight_id, infos)
+        except Exception as exc:
+            for analyzer in analyzers:
+                analyzer.fail(code, fight_id, None, exc)
+            continue
+
+        requests = {a: a.cast_requests(fight) for a in analyzers}
+        requests = {a: reqs for a, reqs in requests.items() if reqs}
+        if not requests:
+            continue
+        try:
+            download_fight(token, fight, requests, store)
+        except Exception as exc:
+            for analyzer, reqs in requests.items():
+                for src, _ in reqs:
+                    analyzer.fail(code, fight_id, src, exc)
+            continue
+
+        for analyzer, reqs in requests.items():
+            for src, ids in reqs:
+                try:
+                    analyzer.consume(fight, src, fight.casts_for(src, ids))
+                except Exception as exc:
+                    analyzer.fail(code, fight_id, src, exc)
+
+
+def parse_reports(value: str) -> List[Tuple[str, int]]:
+    out = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        code, fight_id = part.split(":", 1)
+        out.append((code.strip(), int(fight_id)))
+    return out
+
+
+def main():
+    # Importing the analysis scripts registers their analyzers.
+    import wcl_hp_estimate
+    import wcl_lod_party_context  # noqa: F401
+    import wcl_sequence_analysis  # noqa: F401
+
+    parser = argparse.ArgumentParser(description="Run several log analyses with one download per fight")
+    parser.add_argument(
+        "--analyses", default=",".join(DEFAULT_ANALYSES),
+        help=f"Comma-separated analyzers: {', '.join(ANALYZERS)} (default: {', '.join(DEFAULT_ANALYSES)})",
+    )
+    parser.add_argument("--reports", default="", help="Comma-separated code:fightId list (default: REPORTS in wcl_hp_estimate.py)")
+    parser.add_argument("--class-name", default="Paladin", help="followups: WCL class name of the player to analyze")
+    parser.add_argument("--spec-name", default="Holy", help="followups: WCL spec name of the player to analyze")
+    parser.add_argument("--trigger", default="", help="followups: trigger spell id, or comma-separated ids")
+    parser.add_argument("--followups", default="", help="followups: comma-separated followup spell ids (default: any spell)")
+    parser.add_argument("--max-gap-ms", type=int, default=None, help="followups: maximum time between trigger and followup")
+    parser.add_argument("--out", default="", help="Optional path to write JSON output")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk response cache and event store")
+    parser.add_argument("--cache-dir", default=None, help="Optional directory for the response cache and event store")
+    parser.add_argument("--metrics-out", default="", help="Optional path to write per-call-site GraphQL telemetry JSON")
+    parser.add_argument("--base-url", default=None, help="WCL API host (default WCL_BASE_URL or warcraftlogs.com)")
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.analyses.split(",") if n.strip()]
+    unknown = [n for n in names if n not in ANALYZERS]
+    if unknown:
+        raise RuntimeError(f"Unknown analyzers: {', '.join(unknown)}")
+    analyzers = [ANALYZERS[n].from_args(args) for n in names]
+    fights = parse_reports(args.reports) if args.reports else list(wcl_hp_estimate.REPORTS)
+
+    wcl_client.configure(use_cache=not args.no_cache, cache_dir=args.cache_dir, base_url=args.base_url)
+    store = None
+    if not args.no_cache:
+        store = EventStore.from_env(os.path.join(args.cache_dir, "events") if args.cache_dir else None)
+    token = get_token()
+    run_engine(token, fights, analyzers, store)
+
+    result = {a.name: a.result() for a in analyzers}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+    print(format_rate_report(rate_limit_report(token)), file=sys.stderr)
+    if args.metrics_out:
+        print(format_metrics_report(write_metrics_report(args.metrics_out)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    # The analysis scripts register into the importable wcl_engine module, not __main__.
+    import wcl_engine
+    wcl_engine.main()
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+from wcl_cache import CACHE_DIR_DEFAULT, EVENTS_MAX_MB_DEFAULT, evict_lru, scan_files, write_atomic
+
+# One file per (report, fight, dataType): a small JSON header followed by one
+# contiguous int64 column per field, so a reload is a single mmap and no parsing.
+# hitPoints/maxHitPoints are the event's own fields; the resolved pair also falls
+# back to the target/resource shapes (see event_hit_points) for analyses that want it.
+MAGIC = b"WCLCOL1\n"
+COLUMNS = (
+    "timestamp", "abilityGameID", "sourceID", "targetID", "hitPoints", "maxHitPoints",
+    "resolvedHitPoints", "resolvedMaxHitPoints",
+)
+TYPECODE = "q"
+ITEM_SIZE = 8
+# WCL uses -1 for "no target", so missing fields get a value no event can carry.
+MISSING = -(2 ** 63)
+
+
+def event_hit_points(ev: Dict[str, Any]) -> Tuple[Optional[float], Optional[float]]:
+    # Target HP as reported by the event, falling back to older/alternate shapes;
+    # (None, None) when no shape has both values.
+    hp = ev.get("hitPoints") or ev.get("targetHitPoints")
+    mhp = ev.get("maxHitPoints") or ev.get("targetMaxHitPoints")
+    if hp is not None and mhp:
+        return hp, mhp
+    for key in ("targetResources", "resources"):
+        arr = ev.get(key)
+        if not isinstance(arr, list):
+            continue
+        for r in arr:
+            if not isinstance(r, dict):
+                continue
+            # Health is usually type 0 on WCL resources
+            amount = r.get("amount")
+            maximum = r.get("max") or r.get("maximum")
+            if r.get("type") == 0 and amount is not None and maximum:
+                return amount, maximum
+    return None, None
+
+
+def _int_or_missing(value: Any) -> int:
+    if value is None:
+        return MISSING
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING
+
+
+class FightEvents:
+    # Column views over one fight's events. Columns are either arrays (fresh
+    # download) or memoryviews into a read-only mmap (loaded from the store).
+    def __init__(self, columns: Dict[str, Sequence[int]]):
+        self.columns = columns
+        self.count = len(columns[COLUMNS[0]]) if columns else 0
+
+    @classmethod
+    def from_events(cls, events: Iterable[Dict[str, Any]]) -> "FightEvents":
+        cols = {name: array(TYPECODE) for name in COLUMNS}
+        ts, ability, source, target, hp, mhp, any_hp, any_mhp = (cols[name] for name in COLUMNS)
+        for ev in events:
+            ts.append(_int_or_missing(ev.get("timestamp")))
+            ability.append(_int_or_missing(ev.get("abilityGameID")))
+            source.append(_int_or_missing(ev.get("sourceID")))
+            target.append(_int_or_missing(ev.get("targetID")))
+            hp.append(_int_or_missing(ev.get("hitPoints")))
+            mhp.append(_int_or_missing(ev.get("maxHitPoints")))
+            ev_hp, ev_mhp = event_hit_points(ev)
+            any_hp.append(_int_or_missing(ev_hp))
+            any_mhp.append(_int_or_missing(ev_mhp))
+        return cls(cols)
+
+    @classmethod
+    def concat(cls, parts: Iterable["FightEvents"]) -> "FightEvents":
+        # Joins pages decoded as they arrived (see the `decode` argument of
+        # paginate_events), so a fetch never holds more than one page of JSON.
+        cols = {name: array(TYPECODE) for name in COLUMNS}
+        for part in parts:
+            for name, col in cols.items():
+                col.extend(part.columns[name])
+        return cls(cols)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, name: str) -> Sequence[int]:
+        return self.columns[name]
+
+    def rows(self, *names: str) -> Iterator[Tuple[int, ...]]:
+        return zip(*(self.columns[name] for name in names))
+
+    def select(self, indices: Iterable[int]) -> "FightEvents":
+        keep = list(indices)
+        return FightEvents({name: array(TYPECODE, (col[i] for i in keep)) for name, col in self.columns.items()})
+
+    def to_bytes(self) -> bytes:
+        header = json.dumps({
+            "count": self.count,
+            "columns": list(COLUMNS),
+            "typecode": TYPECODE,
+            "byteorder": sys.byteorder,
+        }).encode("utf-8")
+        # Pad so every column starts on an 8-byte boundary.
+        prefix_len = len(MAGIC) + 4 + len(header)
+        header += b" " * (-prefix_len % ITEM_SIZE)
+        parts = [MAGIC, struct.pack("<I", len(header)), header]
+        for name in COLUMNS:
+            col = self.columns[name]
+            parts.append(col.tobytes() if isinstance(col, array) else bytes(col))
+        return b"".join(parts)
+
+
+def _map_file(path: str) -> Optional[FightEvents]:
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < len(MAGIC) + 4:
+                return None
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if mm[:len(MAGIC)] != MAGIC:
+        return None
+    offset = len(MAGIC)
+    (header_len,) = struct.unpack("<I", mm[offset:offset + 4])
+    offset += 4
+    try:
+        header = json.loads(mm[offset:offset + header_len].decode("utf-8"))
+    except ValueError:
+        return None
+    offset += header_len
+    count = int(header.get("count", -1))
+    if (header.get("columns") != list(COLUMNS) or header.get("typecode") != TYPECODE
+            or header.get("byteorder") != sys.byteorder or count < 0
+            or size != offset + count * ITEM_SIZE * len(COLUMNS)):
+        return None
+    view = memoryview(mm)
+    cols: Dict[str, Sequence[int]] = {}
+    for name in COLUMNS:
+        end = offset + count * ITEM_SIZE
+        cols[name] = view[offset:end].cast(TYPECODE)
+        offset = end
+    return FightEvents(cols)
+
+
+class EventStore:
+    # Local columnar copy of fetched fight events, keyed by report, fight and
+    # dataType. Filtered downloads (one source, some spells) pass a variant so
+    # they never shadow the full event list. Capped like DiskCache: file mtime is
+    # the last use and the least recently used files go first.
+    def __init__(self, root: str, max_bytes: int = EVENTS_MAX_MB_DEFAULT * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+
+    @classmethod
+    def from_env(cls, root: Optional[str] = None) -> Optional["EventStore"]:
+        if os.environ.get("WCL_NO_CACHE"):
+            return None
+        root = root or os.path.join(os.environ.get("WCL_CACHE_DIR") or CACHE_DIR_DEFAULT, "events")
+        max_mb = float(os.environ.get("WCL_EVENTS_MAX_MB") or EVENTS_MAX_MB_DEFAULT)
+        return cls(root, int(max_mb * 1024 * 1024))
+
+    def path(self, code: str, fight_id: int, data_type: str, variant: str = "") -> str:
+        name = f"{int(fight_id)}-{data_type}"
+        if variant:
+            name += "-" + hashlib.sha256(variant.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.root, re.sub(r"[^\w-]", "_", code), name + ".col")
+
+    def load(self, code: str, fight_id: int, data_type: str, variant: str = "") -> Optional[FightEvents]:
+        path = self.path(code, fight_id, data_type, variant)
+        events = _map_file(path)
+        if events is not None:
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        return events
+
+    def save(self, code: str, fight_id: int, data_type: str, events: FightEvents, variant: str = ""):
+        path = self.path(code, fight_id, data_type, variant)
+        raw = events.to_bytes()
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        try:
+            write_atomic(path, raw)
+        except OSError:
+            # Another process may have the file mapped (Windows); it already has the data.
+            return
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, _, size in scan_files(self.root, ".col"))
+            else:
+                self._total_bytes += len(raw) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._total_bytes = evict_lru(scan_files(self.root, ".col"), self.max_bytes)
+
+
+def load_fight_events(store: Optional[EventStore], code: str, fight_id: int, data_type: str,
+                      fetch: Callable[[], FightEvents], variant: str = "") -> FightEvents:
+    if store is not None:
+        cached = store.load(code, fight_id, data_type, variant)
+        if cached is not None:
+            return cached
+    events = fetch()
+    if store is not None:
+        store.save(code, fight_id, data_type, events, variant)
+    return events
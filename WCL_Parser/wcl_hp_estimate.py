@@ -1,11 +1,12 @@
 import json
 import os
 import sys
-import urllib.parse
-import urllib.request
-from bisect import bisect_left
 from statistics import mean
 
+from wcl_client import get_token
+from wcl_engine import Analyzer, nearest_batch, register, run_engine, sorted_samples
+from wcl_event_store import MISSING, EventStore
+
 SPELLS = {
     85673: "Word of Glory",
     85222: "Light of Dawn",
@@ -24,62 +25,6 @@ REPORTS = [
 WINDOW_MS = 2000
 
 
-def get_env(name: str) -> str:
-    v = os.environ.get(name)
-    if not v:
-        raise RuntimeError(f"Missing env var: {name}")
-    return v
-
-
-def get_token() -> str:
-    body = urllib.parse.urlencode(
-        {
-            "grant_type": "client_credentials",
-            "client_id": get_env("WCL_CLIENT_ID"),
-            "client_secret": get_env("WCL_CLIENT_SECRET"),
-        }
-    ).encode("utf-8")
-    req = urllib.request.Request(
-        "https://www.warcraftlogs.com/oauth/token",
-        data=body,
-        headers={"Content-Type": "application/x-www-form-urlencoded"},
-    )
-    with urllib.request.urlopen(req) as resp:
-        return json.loads(resp.read().decode("utf-8"))["access_token"]
-
-
-def gql(token: str, query: str, variables=None):
-    payload = {"query": query, "variables": variables or {}}
-    req = urllib.request.Request(
-        "https://www.warcraftlogs.com/api/v2/client",
-        data=json.dumps(payload).encode("utf-8"),
-        headers={"Content-Type": "application/json", "Authorization": f"Bearer {token}"},
-    )
-    with urllib.request.urlopen(req) as resp:
-        data = json.loads(resp.read().decode("utf-8"))
-    if "errors" in data:
-        raise RuntimeError(f"GraphQL error: {data['errors']}")
-    return data
-
-
-def get_report_meta(token: str, code: str, fight_id: int):
-    query = """
-    query($code:String!, $fightIDs:[Int]) {
-      reportData {
-        report(code:$code) {
-          fights(fightIDs:$fightIDs) { id startTime endTime name }
-          playerDetails(fightIDs:$fightIDs, includeCombatantInfo:true)
-        }
-      }
-    }
-    """
-    res = gql(token, query, {"code": code, "fightIDs": [fight_id]})
-    report = res["data"]["reportData"]["report"]
-    fight = report["fights"][0]
-    details = report["playerDetails"]["data"]["playerDetails"]
-    return fight, details
-
-
 def pick_holy_paladin(details):
     healers = details.get("healers", [])
     pals = [h for h in healers if h.get("type") == "Paladin"]
@@ -101,152 +46,47 @@ def pick_holy_paladin(details):
     return pals[0]
 
 
-def fetch_cast_events(token: str, code: str, fight_id: int, source_id: int):
-    filter_expr = " or ".join([f"ability.id={sid}" for sid in SPELLS.keys()])
-    query = """
-    query($code:String!, $fightIDs:[Int], $sourceID:Int, $start:Float, $filter:String) {
-      reportData {
-        report(code:$code) {
-          events(dataType:Casts, fightIDs:$fightIDs, sourceID:$sourceID, startTime:$start, filterExpression:$filter, useAbilityIDs:true) {
-            data
-            nextPageTimestamp
-          }
-        }
-      }
-    }
-    """
-    out = []
-    start = None
-    while True:
-        res = gql(
-            token,
-            query,
-            {
-                "code": code,
-                "fightIDs": [fight_id],
-                "sourceID": source_id,
-                "start": start,
-                "filter": filter_expr,
-            },
-        )
-        ev = res["data"]["reportData"]["report"]["events"]
-        out.extend(ev.get("data", []))
-        start = ev.get("nextPageTimestamp")
-        if not start:
-            break
-    return out
-
-
-def fetch_events(token: str, code: str, fight_id: int, data_type: str, start_time: int, end_time: int):
-    query = """
-    query($code:String!, $fightIDs:[Int], $start:Float, $end:Float, $dtype:EventDataType!) {
-      reportData {
-        report(code:$code) {
-          events(dataType:$dtype, fightIDs:$fightIDs, startTime:$start, endTime:$end, useAbilityIDs:true, includeResources:true) {
-            data
-            nextPageTimestamp
-          }
-        }
-      }
-    }
-    """
-    out = []
-    start = start_time
-    while True:
-        res = gql(
-            token,
-            query,
-            {
-                "code": code,
-                "fightIDs": [fight_id],
-                "start": start,
-                "end": end_time,
-                "dtype": data_type,
-            },
-        )
-        ev = res["data"]["reportData"]["report"]["events"]
-        out.extend(ev.get("data", []))
-        start = ev.get("nextPageTimestamp")
-        if not start:
-            break
-    return out
+def build_hp_samples(*fights):
+    # targetID -> (timestamps, hpPercents), sorted by time
+    out = {}
+    for events in fights:
+        for ts, tid, hp, mhp in events.rows("timestamp", "targetID", "resolvedHitPoints", "resolvedMaxHitPoints"):
+            if tid == MISSING or ts == MISSING or hp == MISSING or mhp in (MISSING, 0):
+                continue
+            hp_pct = max(0.0, min(100.0, (hp / mhp) * 100.0))
+            out.setdefault(tid, []).append((ts, hp_pct))
 
+    return {tid: sorted_samples(pairs) for tid, pairs in out.items()}
 
-def hp_percent_from_event(ev):
-    # Common direct shapes
-    hp = ev.get("hitPoints") or ev.get("targetHitPoints")
-    mhp = ev.get("maxHitPoints") or ev.get("targetMaxHitPoints")
-    if hp is not None and mhp:
-        return max(0.0, min(100.0, (float(hp) / float(mhp)) * 100.0))
-
-    # resource arrays (shape varies)
-    for key in ("targetResources", "resources"):
-        arr = ev.get(key)
-        if not isinstance(arr, list):
-            continue
-        for r in arr:
-            if not isinstance(r, dict):
-                continue
-            # Health is usually type 0 on WCL resources
-            rtype = r.get("type")
-            amount = r.get("amount")
-            maximum = r.get("max") or r.get("maximum")
-            if rtype == 0 and amount is not None and maximum:
-                return max(0.0, min(100.0, (float(amount) / float(maximum)) * 100.0))
 
+def confidence(dt):
+    if dt <= 300:
+        return "high"
+    if dt <= 1000:
+        return "medium"
+    if dt <= WINDOW_MS:
+        return "low"
     return None
 
 
-def build_hp_samples(events):
-    # targetID -> list[(timestamp, hpPercent)] sorted
-    out = {}
-    for ev in events:
-        tid = ev.get("targetID")
-        ts = ev.get("timestamp")
-        if tid is None or ts is None:
+def nearest_hp_batch(hp_samples, target_ids, cast_times):
+    # (hp, confidence) for every (target, cast time), resolved with one merge pass per target.
+    out = [(None, "low")] * len(target_ids)
+    by_target = {}
+    for k, tid in enumerate(target_ids):
+        by_target.setdefault(tid, []).append(k)
+    for tid, idxs in by_target.items():
+        samples = hp_samples.get(tid)
+        if not samples:
             continue
-        hp_pct = hp_percent_from_event(ev)
-        if hp_pct is None:
-            continue
-        out.setdefault(tid, []).append((int(ts), hp_pct))
-
-    for tid in out:
-        out[tid].sort(key=lambda x: x[0])
+        times, values = samples
+        for k, (j, dt) in zip(idxs, nearest_batch(times, [cast_times[k] for k in idxs])):
+            conf = confidence(dt)
+            if conf is not None:
+                out[k] = (values[j], conf)
     return out
 
 
-def nearest_hp(hp_samples, target_id, cast_ts):
-    arr = hp_samples.get(target_id)
-    if not arr:
-        return None, "low"
-
-    times = [t for t, _ in arr]
-    i = bisect_left(times, cast_ts)
-
-    candidates = []
-    if i < len(arr):
-        candidates.append(arr[i])
-    if i > 0:
-        candidates.append(arr[i - 1])
-
-    if not candidates:
-        return None, "low"
-
-    best_t, best_hp = min(candidates, key=lambda x: abs(x[0] - cast_ts))
-    dt = abs(best_t - cast_ts)
-
-    if dt <= 300:
-        conf = "high"
-    elif dt <= 1000:
-        conf = "medium"
-    elif dt <= WINDOW_MS:
-        conf = "low"
-    else:
-        return None, "low"
-
-    return best_hp, conf
-
-
 def percentile(sorted_vals, p):
     if not sorted_vals:
         return None
@@ -274,50 +114,65 @@ def summarize(vals):
     }
 
 
-def main():
-    token = get_token()
+def print_spell_line(spell, s, c):
+    if not s:
+        print(f"- {spell}: no estimateable casts | conf h/m/l = {c['high']}/{c['medium']}/{c['low']}")
+    else:
+        print(
+            f"- {spell}: n={s['count']} mean={s['mean']} p25={s['p25']} p50={s['p50']} p75={s['p75']} "
+            f"min={s['min']} max={s['max']} | conf h/m/l={c['high']}/{c['medium']}/{c['low']}"
+        )
 
-    by_spell_all = {name: [] for name in SPELLS.values()}
-    conf_counts_all = {name: {"high": 0, "medium": 0, "low": 0} for name in SPELLS.values()}
-    per_report = []
 
-    for code, fight_id in REPORTS:
-        fight, details = get_report_meta(token, code, fight_id)
-        pal = pick_holy_paladin(details)
-        if not pal:
-            print(f"[WARN] {code} fight {fight_id}: No Holy Paladin healer found, skipping")
-            continue
+@register
+class HpAtCastAnalyzer(Analyzer):
+    # Target HP at each Holy Paladin heal cast.
+    name = "hp-at-cast"
+    hp_window_ms = WINDOW_MS
 
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.by_spell_all = {name: [] for name in SPELLS.values()}
+        self.conf_counts_all = {name: {"high": 0, "medium": 0, "low": 0} for name in SPELLS.values()}
+        self.per_report = []
+        self.source_names = {}
+
+    def cast_requests(self, fight):
+        pal = pick_holy_paladin(fight.details)
+        if not pal:
+            if self.verbose:
+                print(f"[WARN] {fight.code} fight {fight.fight_id}: No Holy Paladin healer found, skipping")
+            return []
         source_id = pal["id"]
-        source_name = pal.get("name", str(source_id))
+        self.source_names[(fight.code, fight.fight_id)] = pal.get("name", str(source_id))
+        return [(source_id, list(SPELLS))]
 
-        casts = fetch_cast_events(token, code, fight_id, source_id)
-        healing_events = fetch_events(token, code, fight_id, "Healing", int(fight["startTime"]), int(fight["endTime"]))
-        damage_events = fetch_events(token, code, fight_id, "DamageTaken", int(fight["startTime"]), int(fight["endTime"]))
-        hp_samples = build_hp_samples(healing_events + damage_events)
+    def consume(self, fight, source_id, casts):
+        code, fight_id = fight.code, fight.fight_id
+        source_name = self.source_names[(code, fight_id)]
+        hp_samples = build_hp_samples(fight.healing, fight.damage_taken)
 
         by_spell = {name: [] for name in SPELLS.values()}
         conf_counts = {name: {"high": 0, "medium": 0, "low": 0} for name in SPELLS.values()}
 
-        for c in casts:
-            sid = c.get("abilityGameID")
+        lookups = []
+        for sid, target_id, ts in casts.rows("abilityGameID", "targetID", "timestamp"):
             if sid not in SPELLS:
                 continue
-            spell_name = SPELLS[sid]
-            target_id = c.get("targetID")
-            ts = c.get("timestamp")
-            if target_id is None or ts is None:
-                conf_counts[spell_name]["low"] += 1
+            if target_id == MISSING or ts == MISSING:
+                conf_counts[SPELLS[sid]]["low"] += 1
                 continue
+            lookups.append((SPELLS[sid], target_id, ts))
 
-            hp, conf = nearest_hp(hp_samples, target_id, int(ts))
+        resolved = nearest_hp_batch(hp_samples, [t for _, t, _ in lookups], [ts for _, _, ts in lookups])
+        for (spell_name, _, _), (hp, conf) in zip(lookups, resolved):
             conf_counts[spell_name][conf] += 1
             if hp is not None:
                 by_spell[spell_name].append(hp)
-                by_spell_all[spell_name].append(hp)
-            conf_counts_all[spell_name][conf] += 1
+                self.by_spell_all[spell_name].append(hp)
+            self.conf_counts_all[spell_name][conf] += 1
 
-        per_report.append(
+        self.per_report.append(
             {
                 "report": code,
                 "fight": fight_id,
@@ -327,46 +182,37 @@ def main():
             }
         )
 
-        print(f"\n=== {code} fight {fight_id} | {source_name} ===")
-        for spell in SPELLS.values():
-            s = summarize(by_spell[spell])
-            c = conf_counts[spell]
-            if not s:
-                print(f"- {spell}: no estimateable casts | conf h/m/l = {c['high']}/{c['medium']}/{c['low']}")
-            else:
-                print(
-                    f"- {spell}: n={s['count']} mean={s['mean']} p25={s['p25']} p50={s['p50']} p75={s['p75']} "
-                    f"min={s['min']} max={s['max']} | conf h/m/l={c['high']}/{c['medium']}/{c['low']}"
-                )
+        if self.verbose:
+            print(f"\n=== {code} fight {fight_id} | {source_name} ===")
+            for spell in SPELLS.values():
+                print_spell_line(spell, summarize(by_spell[spell]), conf_counts[spell])
+
+    def result(self):
+        return {
+            "reports": self.per_report,
+            "combined": {k: summarize(v) for k, v in self.by_spell_all.items()},
+            "combinedConfidence": self.conf_counts_all,
+            "notes": {
+                "method": "Nearest target HP sample around cast timestamp from report events",
+                "windowMs": WINDOW_MS,
+                "confidence": {
+                    "high": "<=300ms from cast",
+                    "medium": "<=1000ms from cast",
+                    "low": "<=2000ms from cast",
+                },
+            },
+        }
 
-    combined = {k: summarize(v) for k, v in by_spell_all.items()}
+
+def main():
+    token = get_token()
+    analyzer = HpAtCastAnalyzer(verbose=True)
+    run_engine(token, REPORTS, [analyzer], EventStore.from_env())
+    out = analyzer.result()
 
     print("\n=== COMBINED (Top 5 logs provided) ===")
     for spell in SPELLS.values():
-        s = combined[spell]
-        c = conf_counts_all[spell]
-        if not s:
-            print(f"- {spell}: no estimateable casts | conf h/m/l = {c['high']}/{c['medium']}/{c['low']}")
-        else:
-            print(
-                f"- {spell}: n={s['count']} mean={s['mean']} p25={s['p25']} p50={s['p50']} p75={s['p75']} "
-                f"min={s['min']} max={s['max']} | conf h/m/l={c['high']}/{c['medium']}/{c['low']}"
-            )
-
-    out = {
-        "reports": per_report,
-        "combined": combined,
-        "combinedConfidence": conf_counts_all,
-        "notes": {
-            "method": "Nearest target HP sample around cast timestamp from report events",
-            "windowMs": WINDOW_MS,
-            "confidence": {
-                "high": "<=300ms from cast",
-                "medium": "<=1000ms from cast",
-                "low": "<=2000ms from cast",
-            },
-        },
-    }
+        print_spell_line(spell, out["combined"][spell], out["combinedConfidence"][spell])
 
     out_path = os.path.join("WCL_Parser", "wcl_hp_estimate_output.json")
     with open(out_path, "w", encoding="utf-8") as f:
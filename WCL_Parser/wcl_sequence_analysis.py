@@ -1,45 +1,22 @@
 import argparse
 import json
 import os
+import sys
+from array import array
 from collections import Counter
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
-from wcl_timers import fetch_casts, find_player_id, get_fight_info, get_token, gql, resolve_encounter
+import wcl_client
+from wcl_client import format_metrics_report, format_rate_report, rate_limit_report, rate_stage, write_metrics_report
+from wcl_engine import Analyzer, register, run_engine
+from wcl_cache import write_atomic
+from wcl_event_store import TYPECODE, EventStore, FightEvents
+from wcl_timers import fetch_rankings_bulk, find_player_id, get_token, get_zone_index, public_rankings
 
-
-def fetch_zone(token: str, zone_id: int) -> Dict[str, Any]:
-    query = f'query {{ worldData {{ zone(id: {zone_id}) {{ id name encounters {{ id name }} }} }} }}'
-    data = gql(token, query)
-    zone = data.get("data", {}).get("worldData", {}).get("zone")
-    if not zone:
-        raise RuntimeError(f"Zone {zone_id} not found in worldData")
-    return zone
-
-
-def choose_rankings(
-    token: str,
-    encounter_id: int,
-    class_name: str,
-    spec_name: str,
-    difficulty_id: int,
-    metric: str,
-    top_n: int,
-) -> List[Dict[str, Any]]:
-    query = (
-        'query { worldData { encounter(id: %d) { '
-        'characterRankings(difficulty:%d, className:"%s", specName:"%s", metric:%s, page:1) '
-        '} } }'
-    ) % (encounter_id, difficulty_id, class_name, spec_name, metric)
-    res = gql(token, query)
-    rankings_data = res.get("data", {}).get("worldData", {}).get("encounter", {}).get("characterRankings", {})
-    rankings = rankings_data.get("rankings", [])
-    public = []
-    for ranking in rankings:
-        if not ranking.get("hidden") and not str(ranking.get("report", {}).get("code", "")).startswith("a:"):
-            public.append(ranking)
-        if len(public) >= top_n:
-            break
-    return public
+# --mine-out files: run metadata, per-log cast streams and the transition matrix.
+MATRIX_VERSION = 1
+MATRIX_META_KEYS = ("zone_id", "difficulty_id", "class_name", "spec_name", "metric", "top_n_per_encounter")
+GAP_BUCKET_MS = 100
 
 
 def parse_spell_csv(value: str) -> List[int]:
@@ -67,52 +44,128 @@ def parse_name_map(value: Optional[str]) -> Dict[int, str]:
     return out
 
 
-def normalize_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    return sorted(events, key=lambda event: event.get("timestamp", 0))
+def cast_events(casts: FightEvents) -> FightEvents:
+    # The cast log in timestamp order (stable for equal times), still as columns.
+    times = casts["timestamp"]
+    return casts.select(sorted(range(len(casts)), key=times.__getitem__))
+
+
+def encode_stream(events: FightEvents) -> Dict[str, List[int]]:
+    # A sorted cast log as timestamp deltas plus spell ids: small in JSON and the deltas
+    # are the gaps the transition matrix needs.
+    times = list(events["timestamp"])
+    return {
+        "dt": [ts - prev for prev, ts in zip([0] + times, times)],
+        "spells": list(events["abilityGameID"]),
+    }
+
+
+def decode_stream(stream: Dict[str, List[int]]) -> FightEvents:
+    times = array(TYPECODE)
+    ts = 0
+    for dt in stream["dt"]:
+        ts += dt
+        times.append(ts)
+    return FightEvents({"timestamp": times, "abilityGameID": array(TYPECODE, stream["spells"])})
+
+
+def build_transitions(streams: Iterable[Dict[str, List[int]]]) -> Dict[str, Any]:
+    # spell -> next spell counts and gap histograms (GAP_BUCKET_MS buckets) over every
+    # stream, in one pass; only transitions that occur are stored.
+    counts: Dict[int, Counter[int]] = {}
+    gaps: Dict[int, Dict[int, Counter[int]]] = {}
+    for stream in streams:
+        spells = stream["spells"]
+        for prev, spell_id, dt in zip(spells, spells[1:], stream["dt"][1:]):
+            counts.setdefault(prev, Counter())[spell_id] += 1
+            gaps.setdefault(prev, {}).setdefault(spell_id, Counter())[dt // GAP_BUCKET_MS * GAP_BUCKET_MS] += 1
+    return {
+        "gap_bucket_ms": GAP_BUCKET_MS,
+        "transitions": {
+            str(prev): {str(spell_id): n for spell_id, n in row.most_common()} for prev, row in counts.items()
+        },
+        "gaps_ms": {
+            str(prev): {
+                str(spell_id): {str(bucket): n for bucket, n in sorted(hist.items())}
+                for spell_id, hist in row.items()
+            }
+            for prev, row in gaps.items()
+        },
+    }
+
+
+def next_followup_indices(
+    events: FightEvents,
+    followup_spell_ids: Optional[List[int]],
+) -> Tuple[List[int], List[int]]:
+    # One backward pass: for every position, the index of the next followup cast after it
+    # (-1 if none) and the latest timestamp up to and including that followup, which is
+    # what max_gap_ms has to be checked against. followup_spell_ids=None accepts any spell.
+    followup_set = None if followup_spell_ids is None else set(followup_spell_ids)
+    next_index = [-1] * len(events)
+    latest_ts = [0] * len(events)
+    times, spells = events["timestamp"], events["abilityGameID"]
+    following = -1
+    latest = 0
+    for index in range(len(events) - 1, -1, -1):
+        next_index[index] = following
+        latest_ts[index] = latest
+        ts = times[index]
+        if followup_set is None or spells[index] in followup_set:
+            following = index
+            latest = ts
+        elif following >= 0 and ts > latest:
+            latest = ts
+    return next_index, latest_ts
 
 
 def first_followup_after_trigger(
-    events: List[Dict[str, Any]],
-    trigger_spell_id: int,
-    followup_spell_ids: List[int],
+    events: FightEvents,
+    trigger_spell_id: Union[int, Iterable[int]],
+    followup_spell_ids: Optional[List[int]],
     max_gap_ms: Optional[int] = None,
 ) -> Dict[str, Any]:
-    followup_set = set(followup_spell_ids)
+    # First followup cast after each trigger cast; a cast more than max_gap_ms after the
+    # trigger ends the search. Several trigger ids can be passed at once, "by_trigger"
+    # splits the totals per trigger id.
+    triggers = {trigger_spell_id} if isinstance(trigger_spell_id, int) else set(trigger_spell_id)
+    next_index, latest_ts = next_followup_indices(events, followup_spell_ids)
+    times, spells = events["timestamp"], events["abilityGameID"]
     counts: Counter[str] = Counter()
+    by_trigger: Dict[str, Dict[str, Any]] = {}
     trigger_count = 0
     matched_count = 0
     unmatched_count = 0
 
-    for index, event in enumerate(events):
-        spell_id = event.get("abilityGameID")
-        if spell_id != trigger_spell_id:
+    for index, spell_id in enumerate(spells):
+        if spell_id not in triggers:
             continue
 
         trigger_count += 1
-        trigger_ts = event.get("timestamp", 0)
-        found = False
-
-        for next_event in events[index + 1:]:
-            next_spell_id = next_event.get("abilityGameID")
-            next_ts = next_event.get("timestamp", 0)
-
-            if max_gap_ms is not None and (next_ts - trigger_ts) > max_gap_ms:
-                break
-
-            if next_spell_id in followup_set:
-                counts[str(next_spell_id)] += 1
-                matched_count += 1
-                found = True
-                break
+        per_trigger = by_trigger.setdefault(
+            str(spell_id), {"counts": Counter(), "trigger_count": 0, "matched_count": 0, "unmatched_count": 0}
+        )
+        per_trigger["trigger_count"] += 1
+        followup = next_index[index]
+        if followup >= 0 and max_gap_ms is not None and (latest_ts[index] - times[index]) > max_gap_ms:
+            followup = -1
 
-        if not found:
+        if followup < 0:
             unmatched_count += 1
+            per_trigger["unmatched_count"] += 1
+            continue
+        next_spell_id = str(spells[followup])
+        counts[next_spell_id] += 1
+        matched_count += 1
+        per_trigger["counts"][next_spell_id] += 1
+        per_trigger["matched_count"] += 1
 
     return {
         "counts": counts,
         "trigger_count": trigger_count,
         "matched_count": matched_count,
         "unmatched_count": unmatched_count,
+        "by_trigger": by_trigger,
     }
 
 
@@ -136,40 +189,251 @@ def build_percentages(counter: Counter[str], total: int, spell_names: Dict[int,
     return out
 
 
+def pick_player_name(details: Dict[str, Any], class_name: str, spec_name: str) -> Optional[str]:
+    # First player of the class whose specs include spec_name, else the first of the class.
+    players = [p for role in ("healers", "tanks", "dps") for p in details.get(role, []) if p.get("type") == class_name]
+    for p in players:
+        for s in p.get("specs") or []:
+            sname = s.get("spec") if isinstance(s, dict) else s
+            if str(sname or "").lower() == spec_name.lower():
+                return p.get("name")
+    return players[0].get("name") if players else None
+
+
+@register
+class FollowupAnalyzer(Analyzer):
+    # First followup after each trigger cast, per (report, fight, player). `players` maps
+    # (code, fightId) to the ranked player names; without it the class/spec is looked up.
+    # followup_spell_ids=None downloads the player's full cast log and accepts any spell.
+    name = "followups"
+
+    def __init__(
+        self,
+        class_name: str,
+        spec_name: str,
+        trigger_spell_ids: List[int],
+        followup_spell_ids: Optional[List[int]],
+        max_gap_ms: Optional[int] = None,
+        players: Optional[Dict[Tuple[str, int], List[str]]] = None,
+    ):
+        self.class_name = class_name
+        self.spec_name = spec_name
+        self.trigger_spell_ids = trigger_spell_ids
+        self.followup_spell_ids = followup_spell_ids
+        self.max_gap_ms = max_gap_ms
+        self.players = players
+        self.results: Dict[Tuple[str, int, str], Dict[str, Any]] = {}
+        self.errors: Dict[Tuple[str, int, str], str] = {}
+        self._names: Dict[Tuple[str, int, int], str] = {}
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "FollowupAnalyzer":
+        if not args.trigger:
+            raise RuntimeError("followups analyzer needs --trigger")
+        followups = parse_spell_csv(args.followups) if args.followups else None
+        return cls(args.class_name, args.spec_name, parse_spell_csv(args.trigger), followups, args.max_gap_ms)
+
+    def player_names(self, code: str, fight_id: int, details: Optional[Dict[str, Any]] = None) -> List[str]:
+        if self.players is not None:
+            return self.players.get((code, fight_id), [])
+        name = pick_player_name(details or {}, self.class_name, self.spec_name)
+        return [name] if name else []
+
+    def cast_requests(self, fight) -> List[Tuple[int, List[int]]]:
+        out = []
+        for player_name in self.player_names(fight.code, fight.fight_id, fight.details):
+            try:
+                player_id = find_player_id(fight.report, player_name, self.class_name)
+            except Exception as exc:
+                self.errors[(fight.code, fight.fight_id, player_name)] = str(exc)
+                continue
+            self._names[(fight.code, fight.fight_id, player_id)] = player_name
+            # An empty spell list asks the engine for every cast of the player.
+            spells = [] if self.followup_spell_ids is None else self.trigger_spell_ids + self.followup_spell_ids
+            out.append((player_id, spells))
+        return out
+
+    def result_key(self, fight, source_id: int) -> Tuple[str, int, str]:
+        return (fight.code, fight.fight_id, self._names[(fight.code, fight.fight_id, source_id)])
+
+    def consume(self, fight, source_id, casts):
+        self.results[self.result_key(fight, source_id)] = first_followup_after_trigger(
+            events=cast_events(casts),
+            trigger_spell_id=self.trigger_spell_ids,
+            followup_spell_ids=self.followup_spell_ids,
+            max_gap_ms=self.max_gap_ms,
+        )
+
+    def fail(self, code, fight_id, source_id, exc):
+        if source_id is not None:
+            names = [self._names[(code, fight_id, source_id)]]
+        else:
+            names = self.player_names(code, fight_id)
+        for player_name in names:
+            self.errors[(code, fight_id, player_name)] = str(exc)
+
+    def failures(self) -> List[Dict[str, Any]]:
+        return [
+            {"report": code, "fight_id": fight_id, "player": player, "error": error}
+            for (code, fight_id, player), error in self.errors.items()
+        ]
+
+    def result(self) -> Dict[str, Any]:
+        counter: Counter[str] = Counter()
+        for analysis in self.results.values():
+            counter.update(analysis["counts"])
+        return {
+            "logs_processed": len(self.results),
+            "counts": dict(counter),
+            "trigger_count": sum(a["trigger_count"] for a in self.results.values()),
+            "matched_count": sum(a["matched_count"] for a in self.results.values()),
+            "unmatched_count": sum(a["unmatched_count"] for a in self.results.values()),
+            "failures": self.failures(),
+        }
+
+
+@register
+class CastStreamAnalyzer(FollowupAnalyzer):
+    # Every cast of each player as a compact stream; the result is the spell -> next spell
+    # transition matrix. Followup questions are then answered from the streams offline.
+    name = "transitions"
+
+    def __init__(
+        self,
+        class_name: str,
+        spec_name: str,
+        players: Optional[Dict[Tuple[str, int], List[str]]] = None,
+    ):
+        super().__init__(class_name, spec_name, [], None, players=players)
+        self.streams: Dict[Tuple[str, int, str], Dict[str, List[int]]] = {}
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "CastStreamAnalyzer":
+        return cls(args.class_name, args.spec_name)
+
+    def consume(self, fight, source_id, casts):
+        self.streams[self.result_key(fight, source_id)] = encode_stream(cast_events(casts))
+
+    def result(self) -> Dict[str, Any]:
+        out = build_transitions(self.streams.values())
+        out["logs_processed"] = len(self.streams)
+        out["failures"] = self.failures()
+        return out
+
+
 def choose_encounters(token: str, zone_id: int, encounter_filters: Optional[List[str]]) -> List[Dict[str, Any]]:
-    zone = fetch_zone(token, zone_id)
+    index = get_zone_index(token, zone_id)
     if not encounter_filters:
-        return zone.get("encounters", [])
-    return [resolve_encounter(token, zone_id, entry) for entry in encounter_filters]
+        return index.encounters
+    return [index.resolve(entry) for entry in encounter_filters]
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Analyze first cast followups from top Warcraft Logs dungeon runs")
-    parser.add_argument("--zone", type=int, required=True, help="WCL zone id, for example 45 for Mythic+ Season 3")
-    parser.add_argument("--difficulty", type=int, required=True, help="WCL difficulty id, for example 10 for Mythic+")
-    parser.add_argument("--class-name", required=True, help="WCL class name, for example Shaman")
-    parser.add_argument("--spec-name", required=True, help="WCL spec name, for example Restoration")
-    parser.add_argument("--metric", default="hps", help="WCL rankings metric, for example hps or dps")
-    parser.add_argument("--top", type=int, default=10, help="Top public logs per encounter to inspect")
-    parser.add_argument("--trigger", type=int, required=True, help="Trigger spell id")
-    parser.add_argument("--followups", required=True, help="Comma-separated followup spell ids")
-    parser.add_argument("--spell-names", default="", help="Optional CSV of spellId:Label entries")
-    parser.add_argument("--encounters", default="", help="Optional comma-separated encounter names or ids")
-    parser.add_argument("--max-gap-ms", type=int, default=None, help="Optional maximum time between trigger and followup")
-    parser.add_argument("--report-out", default="", help="Optional path to write JSON output")
-    args = parser.parse_args()
+def ranked_logs(rankings: List[Dict[str, Any]]) -> List[Tuple[str, int, str]]:
+    return [(ranking["report"]["code"], int(ranking["report"]["fightID"]), ranking["name"]) for ranking in rankings]
 
-    token = get_token()
-    followup_spell_ids = parse_spell_csv(args.followups)
-    encounter_filters = [item.strip() for item in args.encounters.split(",") if item.strip()]
-    spell_names = parse_name_map(args.spell_names)
-    spell_names.setdefault(args.trigger, str(args.trigger))
-    for spell_id in followup_spell_ids:
-        spell_names.setdefault(spell_id, str(spell_id))
 
-    encounters = choose_encounters(token, args.zone, encounter_filters)
+def ranked_players(logs: List[Tuple[str, int, str]]) -> Dict[Tuple[str, int], List[str]]:
+    players: Dict[Tuple[str, int], List[str]] = {}
+    for code, fight_id, player_name in logs:
+        players.setdefault((code, fight_id), []).append(player_name)
+    return players
+
 
+# Per encounter: (name, id, [(report, fightId, player, analysis or None, error)]) in ranking order.
+EncounterRun = Tuple[str, int, List[Tuple[str, int, str, Optional[Dict[str, Any]], str]]]
+
+
+def followup_runs(
+    token: str,
+    encounter_logs: List[Tuple[Dict[str, Any], List[Tuple[str, int, str]]]],
+    args: argparse.Namespace,
+    trigger_spell_ids: List[int],
+    followup_spell_ids: Optional[List[int]],
+    store: Optional[EventStore],
+) -> List[EncounterRun]:
+    runs: List[EncounterRun] = []
+    for encounter, logs in encounter_logs:
+        players = ranked_players(logs)
+        analyzer = FollowupAnalyzer(
+            args.class_name, args.spec_name, trigger_spell_ids, followup_spell_ids, args.max_gap_ms, players=players,
+        )
+        run_engine(token, list(players), [analyzer], store)
+        runs.append((encounter["name"], int(encounter["id"]), [
+            (code, fight_id, player_name, analyzer.results.get((code, fight_id, player_name)),
+             analyzer.errors.get((code, fight_id, player_name), "no result"))
+            for code, fight_id, player_name in logs
+        ]))
+    return runs
+
+
+def mine_cast_streams(
+    token: str,
+    encounter_logs: List[Tuple[Dict[str, Any], List[Tuple[str, int, str]]]],
+    meta: Dict[str, Any],
+    store: Optional[EventStore],
+) -> Dict[str, Any]:
+    # Each ranked player's complete cast stream (one casts download per log, whatever the
+    # question), plus the transition matrix over all of them.
+    encounters = []
+    streams = []
+    for encounter, logs in encounter_logs:
+        players = ranked_players(logs)
+        analyzer = CastStreamAnalyzer(meta["class_name"], meta["spec_name"], players=players)
+        run_engine(token, list(players), [analyzer], store)
+        entries = []
+        for code, fight_id, player_name in logs:
+            entry: Dict[str, Any] = {"report": code, "fight_id": fight_id, "player": player_name}
+            stream = analyzer.streams.get((code, fight_id, player_name))
+            if stream is None:
+                entry["error"] = analyzer.errors.get((code, fight_id, player_name), "no result")
+            else:
+                entry["stream"] = stream
+                streams.append(stream)
+            entries.append(entry)
+        encounters.append({"name": encounter["name"], "id": int(encounter["id"]), "logs": entries})
+    mined = {"version": MATRIX_VERSION}
+    mined.update(meta)
+    mined["encounters"] = encounters
+    mined.update(build_transitions(streams))
+    return mined
+
+
+def save_matrix(path: str, mined: Dict[str, Any]):
+    write_atomic(path, json.dumps(mined, separators=(",", ":")).encode("utf-8"))
+
+
+def load_matrix(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as handle:
+        mined = json.load(handle)
+    if mined.get("version") != MATRIX_VERSION:
+        raise RuntimeError(f"{path}: unsupported matrix file version {mined.get('version')!r}")
+    return mined
+
+
+def mined_followup_runs(
+    mined: Dict[str, Any],
+    trigger_spell_ids: List[int],
+    followup_spell_ids: Optional[List[int]],
+    max_gap_ms: Optional[int],
+) -> List[EncounterRun]:
+    # The same per-log analysis as a download run, replayed from stored cast streams.
+    runs: List[EncounterRun] = []
+    for encounter in mined["encounters"]:
+        logs = []
+        for entry in encounter["logs"]:
+            analysis = None
+            if "stream" in entry:
+                analysis = first_followup_after_trigger(
+                    decode_stream(entry["stream"]), trigger_spell_ids, followup_spell_ids, max_gap_ms,
+                )
+            logs.append((entry["report"], entry["fight_id"], entry["player"], analysis, entry.get("error", "no result")))
+        runs.append((encounter["name"], encounter["id"], logs))
+    return runs
+
+
+def summarize_followups(runs: List[EncounterRun], spell_names: Dict[int, str]) -> Dict[str, Any]:
     overall_counter: Counter[str] = Counter()
+    overall_by_trigger: Dict[str, Dict[str, Any]] = {}
     overall_trigger_count = 0
     overall_matched_count = 0
     overall_unmatched_count = 0
@@ -177,59 +441,44 @@ def main():
     per_encounter: Dict[str, Any] = {}
     failures: List[Dict[str, Any]] = []
 
-    for encounter in encounters:
+    for encounter_name, encounter_id, logs in runs:
         encounter_counter: Counter[str] = Counter()
         encounter_trigger_count = 0
         encounter_matched_count = 0
         encounter_unmatched_count = 0
 
-        rankings = choose_rankings(
-            token=token,
-            encounter_id=int(encounter["id"]),
-            class_name=args.class_name,
-            spec_name=args.spec_name,
-            difficulty_id=args.difficulty,
-            metric=args.metric,
-            top_n=args.top,
-        )
-
-        for ranking in rankings:
-            report_code = ranking["report"]["code"]
-            fight_id = int(ranking["report"]["fightID"])
-            player_name = ranking["name"]
-            try:
-                report = get_fight_info(token, report_code, fight_id)
-                player_id = find_player_id(report, player_name, args.class_name)
-                events = normalize_events(fetch_casts(token, report_code, fight_id, player_id, [args.trigger] + followup_spell_ids))
-                analysis = first_followup_after_trigger(
-                    events=events,
-                    trigger_spell_id=args.trigger,
-                    followup_spell_ids=followup_spell_ids,
-                    max_gap_ms=args.max_gap_ms,
-                )
-                encounter_counter.update(analysis["counts"])
-                encounter_trigger_count += analysis["trigger_count"]
-                encounter_matched_count += analysis["matched_count"]
-                encounter_unmatched_count += analysis["unmatched_count"]
-                overall_counter.update(analysis["counts"])
-                overall_trigger_count += analysis["trigger_count"]
-                overall_matched_count += analysis["matched_count"]
-                overall_unmatched_count += analysis["unmatched_count"]
-                logs_processed += 1
-            except Exception as exc:
+        for report_code, fight_id, player_name, analysis, error in logs:
+            if analysis is None:
                 failures.append(
                     {
-                        "encounter": encounter["name"],
+                        "encounter": encounter_name,
                         "report": report_code,
                         "fight_id": fight_id,
                         "player": player_name,
-                        "error": str(exc),
+                        "error": error,
                     }
                 )
-
-        per_encounter[encounter["name"]] = {
-            "encounter_id": int(encounter["id"]),
-            "logs_requested": len(rankings),
+                continue
+            encounter_counter.update(analysis["counts"])
+            encounter_trigger_count += analysis["trigger_count"]
+            encounter_matched_count += analysis["matched_count"]
+            encounter_unmatched_count += analysis["unmatched_count"]
+            overall_counter.update(analysis["counts"])
+            overall_trigger_count += analysis["trigger_count"]
+            overall_matched_count += analysis["matched_count"]
+            overall_unmatched_count += analysis["unmatched_count"]
+            for trigger_id_str, per_trigger in analysis["by_trigger"].items():
+                totals = overall_by_trigger.setdefault(
+                    trigger_id_str, {"counts": Counter(), "trigger_count": 0, "matched_count": 0, "unmatched_count": 0}
+                )
+                totals["counts"].update(per_trigger["counts"])
+                for key in ("trigger_count", "matched_count", "unmatched_count"):
+                    totals[key] += per_trigger[key]
+            logs_processed += 1
+
+        per_encounter[encounter_name] = {
+            "encounter_id": encounter_id,
+            "logs_requested": len(logs),
             "counts": to_named_counts(encounter_counter, spell_names),
             "percentages": build_percentages(encounter_counter, encounter_matched_count, spell_names),
             "trigger_count": encounter_trigger_count,
@@ -237,33 +486,147 @@ def main():
             "unmatched_count": encounter_unmatched_count,
         }
 
-    result = {
-        "zone_id": args.zone,
-        "difficulty_id": args.difficulty,
-        "class_name": args.class_name,
-        "spec_name": args.spec_name,
-        "metric": args.metric,
-        "top_n_per_encounter": args.top,
-        "trigger_spell_id": args.trigger,
-        "trigger_spell_name": spell_names.get(args.trigger, str(args.trigger)),
-        "followup_spell_ids": followup_spell_ids,
-        "followup_spell_names": {str(spell_id): spell_names.get(spell_id, str(spell_id)) for spell_id in followup_spell_ids},
-        "max_gap_ms": args.max_gap_ms,
+    return {
         "logs_processed": logs_processed,
         "overall_counts": to_named_counts(overall_counter, spell_names),
         "overall_percentages": build_percentages(overall_counter, overall_matched_count, spell_names),
         "overall_trigger_count": overall_trigger_count,
         "overall_matched_count": overall_matched_count,
         "overall_unmatched_count": overall_unmatched_count,
+        "overall_by_trigger": {
+            spell_names.get(int(trigger_id_str), trigger_id_str): {
+                "counts": to_named_counts(totals["counts"], spell_names),
+                "percentages": build_percentages(totals["counts"], totals["matched_count"], spell_names),
+                "trigger_count": totals["trigger_count"],
+                "matched_count": totals["matched_count"],
+                "unmatched_count": totals["unmatched_count"],
+            }
+            for trigger_id_str, totals in overall_by_trigger.items()
+        },
         "per_encounter": per_encounter,
         "failures": failures,
     }
 
+
+def print_network_report(token: str, metrics_out: str):
+    print(format_rate_report(rate_limit_report(token)), file=sys.stderr)
+    if metrics_out:
+        print(format_metrics_report(write_metrics_report(metrics_out)), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze first cast followups from top Warcraft Logs dungeon runs")
+    parser.add_argument("--zone", type=int, default=None, help="WCL zone id, for example 45 for Mythic+ Season 3")
+    parser.add_argument("--difficulty", type=int, default=None, help="WCL difficulty id, for example 10 for Mythic+")
+    parser.add_argument("--class-name", default=None, help="WCL class name, for example Shaman")
+    parser.add_argument("--spec-name", default=None, help="WCL spec name, for example Restoration")
+    parser.add_argument("--metric", default="hps", help="WCL rankings metric, for example hps or dps")
+    parser.add_argument("--top", type=int, default=10, help="Top public logs per encounter to inspect")
+    parser.add_argument("--trigger", default="", help="Trigger spell id, or comma-separated trigger spell ids")
+    parser.add_argument("--followups", default="", help="Comma-separated followup spell ids (default: any spell)")
+    parser.add_argument("--spell-names", default="", help="Optional CSV of spellId:Label entries")
+    parser.add_argument("--encounters", default="", help="Optional comma-separated encounter names or ids")
+    parser.add_argument("--max-gap-ms", type=int, default=None, help="Optional maximum time between trigger and followup")
+    parser.add_argument("--report-out", default="", help="Optional path to write JSON output")
+    parser.add_argument("--mine-out", default="", help="Download complete cast logs once and write the transition matrix file here")
+    parser.add_argument("--matrix", default="", help="Answer --trigger/--followups from a --mine-out file, without network access")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk GraphQL response cache")
+    parser.add_argument("--cache-dir", default=None, help="Optional directory for the GraphQL response cache")
+    parser.add_argument("--metrics-out", default="", help="Optional path to write per-call-site GraphQL telemetry JSON")
+    parser.add_argument("--base-url", default=None, help="WCL API host (default WCL_BASE_URL or warcraftlogs.com)")
+    args = parser.parse_args()
+
+    if not args.matrix:
+        missing = [flag for flag, value in (("--zone", args.zone), ("--difficulty", args.difficulty),
+                                            ("--class-name", args.class_name), ("--spec-name", args.spec_name))
+                   if value is None]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
+    if not args.trigger and (args.matrix or not args.mine_out):
+        parser.error("the following arguments are required: --trigger")
+
+    trigger_spell_ids = parse_spell_csv(args.trigger) if args.trigger else []
+    followup_spell_ids = parse_spell_csv(args.followups) if args.followups else None
+    spell_names = parse_name_map(args.spell_names)
+    for spell_id in trigger_spell_ids + (followup_spell_ids or []):
+        spell_names.setdefault(spell_id, str(spell_id))
+
+    token = None
+    if args.matrix:
+        mined = load_matrix(args.matrix)
+        meta = {key: mined[key] for key in MATRIX_META_KEYS}
+        runs = mined_followup_runs(mined, trigger_spell_ids, followup_spell_ids, args.max_gap_ms)
+    else:
+        wcl_client.configure(use_cache=not args.no_cache, cache_dir=args.cache_dir, base_url=args.base_url)
+        store = None
+        if not args.no_cache:
+            store = EventStore.from_env(os.path.join(args.cache_dir, "events") if args.cache_dir else None)
+        token = get_token()
+        encounter_filters = [item.strip() for item in args.encounters.split(",") if item.strip()]
+        meta = {
+            "zone_id": args.zone,
+            "difficulty_id": args.difficulty,
+            "class_name": args.class_name,
+            "spec_name": args.spec_name,
+            "metric": args.metric,
+            "top_n_per_encounter": args.top,
+        }
+
+        with rate_stage("zones"):
+            encounters = choose_encounters(token, args.zone, encounter_filters)
+
+        with rate_stage("rankings"):
+            rankings_by_encounter = fetch_rankings_bulk(
+                token,
+                [int(encounter["id"]) for encounter in encounters],
+                [args.difficulty],
+                args.class_name,
+                args.spec_name,
+                args.metric,
+                args.top,
+            )
+        encounter_logs = [
+            (encounter, ranked_logs(public_rankings(rankings_by_encounter[(int(encounter["id"]), args.difficulty)], args.top)))
+            for encounter in encounters
+        ]
+
+        if args.mine_out:
+            mined = mine_cast_streams(token, encounter_logs, meta, store)
+            save_matrix(args.mine_out, mined)
+            if not trigger_spell_ids:
+                logs = [entry for encounter in mined["encounters"] for entry in encounter["logs"]]
+                print(json.dumps({
+                    "matrix_out": args.mine_out,
+                    "logs_mined": sum(1 for entry in logs if "stream" in entry),
+                    "casts": sum(len(entry["stream"]["spells"]) for entry in logs if "stream" in entry),
+                    "distinct_spells": len(mined["transitions"]),
+                    "failures": [entry for entry in logs if "error" in entry],
+                }, indent=2))
+                print_network_report(token, args.metrics_out)
+                return
+            runs = mined_followup_runs(mined, trigger_spell_ids, followup_spell_ids, args.max_gap_ms)
+        else:
+            runs = followup_runs(token, encounter_logs, args, trigger_spell_ids, followup_spell_ids, store)
+
+    result = dict(meta)
+    result.update({
+        "trigger_spell_id": trigger_spell_ids[0],
+        "trigger_spell_name": spell_names[trigger_spell_ids[0]],
+        "trigger_spell_ids": trigger_spell_ids,
+        "trigger_spell_names": {str(spell_id): spell_names[spell_id] for spell_id in trigger_spell_ids},
+        "followup_spell_ids": followup_spell_ids,
+        "followup_spell_names": {str(spell_id): spell_names[spell_id] for spell_id in followup_spell_ids or []},
+        "max_gap_ms": args.max_gap_ms,
+    })
+    result.update(summarize_followups(runs, spell_names))
+
     if args.report_out:
         with open(args.report_out, "w", encoding="utf-8") as handle:
             json.dump(result, handle, indent=2)
 
     print(json.dumps(result, indent=2))
+    if token is not None:
+        print_network_report(token, args.metrics_out)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,436 @@
+import argparse
+import bisect
+import gzip
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from wcl_cache import ResponseLog, cache_key, normalize_query
+from wcl_client import API_PATH, TOKEN_PATH
+
+# Events per page when a query does not pass limit (WCL's own default).
+PAGE_SIZE_DEFAULT = 300
+ERROR_STATUSES = (500, 502, 503)
+
+EVENTS_FIELD_RE = re.compile(r"(?:(\w+)\s*:\s*)?\bevents\s*\(")
+REPORT_CODE_RE = re.compile(r'\breport\s*\(\s*code\s*:\s*(\$\w+|"(?:[^"\\]|\\.)*")')
+ARG_RE = re.compile(r'(\w+)\s*:\s*(\$\w+|"(?:[^"\\]|\\.)*"|\[[^\]]*\]|[^\s,()\[\]]+)')
+LIST_ITEM_RE = re.compile(r'\$\w+|"(?:[^"\\]|\\.)*"|[^\s,]+')
+ALIASED_REPORTS_RE = re.compile(r"query\{reportData\{(.*)\}\}")
+ALIAS_RE = re.compile(r"(\w+):")
+# Arguments that select a page rather than the event stream itself.
+PAGE_ARGS = ("startTime", "endTime", "limit")
+
+
+def arg_value(raw: str, variables: Dict[str, Any]) -> Any:
+    if raw.startswith("$"):
+        return variables.get(raw[1:])
+    if raw.startswith("["):
+        return [arg_value(item, variables) for item in LIST_ITEM_RE.findall(raw[1:-1])]
+    try:
+        return json.loads(raw)
+    except ValueError:
+        # Enum values such as dataType: Casts.
+        return raw
+
+
+def closing_paren(text: str, pos: int) -> int:
+    # Index of the ')' closing the '(' just before `pos`, skipping string literals.
+    depth = 1
+    while pos < len(text):
+        ch = text[pos]
+        if ch == '"':
+            pos += 1
+            while pos < len(text) and text[pos] != '"':
+                pos += 2 if text[pos] == "\\" else 1
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth == 0:
+                return pos
+        pos += 1
+    raise ValueError("unbalanced parentheses in query")
+
+
+def field_end(text: str, pos: int) -> int:
+    # End of the GraphQL field starting at `pos`: its arguments and selection set,
+    # skipping string literals.
+    depth = 0
+    while pos < len(text):
+        ch = text[pos]
+        if ch == '"':
+            pos += 1
+            while pos < len(text) and text[pos] != '"':
+                pos += 2 if text[pos] == "\\" else 1
+        elif ch in "({[":
+            depth += 1
+        elif ch in ")}]":
+            depth -= 1
+            if depth == 0 and ch == "}":
+                return pos + 1
+        pos += 1
+    raise ValueError("unbalanced braces in query")
+
+
+def aliased_reports(query: str) -> Optional[List[Tuple[str, str]]]:
+    # (alias, field) for a query of aliased reportData.report fields, as sent by
+    # get_fight_infos; None for any other query.
+    m = ALIASED_REPORTS_RE.fullmatch(normalize_query(query))
+    if not m:
+        return None
+    inner, pos, out = m.group(1), 0, []
+    while pos < len(inner):
+        alias = ALIAS_RE.match(inner, pos)
+        if not alias or not inner.startswith("report(", alias.end()):
+            return None
+        end = field_end(inner, alias.end())
+        out.append((alias.group(1), inner[alias.end():end]))
+        pos = end
+    return out or None
+
+
+def events_fields(query: str, variables: Dict[str, Any]) -> Tuple[Optional[str], List[Tuple[str, Dict[str, Any]]]]:
+    # Report code and (response key, resolved arguments) for every events field of a
+    # reportData.report query; no fields for any other query.
+    fields = []
+    for m in EVENTS_FIELD_RE.finditer(query):
+        body = query[m.end():closing_paren(query, m.end())]
+        args = {name: arg_value(raw, variables) for name, raw in ARG_RE.findall(body)}
+        fields.append((m.group(1) or "events", args))
+    if not fields:
+        return None, []
+    m = REPORT_CODE_RE.search(query)
+    return (arg_value(m.group(1), variables) if m else None), fields
+
+
+def stream_key(code: Optional[str], args: Dict[str, Any]) -> str:
+    selector = {k: v for k, v in args.items() if k not in PAGE_ARGS and v is not None}
+    return json.dumps([code, selector], sort_keys=True, separators=(",", ":"))
+
+
+class EventStream:
+    # One (report, dataType, fights, filters...) event list, stitched together from every
+    # recorded page of it and served back with any start/end/page size, as long as the
+    # recorded pages cover the requested time range.
+    def __init__(self):
+        self.pages: List[Tuple[float, List[Dict[str, Any]]]] = []
+        self.events: List[Dict[str, Any]] = []
+        self.times: List[float] = []
+        # Time ranges the recorded pages answered: (lo, hi, hi included), merged by finish().
+        self.coverage: List[Tuple[float, float, bool]] = []
+
+    def add_page(self, start: Optional[float], end: Optional[float], next_page: Optional[float],
+                 events: List[Dict[str, Any]]):
+        # A page holds every event from its start up to nextPageTimestamp (excluded), or up
+        # to the query's end (included) when it is the last page.
+        lo = float("-inf") if start is None else float(start)
+        if next_page is not None:
+            self.coverage.append((lo, float(next_page), False))
+        else:
+            self.coverage.append((lo, float("inf") if end is None else float(end), True))
+        self.pages.append((lo, events))
+
+    def covers(self, start: Optional[float], end: Optional[float]) -> bool:
+        lo = float("-inf") if start is None else float(start)
+        hi = float("inf") if end is None else float(end)
+        for c_lo, c_hi, closed in self.coverage:
+            if c_lo <= lo and (hi < c_hi or (hi == c_hi and closed)):
+                return True
+        return False
+
+    def finish(self):
+        merged_ranges: List[Tuple[float, float, bool]] = []
+        for lo, hi, closed in sorted(self.coverage):
+            if merged_ranges and lo <= merged_ranges[-1][1]:
+                p_lo, p_hi, p_closed = merged_ranges[-1]
+                if hi > p_hi:
+                    merged_ranges[-1] = (p_lo, hi, closed)
+                elif hi == p_hi:
+                    merged_ranges[-1] = (p_lo, p_hi, p_closed or closed)
+                continue
+            merged_ranges.append((lo, hi, closed))
+        self.coverage = merged_ranges
+        # Pages from different runs (serial, sliced, windowed) may overlap. An event is
+        # kept as many times as the page holding the most copies of it has it.
+        merged: List[Dict[str, Any]] = []
+        kept: Counter = Counter()
+        for _, events in sorted(self.pages, key=lambda p: p[0]):
+            seen: Counter = Counter()
+            for e in events:
+                raw = json.dumps(e, sort_keys=True)
+                seen[raw] += 1
+                if seen[raw] > kept[raw]:
+                    kept[raw] += 1
+                    merged.append(e)
+        merged.sort(key=lambda e: e.get("timestamp", 0))
+        self.events = merged
+        self.times = [e.get("timestamp", 0) for e in merged]
+        self.pages = []
+
+    def page(self, start: Optional[float], end: Optional[float], size: int) -> Dict[str, Any]:
+        # Events in [start, end], at most `size` of them, plus the timestamp to continue
+        # from. A page never ends inside a run of equal timestamps, so the next page
+        # starting at nextPageTimestamp neither repeats nor skips an event.
+        lo = 0 if start is None else bisect.bisect_left(self.times, start)
+        hi = len(self.times) if end is None else bisect.bisect_right(self.times, end)
+        n = min(max(1, size), hi - lo)
+        while lo + n < hi and self.times[lo + n] == self.times[lo + n - 1]:
+            n += 1
+        nxt = self.times[lo + n] if lo + n < hi else None
+        return {"data": self.events[lo:lo + n], "nextPageTimestamp": nxt}
+
+
+class Recordings:
+    def __init__(self, page_size: int = PAGE_SIZE_DEFAULT):
+        self.page_size = page_size
+        self.exact: Dict[str, Dict[str, Any]] = {}
+        self.streams: Dict[str, EventStream] = {}
+
+    @classmethod
+    def load(cls, root: str, page_size: int = PAGE_SIZE_DEFAULT) -> "Recordings":
+        rec = cls(page_size)
+        for entry in ResponseLog(root).entries():
+            rec.add(entry["query"], entry.get("variables") or {}, entry["response"])
+        for stream in rec.streams.values():
+            stream.finish()
+        return rec
+
+    def add(self, query: str, variables: Dict[str, Any], response: Dict[str, Any]):
+        code, fields = events_fields(query, variables)
+        if not fields or response.get("errors"):
+            self.exact[cache_key(query, variables)] = response
+            return
+        report = ((response.get("data") or {}).get("reportData") or {}).get("report") or {}
+        for name, args in fields:
+            ev = report.get(name)
+            if ev is not None:
+                self.streams.setdefault(stream_key(code, args), EventStream()).add_page(
+                    args.get("startTime"), args.get("endTime"), ev.get("nextPageTimestamp"), ev.get("data") or [])
+
+    def answer(self, query: str, variables: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # Events queries are re-paginated from the recorded streams; everything else
+        # (and events queries for streams or time ranges never recorded) is replayed verbatim.
+        code, fields = events_fields(query, variables)
+        if fields and all(self.covered(code, args) for _, args in fields):
+            report = {}
+            for name, args in fields:
+                size = int(args.get("limit") or self.page_size)
+                report[name] = self.streams[stream_key(code, args)].page(args.get("startTime"), args.get("endTime"), size)
+            return {"data": {"reportData": {"report": report}}}
+        res = self.exact.get(cache_key(query, variables))
+        if res is None and not variables:
+            res = self.answer_aliased(query)
+        return res
+
+    def covered(self, code: Optional[str], args: Dict[str, Any]) -> bool:
+        stream = self.streams.get(stream_key(code, args))
+        return stream is not None and stream.covers(args.get("startTime"), args.get("endTime"))
+
+    def answer_aliased(self, query: str) -> Optional[Dict[str, Any]]:
+        # A batch of reports recorded with other batch boundaries (or fetched one by one)
+        # is put together from each report's own single-report response.
+        fields = aliased_reports(query)
+        if not fields:
+            return None
+        data: Dict[str, Any] = {}
+        errors = []
+        for alias, field in fields:
+            single = self.exact.get(cache_key(f"query{{reportData{{{field}}}}}"))
+            report = (((single or {}).get("data") or {}).get("reportData") or {}).get("report")
+            data[alias] = report
+            if report is None:
+                errors.append({"message": "wcl_stub_server: no recorded response for this report", "path": ["reportData", alias]})
+        if len(errors) == len(fields):
+            return None
+        return {"data": {"reportData": data}, "errors": errors} if errors else {"data": {"reportData": data}}
+
+
+class Budget:
+    # WCL-style points budget: a fixed allowance per window that resets as a whole.
+    def __init__(self, limit: float, window_seconds: float):
+        self.limit = limit
+        self.window = window_seconds
+        self.spent = 0.0
+        self.window_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _roll(self, now: float):
+        if now - self.window_start >= self.window:
+            self.spent = 0.0
+            self.window_start = now - (now - self.window_start) % self.window
+
+    def spend(self, points: float) -> bool:
+        with self._lock:
+            self._roll(time.monotonic())
+            if self.spent + points > self.limit:
+                return False
+            self.spent += points
+            return True
+
+    def exhaust(self):
+        with self._lock:
+            self._roll(time.monotonic())
+            self.spent = max(self.spent, self.limit)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._roll(now)
+            return {
+                "limitPerHour": self.limit,
+                "pointsSpentThisHour": self.spent,
+                # Whole seconds like WCL, rounded up so a client never sees 0 mid-window.
+                "pointsResetIn": max(1, math.ceil(self.window - (now - self.window_start))),
+            }
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], recordings: Recordings, budget: Budget, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 points_per_request: float = 1.0, token_ttl: float = 3600.0, seed: Optional[int] = None):
+        super().__init__(address, StubHandler)
+        self.recordings = recordings
+        self.budget = budget
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.points_per_request = points_per_request
+        self.token_ttl = token_ttl
+        self.rng = random.Random(seed)
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+        self._tokens = 0
+
+    def roll(self) -> float:
+        with self._lock:
+            return self.rng.random()
+
+    def error_status(self) -> int:
+        with self._lock:
+            return self.rng.choice(ERROR_STATUSES)
+
+    def delay(self) -> float:
+        with self._lock:
+            jitter = self.rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000.0
+
+    def new_token(self) -> str:
+        with self._lock:
+            self._tokens += 1
+            return f"stub-token-{self._tokens}"
+
+    def count(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: StubServer
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+    def send_json(self, status: int, obj: Dict[str, Any]):
+        raw = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+        self.server.count(f"status {status}")
+        self.server.count("bytes out", len(raw))
+        gz = "gzip" in (self.headers.get("Accept-Encoding") or "")
+        if gz:
+            raw = gzip.compress(raw)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if gz:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        server = self.server
+        time.sleep(server.delay())
+        if self.path == TOKEN_PATH:
+            server.count("token")
+            return self.send_json(200, {"access_token": server.new_token(), "token_type": "Bearer",
+                                        "expires_in": server.token_ttl})
+        if self.path != API_PATH:
+            return self.send_json(404, {"error": f"unknown path {self.path}"})
+        if not (self.headers.get("Authorization") or "").startswith("Bearer "):
+            return self.send_json(401, {"error": "missing bearer token"})
+        try:
+            payload = json.loads(body.decode("utf-8"))
+            query, variables = payload["query"], payload.get("variables") or {}
+        except (ValueError, KeyError, TypeError):
+            return self.send_json(400, {"error": "expected a JSON body with query and variables"})
+        if "rateLimitData" in query:
+            server.count("rateLimitData")
+            return self.send_json(200, {"data": {"rateLimitData": server.budget.snapshot()}})
+
+        roll = server.roll()
+        if roll < server.error_rate:
+            return self.send_json(server.error_status(), {"error": "injected server error"})
+        if roll < server.error_rate + server.rate_limit_rate:
+            server.budget.exhaust()
+            return self.send_json(429, {"error": "injected rate limit"})
+        if not server.budget.spend(server.points_per_request):
+            return self.send_json(429, {"error": "points budget exhausted"})
+
+        server.count("queries")
+        res = server.recordings.answer(query, variables)
+        if res is None:
+            server.count("not recorded")
+            res = {"data": None, "errors": [{"message": "wcl_stub_server: no recorded response for this query"}]}
+        self.send_json(200, res)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded WCL API responses locally (record with WCL_RECORD_DIR)")
+    parser.add_argument("--recordings", required=True, help="Directory written by a run with WCL_RECORD_DIR set")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (0 picks a free one)")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE_DEFAULT, help="Events per page when a query has no limit")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random +/- spread around --latency-ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of API requests answered with a 5xx")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of API requests answered with 429")
+    parser.add_argument("--limit-per-hour", type=float, default=3600.0, help="Points budget per window")
+    parser.add_argument("--points-per-request", type=float, default=1.0, help="Points each API request costs")
+    parser.add_argument("--hour-seconds", type=float, default=3600.0, help="Length of the budget window, shorten for tests")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latency jitter and fault injection")
+    args = parser.parse_args()
+
+    recordings = Recordings.load(args.recordings, args.page_size)
+    if not recordings.exact and not recordings.streams:
+        parser.error(f"no recorded responses in {args.recordings}")
+    server = StubServer(
+        (args.host, args.port), recordings, Budget(args.limit_per_hour, args.hour_seconds),
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, points_per_request=args.points_per_request, seed=args.seed,
+    )
+    host, port = server.server_address[:2]
+    print(f"Serving {len(recordings.exact)} recorded responses ({len(recordings.streams)} event streams) "
+          f"on http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for key, value in sorted(server.stats.items()):
+            print(f"  {key}: {value}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,21 @@
-﻿import json, os, re, sys, urllib.request, urllib.parse
+﻿import hashlib, json, os, re, sys, threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import count
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, Iterator, List, Any, Optional, Tuple
+
+import wcl_client
+from wcl_client import (
+    PageDecoder, WclGraphQLError, WclHttpError, cache_lookup, cache_store, format_metrics_report, format_rate_report,
+    get_token, gql, paginate_events, rate_limit_report, rate_stage, write_metrics_report,
+)
+from wcl_cache import write_atomic, write_text_if_changed
+from wcl_event_store import MISSING, FightEvents
 
 CONFIG_DEFAULT = os.path.join('WCL_Parser', 'wcl_timers.json')
 OUT_DEFAULT = os.path.join('WCL_Parser', 'LorrgsTimers_generated.lua')
+# Bump when aggregation changes so every cell is rebuilt once.
+MANIFEST_VERSION = 1
 
 
 def eprint(*args, **kwargs):
@@ -19,55 +31,71 @@ def read_text_no_bom(path: str) -> str:
     return Path(path).read_text(encoding="utf-8-sig")
 
 
-def write_text_no_bom(path: str, text: str):
-    if text.startswith("\ufeff"):
-        text = text.lstrip("\ufeff")
-    Path(path).write_text(text, encoding="utf-8")
-
-
-def get_env(name: str) -> str:
-    val = os.environ.get(name)
-    if not val:
-        raise RuntimeError(f"Missing env var {name}")
-    return val
+def normalize_name(s: str) -> str:
+    return re.sub(r'[^a-z0-9]+', '', s.lower())
 
 
-def get_token() -> str:
-    data = urllib.parse.urlencode({
-        'grant_type': 'client_credentials',
-        'client_id': get_env('WCL_CLIENT_ID'),
-        'client_secret': get_env('WCL_CLIENT_SECRET'),
-    }).encode('utf-8')
-    req = urllib.request.Request(
-        'https://www.warcraftlogs.com/oauth/token',
-        data=data,
-        headers={'Content-Type': 'application/x-www-form-urlencoded'}
-    )
-    with urllib.request.urlopen(req) as resp:
-        return json.loads(resp.read().decode('utf-8'))['access_token']
-
-
-def gql(token: str, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    payload = {'query': query}
-    if variables:
-        payload['variables'] = variables
-    body = json.dumps(payload).encode('utf-8')
-    req = urllib.request.Request(
-        'https://www.warcraftlogs.com/api/v2/client',
-        data=body,
-        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'}
-    )
-    with urllib.request.urlopen(req) as resp:
-        return json.loads(resp.read().decode('utf-8'))
+# Partial boss names are found through substrings of this length (and shorter ones
+# for queries shorter than it).
+BOSS_NGRAM = 3
+
+
+class BossNpcMap(dict):
+    # Normalized boss name -> NPC ids, in unitIsBossList order. Exact names are one dict
+    # hit; partial names go through an n-gram index built on first use. Read-only.
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._names: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._grams: Optional[Dict[str, List[int]]] = None
+
+    def _gram_index(self) -> Dict[str, List[int]]:
+        if self._grams is None:
+            self._names = list(self)
+            self._positions = {name: pos for pos, name in enumerate(self._names)}
+            grams: Dict[str, List[int]] = {}
+            for pos, name in enumerate(self._names):
+                seen = set()
+                for size in range(1, BOSS_NGRAM + 1):
+                    for k in range(len(name) - size + 1):
+                        gram = name[k:k + size]
+                        if gram not in seen:
+                            seen.add(gram)
+                            grams.setdefault(gram, []).append(pos)
+            self._grams = grams
+        return self._grams
+
+    def best_match(self, en: str) -> Optional[List[int]]:
+        # Longest boss name that contains `en` or is contained in it, first in file order
+        # on ties; same answer as comparing `en` against every name.
+        if en in self:
+            return self[en]
+        grams = self._gram_index()
+        if not en:
+            containing: List[int] = list(range(len(self._names)))
+        elif len(en) <= BOSS_NGRAM:
+            containing = grams.get(en, [])
+        else:
+            rarest = min((grams.get(en[k:k + BOSS_NGRAM], []) for k in range(len(en) - BOSS_NGRAM + 1)), key=len)
+            containing = [pos for pos in rarest if en in self._names[pos]]
+        if containing:
+            # Names containing `en` are at least as long as any name inside it.
+            best = max(containing, key=lambda pos: (len(self._names[pos]), -pos))
+            return self[self._names[best]]
+        # Otherwise the longest name inside `en`: look its substrings up, longest first.
+        for size in range(len(en) - 1, 0, -1):
+            found = [self._positions[en[k:k + size]] for k in range(len(en) - size + 1) if en[k:k + size] in self]
+            if found:
+                return self[self._names[min(found)]]
+        return None
 
 
-def normalize_name(s: str) -> str:
-    return re.sub(r'[^a-z0-9]+', '', s.lower())
+_boss_maps: Dict[Tuple[str, int, int], BossNpcMap] = {}
 
 
-def load_boss_npc_map(path: str) -> Dict[str, List[int]]:
+def parse_boss_npc_list(path: str) -> BossNpcMap:
     rx = re.compile(r'\[(\d+)\]\s*=\s*{\s*name\s*=\s*"([^"]+)"')
-    mapping: Dict[str, List[int]] = {}
+    mapping = BossNpcMap()
     with open(path, 'r', encoding='utf-8') as f:
         for line in f:
             m = rx.search(line)
@@ -80,70 +108,213 @@ def load_boss_npc_map(path: str) -> Dict[str, List[int]]:
     return mapping
 
 
-def resolve_encounter(token: str, zone_id: int, entry: Any) -> Dict[str, Any]:
+def load_boss_npc_map(path: str, cache_root: Optional[str] = None) -> BossNpcMap:
+    # Parsed once per version of the file (mtime + size): memoized in process and, with a
+    # cache_root, stored as JSON so later runs skip the Lua scan.
+    st = os.stat(path)
+    abs_path = os.path.abspath(path)
+    key = (abs_path, st.st_mtime_ns, st.st_size)
+    mapping = _boss_maps.get(key)
+    if mapping is not None:
+        return mapping
+    cache_file = None
+    if cache_root:
+        digest = hashlib.sha256(abs_path.encode('utf-8')).hexdigest()[:16]
+        cache_file = os.path.join(cache_root, f"bossnpc-{digest}.json")
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('mtime_ns') == st.st_mtime_ns and data.get('size') == st.st_size:
+                mapping = BossNpcMap((name, ids) for name, ids in data['names'])
+        except (OSError, ValueError, KeyError, TypeError):
+            mapping = None
+    if mapping is None:
+        mapping = parse_boss_npc_list(path)
+        if cache_file:
+            data = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'names': list(mapping.items())}
+            try:
+                write_atomic(cache_file, json.dumps(data).encode('utf-8'))
+            except OSError:
+                pass
+    _boss_maps[key] = mapping
+    return mapping
+
+
+def fetch_zone(token: str, zone_id: int) -> Dict[str, Any]:
     query = f'query {{ worldData {{ zone(id: {zone_id}) {{ id name encounters {{ id name }} }} }} }}'
     data = gql(token, query)
     zone = data.get('data', {}).get('worldData', {}).get('zone')
     if not zone:
         raise RuntimeError(f"Zone {zone_id} not found in worldData")
-    encounters = zone.get('encounters', [])
-    by_norm = {normalize_name(e['name']): e for e in encounters}
+    return zone
 
-    if isinstance(entry, dict):
-        name = entry.get('name')
-    else:
-        name = entry
-    if isinstance(name, int):
-        match = next((e for e in encounters if e['id'] == name), None)
-        if not match:
-            raise RuntimeError(f"Encounter id {name} not found in zone {zone_id}")
-        return match
-    key = normalize_name(str(name))
-    if key in by_norm:
-        return by_norm[key]
-    match = None
-    for e in encounters:
-        en = normalize_name(e['name'])
-        if key in en or en in key:
-            match = e
-            break
-    if not match:
-        raise RuntimeError(f"Encounter '{name}' not found in zone {zone_id}")
-    return match
+
+class ZoneIndex:
+    # Encounter lookup for one zone: O(1) by id or normalized name, with the
+    # original substring match as the fallback for partial names.
+    def __init__(self, zone: Dict[str, Any]):
+        self.zone_id = int(zone['id'])
+        self.encounters: List[Dict[str, Any]] = zone.get('encounters', [])
+        self.by_id = {int(e['id']): e for e in self.encounters}
+        self.by_norm = {normalize_name(e['name']): e for e in self.encounters}
+
+    def resolve(self, entry: Any) -> Dict[str, Any]:
+        if isinstance(entry, dict):
+            name = entry.get('name')
+        else:
+            name = entry
+        if isinstance(name, int):
+            match = self.by_id.get(name)
+            if not match:
+                raise RuntimeError(f"Encounter id {name} not found in zone {self.zone_id}")
+            return match
+        if isinstance(name, str) and name.strip().isdigit() and int(name) in self.by_id:
+            return self.by_id[int(name)]
+        key = normalize_name(str(name))
+        if key in self.by_norm:
+            return self.by_norm[key]
+        for e in self.encounters:
+            en = normalize_name(e['name'])
+            if key in en or en in key:
+                return e
+        raise RuntimeError(f"Encounter '{name}' not found in zone {self.zone_id}")
+
+
+_zone_indexes: Dict[int, ZoneIndex] = {}
+_zone_lock = threading.Lock()
+
+
+def get_zone_index(token: str, zone_id: int) -> ZoneIndex:
+    # One worldData.zone request per zone per run; the response cache keeps it across runs.
+    zone_id = int(zone_id)
+    with _zone_lock:
+        index = _zone_indexes.get(zone_id)
+        if index is None:
+            index = ZoneIndex(fetch_zone(token, zone_id))
+            _zone_indexes[zone_id] = index
+        return index
+
+
+def resolve_encounter(token: str, zone_id: int, entry: Any) -> Dict[str, Any]:
+    return get_zone_index(token, zone_id).resolve(entry)
 
 
 def resolve_npc_id(encounter_name: str, npc_map: Dict[str, List[int]], override_npc_id: Optional[int] = None) -> int:
     if override_npc_id:
         return int(override_npc_id)
-    en = normalize_name(encounter_name)
-    if en in npc_map:
-        return npc_map[en][0]
-    best = None
-    best_len = 0
-    for name_norm, ids in npc_map.items():
-        if name_norm in en or en in name_norm:
-            if len(name_norm) > best_len:
-                best = ids[0]
-                best_len = len(name_norm)
-    if best is not None:
-        return best
+    if not isinstance(npc_map, BossNpcMap):
+        npc_map = BossNpcMap(npc_map)
+    ids = npc_map.best_match(normalize_name(encounter_name))
+    if ids is not None:
+        return ids[0]
     raise RuntimeError(f"No NPC id match for encounter '{encounter_name}'. Provide npcId in config.")
 
 
-def choose_rankings(token: str, encounter_id: int, class_name: str, spec_name: str, difficulty_id: int, metric: str, top_n: int) -> List[Dict[str, Any]]:
-    query = (
-        'query { worldData { encounter(id: %d) { '
-        'characterRankings(difficulty:%d, className:"%s", specName:"%s", metric:%s, page:1) '
-        '} } }'
-    ) % (encounter_id, difficulty_id, class_name, spec_name, metric)
-    res = gql(token, query)
-    rankings = res['data']['worldData']['encounter']['characterRankings']['rankings']
+RANKINGS_MAX_PAGES = 10
+RANKINGS_BATCH_SIZE = 16
+
+
+def rankings_field(encounter_id: int, difficulty_id: int, class_name: str, spec_name: str, metric: str, page: int) -> str:
+    return 'characterRankings(difficulty:%d, className:"%s", specName:"%s", metric:%s, page:%d)' % (
+        difficulty_id, class_name, spec_name, metric, page
+    )
+
+
+def rankings_query(encounter_id: int, difficulty_id: int, class_name: str, spec_name: str, metric: str, page: int) -> str:
+    field = rankings_field(encounter_id, difficulty_id, class_name, spec_name, metric, page)
+    return 'query { worldData { encounter(id: %d) { %s } } }' % (encounter_id, field)
+
+
+def public_rankings(rankings: List[Dict[str, Any]], top_n: int) -> List[Dict[str, Any]]:
     public = []
     for r in rankings:
         if not r.get('hidden') and not str(r.get('report', {}).get('code', '')).startswith('a:'):
             public.append(r)
         if len(public) >= top_n:
             break
+    return public
+
+
+def fetch_rankings_bulk(
+    token: str,
+    encounter_ids: List[int],
+    difficulty_ids: List[int],
+    class_name: str,
+    spec_name: str,
+    metric: str,
+    top_n: int,
+    max_pages: int = RANKINGS_MAX_PAGES,
+    workers: int = 4,
+) -> Dict[Tuple[int, int], List[Dict[str, Any]]]:
+    # Page 1 of every encounter x difficulty goes out as one aliased worldData
+    # query. Further pages are only requested for cells where hidden/anonymous
+    # logs left fewer than top_n public ones, sized from the public ratio seen so
+    # far, and sent together (several documents in parallel). Pages are cached
+    # under the same key as the single-page query.
+    keys = list(dict.fromkeys((int(e), int(d)) for e in encounter_ids for d in difficulty_ids))
+    rankings: Dict[Tuple[int, int], List[Dict[str, Any]]] = {k: [] for k in keys}
+    wanted: List[Tuple[int, int, int]] = [(e, d, 1) for e, d in keys]
+
+    def fetch_batch(batch: List[Tuple[int, int, int]]) -> Dict[Tuple[int, int, int], Dict[str, Any]]:
+        by_enc: Dict[int, List[Tuple[int, int]]] = {}
+        for e, d, page in batch:
+            by_enc.setdefault(e, []).append((d, page))
+        fields = ' '.join(
+            'e%d: encounter(id: %d) { %s }' % (e, e, ' '.join(
+                'd%dp%d: %s' % (d, page, rankings_field(e, d, class_name, spec_name, metric, page)) for d, page in pages
+            ))
+            for e, pages in by_enc.items()
+        )
+        res = gql(token, 'query { worldData { %s } }' % fields, use_cache=False)
+        world = res['data']['worldData']
+        out = {}
+        for e, d, page in batch:
+            data = world['e%d' % e]['d%dp%d' % (d, page)]
+            out[(e, d, page)] = data
+            cache_store(rankings_query(e, d, class_name, spec_name, metric, page), None,
+                        {'data': {'worldData': {'encounter': {'characterRankings': data}}}})
+        return out
+
+    while wanted:
+        pages: Dict[Tuple[int, int, int], Dict[str, Any]] = {}
+        misses: List[Tuple[int, int, int]] = []
+        for e, d, page in wanted:
+            cached = cache_lookup(rankings_query(e, d, class_name, spec_name, metric, page))
+            if cached is not None:
+                pages[(e, d, page)] = cached['data']['worldData']['encounter']['characterRankings']
+            else:
+                misses.append((e, d, page))
+        batches = [misses[i:i + RANKINGS_BATCH_SIZE] for i in range(0, len(misses), RANKINGS_BATCH_SIZE)]
+        if len(batches) > 1 and workers > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+                for result in pool.map(fetch_batch, batches):
+                    pages.update(result)
+        else:
+            for batch in batches:
+                pages.update(fetch_batch(batch))
+
+        next_wanted: List[Tuple[int, int, int]] = []
+        last_page: Dict[Tuple[int, int], Tuple[int, bool, int]] = {}
+        for e, d, page in sorted(pages):
+            data = pages[(e, d, page)] or {}
+            rows = data.get('rankings') or []
+            rankings[(e, d)].extend(rows)
+            last_page[(e, d)] = (page, bool(data.get('hasMorePages')), len(rows))
+        for key, (page, has_more, page_rows) in last_page.items():
+            rows = rankings[key]
+            public = len(public_rankings(rows, top_n))
+            if public >= top_n or not has_more or page >= max_pages:
+                continue
+            ratio = max(public / len(rows), 0.1) if rows else 1.0
+            extra = -(-int((top_n - public) / ratio) // max(page_rows, 1))
+            for p in range(page + 1, min(page + max(extra, 1), max_pages) + 1):
+                next_wanted.append((key[0], key[1], p))
+        wanted = next_wanted
+    return rankings
+
+
+def select_rankings(rankings: List[Dict[str, Any]], top_n: int) -> List[Dict[str, Any]]:
+    public = public_rankings(rankings, top_n)
     if public:
         return public
     if not rankings:
@@ -151,19 +322,78 @@ def choose_rankings(token: str, encounter_id: int, class_name: str, spec_name: s
     return rankings[:top_n]
 
 
+FIGHT_INFO_BATCH_SIZE = 25
+
+
+def fight_info_fields(report_code: str, fight_id: int) -> str:
+    # Callers read each player's id, name, type and specs, which playerDetails returns
+    # without combatant info; that only adds gear, talents and stats.
+    return (
+        f'report(code: {json.dumps(report_code)}) {{ '
+        f'fights(fightIDs: [{fight_id}]) {{ id startTime endTime encounterID difficulty kill }} '
+        f'playerDetails(fightIDs: [{fight_id}], includeCombatantInfo: false) }}'
+    )
+
+
+def fight_info_query(report_code: str, fight_id: int) -> str:
+    return f'query {{ reportData {{ {fight_info_fields(report_code, fight_id)} }} }}'
+
+
 def get_fight_info(token: str, report_code: str, fight_id: int) -> Dict[str, Any]:
-    query = f'''query {{
-      reportData {{
-        report(code: "{report_code}") {{
-          fights(fightIDs: [{fight_id}]) {{ id startTime endTime encounterID difficulty kill }}
-          playerDetails(fightIDs: [{fight_id}], includeCombatantInfo: false)
-        }}
-      }}
-    }}'''
-    res = gql(token, query)
+    res = gql(token, fight_info_query(report_code, fight_id))
     return res['data']['reportData']['report']
 
 
+def get_fight_infos(
+    token: str,
+    pairs: List[Tuple[str, int]],
+    chunk_size: Optional[int] = None,
+) -> Dict[Tuple[str, int], Dict[str, Any]]:
+    # Resolves many (report_code, fight_id) pairs with aliased multi-report queries.
+    # Each result is cached under its single get_fight_info query, so batched and
+    # single lookups share entries. Pairs WCL refuses (private, deleted) are left
+    # out and logged; callers fall back to get_fight_info to surface the error.
+    out: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    missing: List[Tuple[str, int]] = []
+    for code, fight_id in dict.fromkeys((str(c), int(f)) for c, f in pairs):
+        cached = cache_lookup(fight_info_query(code, fight_id))
+        if cached is not None:
+            out[(code, fight_id)] = cached['data']['reportData']['report']
+        else:
+            missing.append((code, fight_id))
+
+    # Automatic sizing: start large and halve whenever a whole batch is rejected
+    # (query complexity, payload size), keeping the smaller size for the rest.
+    # Transport, auth and server failures are raised: a smaller batch would fail the same way.
+    size = max(1, int(chunk_size or FIGHT_INFO_BATCH_SIZE))
+    pos = 0
+    while pos < len(missing):
+        chunk = missing[pos:pos + size]
+        fields = ' '.join(f'r{i}: {fight_info_fields(code, fid)}' for i, (code, fid) in enumerate(chunk))
+        try:
+            res = gql(token, f'query {{ reportData {{ {fields} }} }}', use_cache=False, allow_errors=True)
+        except (WclGraphQLError, WclHttpError) as exc:
+            if isinstance(exc, WclHttpError) and exc.status != 413:
+                raise
+            if size == 1:
+                code, fid = chunk[0]
+                eprint(f"Fight info for {code}:{fid} was rejected: {exc}")
+                pos += 1
+                continue
+            size = max(1, size // 2)
+            continue
+        report_data = (res.get('data') or {}).get('reportData') or {}
+        for i, (code, fid) in enumerate(chunk):
+            report = report_data.get(f'r{i}')
+            if not report or not report.get('fights'):
+                eprint(f"Fight info for {code}:{fid} was not returned")
+                continue
+            out[(code, fid)] = report
+            cache_store(fight_info_query(code, fid), None, {'data': {'reportData': {'report': report}}})
+        pos += len(chunk)
+    return out
+
+
 def find_player_id(report: Dict[str, Any], player_name: str, class_name: str) -> int:
     details = report['playerDetails']['data']['playerDetails']
     for role in ('healers', 'dps', 'tanks'):
@@ -173,29 +403,31 @@ def find_player_id(report: Dict[str, Any], player_name: str, class_name: str) ->
     raise RuntimeError(f"Player {player_name} ({class_name}) not found in report")
 
 
-def fetch_casts(token: str, report_code: str, fight_id: int, source_id: int, spell_ids: List[int]) -> List[Dict[str, Any]]:
-    filter_expr = ' or '.join([f"ability.id={sid}" for sid in spell_ids])
-    query = '''query($code:String!, $fightIDs:[Int], $sourceID:Int, $start:Float, $filter:String) {
+def fetch_casts(
+    token: str,
+    report_code: str,
+    fight_id: int,
+    source_id: Optional[int],
+    spell_ids: List[int],
+    start_time: Optional[float] = None,
+    end_time: Optional[float] = None,
+    decode: Optional[PageDecoder] = None,
+) -> List[Any]:
+    # With the fight bounds known, long fights can be paged in parallel time slices (see --event-slices).
+    # No spell ids means the source's whole cast log. `decode` is applied per page (see paginate_events).
+    filter_expr = ' or '.join([f"ability.id={sid}" for sid in spell_ids]) or None
+    query = '''query($code:String!, $fightIDs:[Int], $sourceID:Int, $start:Float, $end:Float, $filter:String) {
       reportData {
         report(code:$code) {
-          events(dataType:Casts, fightIDs:$fightIDs, sourceID:$sourceID, startTime:$start, filterExpression:$filter, useAbilityIDs:true) {
+          events(dataType:Casts, fightIDs:$fightIDs, sourceID:$sourceID, startTime:$start, endTime:$end, filterExpression:$filter, useAbilityIDs:true) {
             data
             nextPageTimestamp
           }
         }
       }
     }'''
-    start = None
-    all_events = []
-    while True:
-        vars = {'code': report_code, 'fightIDs': [fight_id], 'sourceID': source_id, 'start': start, 'filter': filter_expr}
-        res = gql(token, query, vars)
-        ev = res['data']['reportData']['report']['events']
-        all_events.extend(ev['data'])
-        if not ev.get('nextPageTimestamp'):
-            break
-        start = ev['nextPageTimestamp']
-    return all_events
+    variables = {'code': report_code, 'fightIDs': [fight_id], 'sourceID': source_id, 'filter': filter_expr}
+    return paginate_events(token, query, variables, start=start_time, end=end_time, decode=decode)
 
 
 def format_times(events: List[Dict[str, Any]], fight_start: float) -> List[str]:
@@ -212,16 +444,15 @@ def format_times(events: List[Dict[str, Any]], fight_start: float) -> List[str]:
     return times
 
 
-def format_times_by_spell(events: List[Dict[str, Any]], fight_start: float) -> Dict[int, List[float]]:
+def format_times_by_spell(events: FightEvents, fight_start: float) -> Dict[int, List[float]]:
     by_spell: Dict[int, List[float]] = {}
-    for e in events:
-        sid = e.get('abilityGameID')
-        if not sid:
+    for ts, sid in events.rows('timestamp', 'abilityGameID'):
+        if not sid or sid == MISSING or ts == MISSING:
             continue
-        offset = (e['timestamp'] - fight_start) / 1000.0
+        offset = (ts - fight_start) / 1000.0
         if offset < 0:
             continue
-        by_spell.setdefault(int(sid), []).append(offset)
+        by_spell.setdefault(sid, []).append(offset)
     for sid, arr in by_spell.items():
         arr.sort()
     return by_spell
@@ -247,42 +478,71 @@ def aggregate_median_per_index(time_lists: List[List[float]]) -> List[float]:
     return out
 
 
+def _majority_span(sorted_vals: List[float], start: int, end: int, window_seconds: float) -> Tuple[int, int]:
+    # Densest cluster of the sorted run sorted_vals[start:end], as a [lo, hi) span.
+    # Members of an anchor are a contiguous run of the sorted values and both ends only move
+    # forward as the anchor does, so two pointers find every anchor's cluster in O(n).
+    # Ties: more members, then smaller range, then strictly smaller middle member; the
+    # first anchor in sorted order wins otherwise.
+    if not window_seconds >= 0:
+        return start, end
+    lo = hi = best_lo = best_hi = start
+    for anchor in sorted_vals[start:end]:
+        # lo never passes the anchor and hi never trails it, so no abs() is needed.
+        while anchor - sorted_vals[lo] > window_seconds:
+            lo += 1
+        if hi < lo:
+            hi = lo
+        while hi < end and sorted_vals[hi] - anchor <= window_seconds:
+            hi += 1
+        count, best_count = hi - lo, best_hi - best_lo
+        if count > best_count:
+            best_lo, best_hi = lo, hi
+            continue
+        if count == best_count:
+            cur_range = sorted_vals[hi - 1] - sorted_vals[lo]
+            best_range = sorted_vals[best_hi - 1] - sorted_vals[best_lo]
+            if cur_range < best_range:
+                best_lo, best_hi = lo, hi
+            elif cur_range == best_range and sorted_vals[lo + count // 2] < sorted_vals[best_lo + count // 2]:
+                best_lo, best_hi = lo, hi
+    return best_lo, best_hi
+
+
 def pick_majority_cluster(values: List[float], window_seconds: float) -> List[float]:
     # Find the densest cluster where values are within +/- window_seconds of an anchor value.
     # This avoids blending distinct strategies (for example 90s vs 120s timings).
-    if not values:
-        return []
     sorted_vals = sorted(values)
-    best: List[float] = []
-    for anchor in sorted_vals:
-        members = [v for v in sorted_vals if abs(v - anchor) <= window_seconds]
-        if len(members) > len(best):
-            best = members
-            continue
-        if len(members) == len(best) and members:
-            best_range = (best[-1] - best[0]) if best else float("inf")
-            cur_range = members[-1] - members[0]
-            if cur_range < best_range:
-                best = members
-            elif cur_range == best_range:
-                # deterministic tie-breaker
-                if members[len(members) // 2] < best[len(best) // 2]:
-                    best = members
-    return best or sorted_vals
+    lo, hi = _majority_span(sorted_vals, 0, len(sorted_vals), window_seconds)
+    return sorted_vals[lo:hi]
+
+
+def pick_majority_clusters(time_lists: List[List[float]], window_seconds: float) -> List[List[float]]:
+    # Batch form over every cast index of a spell: cluster i is pick_majority_cluster of the
+    # i-th cast time of every log that has one. All columns share one buffer, laid out as
+    # consecutive runs that are each sorted in place and swept by offset.
+    buf: List[float] = []
+    bounds: List[int] = [0]
+    live = [lst for lst in time_lists if lst]
+    i = 0
+    while live:
+        buf.extend(lst[i] for lst in live)
+        bounds.append(len(buf))
+        i += 1
+        live = [lst for lst in live if len(lst) > i]
+    clusters: List[List[float]] = []
+    for start, end in zip(bounds, bounds[1:]):
+        buf[start:end] = sorted(buf[start:end])
+        lo, hi = _majority_span(buf, start, end, window_seconds)
+        clusters.append(buf[lo:hi])
+    return clusters
 
 
 def aggregate_majority_cluster_per_index(time_lists: List[List[float]], window_seconds: float = 10.0) -> List[float]:
     # For cast index i, select the most common timing cluster then use its median.
-    if not time_lists:
-        return []
-    max_len = max(len(lst) for lst in time_lists)
     out: List[float] = []
-    for i in range(max_len):
-        vals = [lst[i] for lst in time_lists if len(lst) > i]
-        if not vals:
-            continue
-        cluster = pick_majority_cluster(vals, window_seconds)
-        cluster.sort()
+    # Clusters come back sorted.
+    for cluster in pick_majority_clusters(time_lists, window_seconds):
         mid = len(cluster) // 2
         if len(cluster) % 2 == 1:
             out.append(cluster[mid])
@@ -453,33 +713,131 @@ def lua_dsl_table(tbl: Dict[int, List[Dict[str, Any]]]) -> str:
     return "\n".join(lines)
 
 
-def write_lua(
-    path: str,
+def lua_generated_chunks(
     data_by_bucket: Dict[str, Dict[str, Dict[int, Dict[int, List[Dict[str, Any]]]]]],
     boss_names_by_bucket: Optional[Dict[str, Dict[str, Dict[int, str]]]] = None,
-):
-    lines = []
-    lines.append("local generated = {")
+) -> Iterator[str]:
+    # Specs by name and bosses by NPC id, so reruns with a different --spec order or
+    # worker count produce the same file.
+    yield "local generated = {\n"
     for bucket_name in ("dynamicTimers", "dynamicMythic"):
         bucket = data_by_bucket.get(bucket_name, {})
         boss_name_bucket = (boss_names_by_bucket or {}).get(bucket_name, {})
-        lines.append(f"    {bucket_name} = {{")
-        for spec, bosses in bucket.items():
+        yield f"    {bucket_name} = {{\n"
+        for spec in sorted(bucket):
+            bosses = bucket[spec]
             spec_boss_names = boss_name_bucket.get(spec, {})
-            lines.append(f"        [\"{spec}\"] = {{")
-            for boss_id, dsl_tbl in bosses.items():
+            yield f"        [\"{spec}\"] = {{\n"
+            for boss_id in sorted(bosses):
+                dsl_tbl = bosses[boss_id]
                 boss_name = spec_boss_names.get(boss_id)
                 if boss_name:
                     safe_name = str(boss_name).replace("\r", " ").replace("\n", " ").strip()
-                    lines.append(f"            [{boss_id}] = {lua_dsl_table(dsl_tbl)}, -- {safe_name}")
+                    yield f"            [{boss_id}] = {lua_dsl_table(dsl_tbl)}, -- {safe_name}\n"
                 else:
-                    lines.append(f"            [{boss_id}] = {lua_dsl_table(dsl_tbl)},")
-            lines.append("        },")
-        lines.append("    },")
-    lines.append("}")
-    lines.append("")
-    lines.append("return generated")
-    write_text_no_bom(path, "\n".join(lines))
+                    yield f"            [{boss_id}] = {lua_dsl_table(dsl_tbl)},\n"
+            yield "        },\n"
+        yield "    },\n"
+    yield "}\n"
+    yield "\n"
+    yield "return generated"
+
+
+def write_lua(
+    path: str,
+    data_by_bucket: Dict[str, Dict[str, Dict[int, Dict[int, List[Dict[str, Any]]]]]],
+    boss_names_by_bucket: Optional[Dict[str, Dict[str, Dict[int, str]]]] = None,
+) -> bool:
+    # Left untouched (same mtime) when the content is unchanged, so the addon side
+    # only reloads real changes.
+    return write_text_if_changed(path, lua_generated_chunks(data_by_bucket, boss_names_by_bucket))
+
+
+# Structural tokens of a Lua source: comments and strings are matched whole so braces
+# and anchors inside them are never seen, plus the braces themselves. Long brackets
+# are closed with str.find. Everything between tokens is plain code.
+LUA_TOKEN_RE = re.compile(r"""
+    --\[(?P<comment>=*)\[
+  | --[^\n]*
+  | \[(?P<long>=*)\[
+  | "(?:[^"\\\n]|\\[\s\S])*"
+  | '(?:[^'\\\n]|\\[\s\S])*'
+  | [{}]
+""", re.VERBOSE)
+
+
+def _lua_name_before(src: str, end: int) -> str:
+    # The identifier (dots allowed) ending right at src[end].
+    start = end
+    while start > 0 and (src[start - 1].isalnum() or src[start - 1] in '_.'):
+        start -= 1
+    name = src[start:end]
+    return name if name and (name[0].isalpha() or name[0] == '_') else ''
+
+
+class LuaIndex:
+    # Brace pairs and table anchors of a Lua source, from one tokenizing pass:
+    #   close_of[open]          matching "}" of every "{"
+    #   assignments[name]       "{" of the first `name = {`
+    #   fields[open][key]       ("[" position, "{") of the first `["key"] = {` directly inside table `open`
+    # Anchors are read from the code just before each "{".
+    def __init__(self, src: str):
+        self.close_of: Dict[int, int] = {}
+        self.assignments: Dict[str, int] = {}
+        self.fields: Dict[int, Dict[str, Tuple[int, int]]] = {}
+        stack: List[int] = []
+        code_start = 0
+        last_string: Optional[Tuple[int, int]] = None
+        pos = 0
+        while True:
+            m = LUA_TOKEN_RE.search(src, pos)
+            if m is None:
+                break
+            tok = m.group(0)
+            pos = m.end()
+            level = m.group('comment') if m.group('comment') is not None else m.group('long')
+            if level is not None:
+                closing = src.find(']' + level + ']', pos)
+                pos = len(src) if closing == -1 else closing + len(level) + 2
+            if tok[0] in '"\'':
+                last_string = (m.start(), pos)
+                code_start = pos
+                continue
+            if tok != '{' and tok != '}':
+                last_string = None
+                code_start = pos
+                continue
+
+            if tok == '{':
+                self._anchor(src, code_start, m.start(), last_string, stack)
+                stack.append(m.start())
+            else:
+                if not stack:
+                    raise RuntimeError("Unbalanced braces")
+                self.close_of[stack.pop()] = m.start()
+            last_string = None
+            code_start = pos
+        if stack:
+            raise RuntimeError("Unbalanced braces")
+
+    def _anchor(self, src: str, code_start: int, brace: int, last_string: Optional[Tuple[int, int]], stack: List[int]):
+        code = src[code_start:brace].rstrip()
+        if not code.endswith('=') or code[-2:-1] in ('=', '~', '<', '>'):
+            return
+        code = code[:-1].rstrip()
+        if code.lstrip() == ']' and last_string is not None and stack:
+            # ["key"] = {   (the key is the string token before this code)
+            key_start, key_end = last_string
+            bracket = key_start - 1
+            while bracket >= 0 and src[bracket] in ' \t\r\n':
+                bracket -= 1
+            if bracket >= 0 and src[bracket] == '[':
+                key = src[key_start + 1:key_end - 1]
+                self.fields.setdefault(stack[-1], {}).setdefault(key, (bracket, brace))
+            return
+        name = _lua_name_before(code, len(code))
+        if name:
+            self.assignments.setdefault(name, brace)
 
 
 def upsert_specs_into_main(
@@ -489,33 +847,14 @@ def upsert_specs_into_main(
 ):
     text = read_text_no_bom(main_path)
 
-    def find_range(src: str, open_idx: int) -> Tuple[int, int]:
-        brace = 0
-        for idx in range(open_idx, len(src)):
-            if src[idx] == "{":
-                brace += 1
-            elif src[idx] == "}":
-                brace -= 1
-                if brace == 0:
-                    return open_idx, idx
-        raise RuntimeError("Unbalanced braces")
-
-    def find_block_bounds(src: str, name: str) -> Tuple[int, int]:
-        marker = f"LorrgsTimers.{name} = {{"
-        start = src.find(marker)
-        if start == -1:
-            raise RuntimeError(f"Could not find {name} block in {main_path}")
-        open_idx = src.find("{", start)
-        _, close_idx = find_range(src, open_idx)
-        return open_idx, close_idx
-
     def build_spec_block(
         spec: str,
         bosses: Dict[int, Dict[int, List[Dict[str, Any]]]],
         boss_names: Optional[Dict[int, str]] = None,
     ) -> str:
         lines = [f'    ["{spec}"] = {{']
-        for boss_id, dsl_tbl in bosses.items():
+        for boss_id in sorted(bosses):
+            dsl_tbl = bosses[boss_id]
             boss_name = (boss_names or {}).get(boss_id)
             if boss_name:
                 safe_name = str(boss_name).replace("\r", " ").replace("\n", " ").strip()
@@ -525,48 +864,50 @@ def upsert_specs_into_main(
         lines.append("    },")
         return "\n".join(lines)
 
-    def replace_or_insert_spec(src: str, block_open: int, block_close: int, spec: str, spec_block: str) -> str:
-        spec_anchor = f'["{spec}"] = {{'
-        search_start = block_open
-        while True:
-            i = src.find(spec_anchor, search_start, block_close)
-            if i == -1:
-                # insert before block close
-                return src[:block_close] + "\n" + spec_block + "\n" + src[block_close:]
-            # validate this spec is at top-level depth inside block
-            depth = 0
-            for k in range(block_open, i):
-                if src[k] == "{":
-                    depth += 1
-                elif src[k] == "}":
-                    depth -= 1
-            if depth == 1:
-                spec_open = src.find("{", i)
-                _, spec_close = find_range(src, spec_open)
-                # include trailing comma after spec block, if present
-                after = spec_close + 1
-                while after < len(src) and src[after] in " \t\r\n":
-                    after += 1
-                if after < len(src) and src[after] == ",":
-                    after += 1
-                return src[:i] + spec_block + src[after:]
-            search_start = i + len(spec_anchor)
-
-    out = text
+    # Index the file once, collect every replacement as (start, end, text) against the
+    # original text, then splice them all in one pass.
+    index = LuaIndex(text)
+    edits: List[Tuple[int, int, str]] = []
     for bucket_name in ("dynamicTimers", "dynamicMythic"):
         bucket = data_by_bucket.get(bucket_name, {})
         boss_name_bucket = (boss_names_by_bucket or {}).get(bucket_name, {})
         if not bucket:
             continue
 
-        open_idx, close_idx = find_block_bounds(out, bucket_name)
-        # process each spec and recalc bounds after each mutation
-        for spec, bosses in bucket.items():
+        block_open = index.assignments.get(f"LorrgsTimers.{bucket_name}")
+        if block_open is None:
+            raise RuntimeError(f"Could not find {bucket_name} block in {main_path}")
+        block_close = index.close_of[block_open]
+        fields = index.fields.get(block_open, {})
+        for spec in sorted(bucket):
+            bosses = bucket[spec]
             spec_block = build_spec_block(spec, bosses, boss_name_bucket.get(spec))
-            out = replace_or_insert_spec(out, open_idx, close_idx, spec, spec_block)
-            open_idx, close_idx = find_block_bounds(out, bucket_name)
-
-    write_text_no_bom(main_path, out)
+            if spec not in fields:
+                # insert before block close
+                edits.append((block_close, block_close, "\n" + spec_block + "\n"))
+                continue
+            spec_start, spec_open = fields[spec]
+            # The new block carries its own indentation; replace the old one with it.
+            line_start = text.rfind("\n", 0, spec_start) + 1
+            if not text[line_start:spec_start].strip():
+                spec_start = line_start
+            # include trailing comma after spec block, if present
+            after = index.close_of[spec_open] + 1
+            while after < len(text) and text[after] in " \t\r\n":
+                after += 1
+            if after < len(text) and text[after] == ",":
+                after += 1
+            edits.append((spec_start, after, spec_block))
+
+    parts = []
+    pos = 0
+    # Stable sort keeps several inserts at one block close in spec order.
+    for start, end, new_text in sorted(edits, key=lambda e: e[0]):
+        parts.append(text[pos:start])
+        parts.append(new_text)
+        pos = end
+    parts.append(text[pos:])
+    write_text_if_changed(main_path, parts)
 
 
 def fetch_class_specs(token: str) -> List[Dict[str, Any]]:
@@ -589,6 +930,394 @@ def format_class_specs_md(classes: List[Dict[str, Any]]) -> str:
     return "\n".join(lines).rstrip() + "\n"
 
 
+def plan_cells(
+    token: str,
+    cfg: Dict[str, Any],
+    spec_filter: Optional[set],
+    top_override: Optional[int],
+    npc_map: Dict[str, List[int]],
+) -> List[Dict[str, Any]]:
+    # One cell per spec x encounter x difficulty, in the order the serial run visits them.
+    difficulty_ids = cfg.get('difficultyIds')
+    if difficulty_ids is None:
+        difficulty_ids = [int(cfg.get('difficultyId', 4))]
+    difficulty_ids = [int(d) for d in difficulty_ids]
+    zones = cfg.get('zones', [])
+    specs_cfg = cfg.get('specs', {})
+    top_n = int(cfg.get('topN', 1))
+    if top_override is not None:
+        top_n = int(top_override)
+
+    cells: List[Dict[str, Any]] = []
+    for spec_label, sc in specs_cfg.items():
+        if spec_filter and spec_label not in spec_filter:
+            continue
+        metric = sc.get('metric')
+        if not metric:
+            raise RuntimeError(f"Spec {spec_label} missing metric")
+        spec_top_n = int(sc.get('topN', top_n))
+        if top_override is not None:
+            spec_top_n = int(top_override)
+        default_label = sc.get('label', 'Ramp')
+        default_mode = sc.get('mode', 'toggle')
+        spell_entries = normalize_spell_entries(sc.get('spells', []), default_label, default_mode)
+        if not spell_entries:
+            raise RuntimeError(f"Spec {spec_label} missing spells list")
+        spec = {
+            'spec_label': spec_label,
+            'class_name': sc['className'],
+            'spec_name': sc['specName'],
+            'metric': metric,
+            'top_n': spec_top_n,
+            'cluster_window': float(sc.get('clusterWindowSeconds', cfg.get('clusterWindowSeconds', 10))),
+            'toggle_sync_window': float(sc.get('toggleSyncWindowSeconds', cfg.get('toggleSyncWindowSeconds', 5))),
+            'early_clamp_seconds': int(sc.get('earlyClampSeconds', cfg.get('earlyClampSeconds', 5))),
+            'spell_ids': sorted({e['id'] for e in spell_entries}),
+            'entry_by_id': {e['id']: e for e in spell_entries},
+        }
+
+        for z in zones:
+            zone_id = int(z['id'])
+            for entry in z.get('encounters', []):
+                with rate_stage('zones'):
+                    enc = resolve_encounter(token, zone_id, entry)
+                enc_name = enc['name']
+                npc_override = None
+                npc_overrides = None
+                if isinstance(entry, dict):
+                    npc_override = entry.get('npcId')
+                    npc_overrides = entry.get('npcIds')
+
+                npc_ids: List[int]
+                if npc_overrides:
+                    npc_ids = [int(x) for x in npc_overrides]
+                else:
+                    npc_ids = [resolve_npc_id(enc_name, npc_map, npc_override)]
+
+                for difficulty_id in difficulty_ids:
+                    bucket = "dynamicTimers" if difficulty_id == 4 else "dynamicMythic" if difficulty_id == 5 else "dynamicTimers"
+                    cells.append(dict(
+                        spec,
+                        enc_name=enc_name,
+                        enc_id=int(enc['id']),
+                        npc_ids=npc_ids,
+                        difficulty_id=difficulty_id,
+                        bucket=bucket,
+                    ))
+    return cells
+
+
+def spec_rankings(token: str, cells: List[Dict[str, Any]]) -> Dict[Tuple[int, int], List[Dict[str, Any]]]:
+    # All cells of one spec share class/spec/metric/topN, so their rankings come back in one bulk fetch.
+    first = cells[0]
+    with rate_stage('rankings'):
+        return fetch_rankings_bulk(
+            token,
+            [c['enc_id'] for c in cells],
+            sorted({c['difficulty_id'] for c in cells}),
+            first['class_name'],
+            first['spec_name'],
+            first['metric'],
+            first['top_n'],
+        )
+
+
+def cell_rankings(cell: Dict[str, Any], bulk: Dict[Tuple[int, int], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    return select_rankings(bulk[(cell['enc_id'], cell['difficulty_id'])], cell['top_n'])
+
+
+def ranking_key(ranking: Dict[str, Any]) -> Tuple[str, int]:
+    return str(ranking['report']['code']), int(ranking['report']['fightID'])
+
+
+def fetch_fight_infos(token: str, pairs: List[Tuple[str, int]]) -> Dict[Tuple[str, int], Dict[str, Any]]:
+    with rate_stage('metadata'):
+        return get_fight_infos(token, pairs)
+
+
+def fetch_fight_info(token: str, key: Tuple[str, int]) -> Dict[Tuple[str, int], Dict[str, Any]]:
+    # A log WCL refused in a batch, retried alone so its error surfaces as before.
+    with rate_stage('metadata'):
+        return {key: get_fight_info(token, *key)}
+
+
+def fetch_fight_times(
+    token: str,
+    key: Tuple[str, int],
+    report: Dict[str, Any],
+    wanted: Dict[int, set],
+) -> Dict[int, Dict[int, List[float]]]:
+    # One casts download per fight for every planned player: filtered by source when
+    # only one player is wanted, otherwise all sources, split locally by sourceID.
+    report_code, fight_id = key
+    fight = report['fights'][0]
+    spell_ids = sorted(set().union(*wanted.values()))
+    source_id = next(iter(wanted)) if len(wanted) == 1 else None
+    with rate_stage('casts'):
+        events = FightEvents.concat(fetch_casts(
+            token, report_code, fight_id, source_id, spell_ids, fight.get('startTime'), fight.get('endTime'),
+            decode=FightEvents.from_events,
+        ))
+    if source_id is not None:
+        return {source_id: format_times_by_spell(events, fight['startTime'])}
+    by_source: Dict[int, List[int]] = {player_id: [] for player_id in wanted}
+    for index, src in enumerate(events['sourceID']):
+        bucket = by_source.get(src)
+        if bucket is not None:
+            bucket.append(index)
+    return {
+        player_id: format_times_by_spell(events.select(indices), fight['startTime'])
+        for player_id, indices in by_source.items()
+    }
+
+
+def log_times(
+    cell: Dict[str, Any],
+    ranking: Dict[str, Any],
+    times: Dict[int, List[float]],
+) -> Tuple[str, Dict[int, List[float]]]:
+    report_code, fight_id = ranking_key(ranking)
+    return f"{report_code}:{fight_id}:{ranking['name']}", {sid: times.get(sid, []) for sid in cell['spell_ids']}
+
+
+def build_cell_table(cell: Dict[str, Any], logs: List[Tuple[str, Dict[int, List[float]]]]) -> Dict[int, List[Dict[str, Any]]]:
+    spell_ids = cell['spell_ids']
+    cluster_window = cell['cluster_window']
+    per_log_labels = [label for label, _ in logs]
+    per_log_times = [times for _, times in logs]
+    per_spell_times: Dict[int, List[List[float]]] = {sid: [t[sid] for t in per_log_times] for sid in spell_ids}
+
+    consensus_by_spell: Dict[int, List[float]] = {}
+    for sid, lists in per_spell_times.items():
+        consensus_by_spell[sid] = aggregate_majority_cluster_per_index(lists, cluster_window)
+
+    rep_idx = choose_representative_log_index(per_log_times, consensus_by_spell, cluster_window)
+    representative_times: Dict[int, List[float]] = {}
+    if rep_idx is not None:
+        representative_times = per_log_times[rep_idx]
+        if rep_idx < len(per_log_labels):
+            eprint(
+                f"{cell['spec_label']} | {cell['enc_name']} | diff {cell['difficulty_id']} -> representative {per_log_labels[rep_idx]}"
+            )
+    else:
+        representative_times = {sid: consensus_by_spell.get(sid, []) for sid in spell_ids}
+
+    actions: List[Tuple[int, Dict[str, Any]]] = []
+    for sid in spell_ids:
+        aggregated = representative_times.get(sid, [])
+        entry = cell['entry_by_id'].get(sid)
+        if not entry:
+            continue
+        for sec in aggregated:
+            t_sec = int(round(sec))
+            if entry['mode'] == 'spell':
+                action = {
+                    "method": None,
+                    "ID": None,
+                    "occurrence": None,
+                    "spellId": int(sid),
+                    "toggle": None,
+                }
+            else:
+                action = {
+                    "method": None,
+                    "ID": None,
+                    "occurrence": None,
+                    "spellId": None,
+                    "toggle": entry['label'],
+                }
+            actions.append((t_sec, action))
+
+    if cell['toggle_sync_window'] > 0:
+        actions = snap_close_toggle_pairs(actions, cell['toggle_sync_window'])
+
+    if cell['early_clamp_seconds'] > 0:
+        actions = clamp_early_action_times(actions, cell['early_clamp_seconds'], 0)
+
+    ids_label = ",".join(str(i) for i in cell['npc_ids'])
+    eprint(f"{cell['spec_label']} | {cell['enc_name']} | diff {cell['difficulty_id']} -> bossNpcIds {ids_label} | logs {len(logs)}")
+    return build_dsl_table(actions)
+
+
+def manifest_path(out_path: str) -> str:
+    return os.path.splitext(out_path)[0] + '.manifest.json'
+
+
+def load_manifest(path: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get('version') != MANIFEST_VERSION:
+        return {}
+    return data.get('cells') or {}
+
+
+def save_manifest(path: str, cells: Dict[str, Dict[str, Any]]):
+    data = {'version': MANIFEST_VERSION, 'cells': cells}
+    write_atomic(path, (json.dumps(data, indent=1, sort_keys=True) + "\n").encode('utf-8'))
+
+
+def cell_key(cell: Dict[str, Any]) -> str:
+    return f"{cell['spec_label']}|{cell['enc_id']}|{cell['difficulty_id']}"
+
+
+def cell_fingerprint(cell: Dict[str, Any], rankings: List[Dict[str, Any]]) -> str:
+    # Everything that feeds build_cell_table: which logs/players, which spells and how they
+    # are emitted, and the clustering knobs. Boss NPC ids only affect where the table lands.
+    payload = {
+        'logs': [[*ranking_key(r), r.get('name')] for r in rankings],
+        'class': cell['class_name'],
+        'spells': [[sid, cell['entry_by_id'][sid]['mode'], cell['entry_by_id'][sid]['label']] for sid in cell['spell_ids']],
+        'cluster_window': cell['cluster_window'],
+        'toggle_sync_window': cell['toggle_sync_window'],
+        'early_clamp_seconds': cell['early_clamp_seconds'],
+    }
+    raw = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def reuse_cell_table(cell: Dict[str, Any], rankings: List[Dict[str, Any]], manifest: Optional[Dict[str, Dict[str, Any]]]) -> Optional[Dict[int, List[Dict[str, Any]]]]:
+    # Records the cell's fingerprint; returns the previous table if nothing it depends on changed.
+    cell['fingerprint'] = cell_fingerprint(cell, rankings)
+    prev = (manifest or {}).get(cell_key(cell))
+    if not prev or prev.get('fingerprint') != cell['fingerprint']:
+        return None
+    eprint(f"{cell['spec_label']} | {cell['enc_name']} | diff {cell['difficulty_id']} -> unchanged, reusing previous timers")
+    return {int(t): actions for t, actions in prev['table'].items()}
+
+
+def start_job(pool: Optional[ThreadPoolExecutor], fn, *args) -> Future:
+    # Without a pool the job runs right away, so the serial run needs no threads.
+    if pool is not None:
+        return pool.submit(fn, *args)
+    fut: Future = Future()
+    try:
+        fut.set_result(fn(*args))
+    except Exception as exc:
+        fut.set_exception(exc)
+    return fut
+
+
+def run_cells(
+    token: str,
+    cells: List[Dict[str, Any]],
+    workers: int = 1,
+    manifest: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> List[Dict[int, List[Dict[str, Any]]]]:
+    # Returns one dsl_tbl per cell, in cell order. Planned across every selected spec
+    # at once, so a raid log in the top rankings of several specs or cells costs one
+    # metadata lookup and one casts download in total. Every job starts as soon as
+    # what it needs is in:
+    #   - rankings, one bulk fetch per spec, all at once;
+    #   - report metadata for the new logs of each spec as its rankings arrive, in batches;
+    #   - casts, one download per (report, fight) for all planned players of it, once
+    #     every spec's rankings are known (so the player set is final) and its metadata is;
+    #   - a cell's aggregation as soon as the last of its logs is downloaded.
+    # Cells whose fingerprint matches the manifest reuse the stored table and start no
+    # downloads. With workers > 1 the jobs run concurrently.
+    groups: Dict[str, List[int]] = {}
+    for idx, cell in enumerate(cells):
+        groups.setdefault(cell['spec_label'], []).append(idx)
+
+    results: List[Dict[int, List[Dict[str, Any]]]] = [{} for _ in cells]
+    todo: Dict[int, List[Dict[str, Any]]] = {}
+    # (report, fight) -> (cell index, ranking position) of every log that needs it
+    wanted: Dict[Tuple[str, int], List[Tuple[int, int]]] = {}
+    waiting: Dict[int, set] = {}
+    infos: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    requested: set = set()
+    dispatched: set = set()
+    player_ids: Dict[Tuple[int, int], int] = {}
+    times: Dict[Tuple[Tuple[str, int], int], Dict[int, List[float]]] = {}
+    specs_left = len(groups)
+    jobs: Dict[Future, Tuple[int, str, Any]] = {}
+
+    pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    order = count()
+
+    def submit(kind: str, arg: Any, fn, *args):
+        jobs[start_job(pool, fn, *args)] = (next(order), kind, arg)
+
+    def aggregate(idx: int):
+        cell = cells[idx]
+        logs = [
+            log_times(cell, r, times[(ranking_key(r), player_ids[(idx, pos)])])
+            for pos, r in enumerate(todo[idx])
+        ]
+        submit('cell', idx, build_cell_table, cell, logs)
+
+    def download(key: Tuple[str, int]):
+        players: Dict[int, set] = {}
+        for idx, pos in wanted[key]:
+            cell = cells[idx]
+            player_id = find_player_id(infos[key], todo[idx][pos]['name'], cell['class_name'])
+            player_ids[(idx, pos)] = player_id
+            players.setdefault(player_id, set()).update(cell['spell_ids'])
+        dispatched.add(key)
+        submit('casts', key, fetch_fight_times, token, key, infos[key], players)
+
+    try:
+        for label, idxs in groups.items():
+            submit('rankings', label, spec_rankings, token, [cells[i] for i in idxs])
+        while jobs:
+            done, _ = wait(list(jobs), return_when=FIRST_COMPLETED)
+            new_keys: List[Tuple[str, int]] = []
+            # Handled in submission order, which keeps the serial run deterministic.
+            for fut in sorted(done, key=lambda f: jobs[f][0]):
+                _, kind, arg = jobs.pop(fut)
+                result = fut.result()
+                if kind == 'rankings':
+                    specs_left -= 1
+                    for idx in groups[arg]:
+                        cell = cells[idx]
+                        rankings = cell_rankings(cell, result)
+                        reused = reuse_cell_table(cell, rankings, manifest)
+                        if reused is not None:
+                            results[idx] = reused
+                            continue
+                        todo[idx] = rankings
+                        waiting[idx] = set()
+                        for pos, r in enumerate(rankings):
+                            key = ranking_key(r)
+                            wanted.setdefault(key, []).append((idx, pos))
+                            waiting[idx].add(key)
+                            if key not in requested:
+                                requested.add(key)
+                                new_keys.append(key)
+                        if not rankings:
+                            aggregate(idx)
+                elif kind == 'metadata':
+                    infos.update(result)
+                    for key in arg:
+                        if key not in result:
+                            submit('metadata', [key], fetch_fight_info, token, key)
+                elif kind == 'casts':
+                    for player_id, player_times in result.items():
+                        times[(arg, player_id)] = player_times
+                    for idx in dict.fromkeys(idx for idx, _ in wanted[arg]):
+                        waiting[idx].discard(arg)
+                        if not waiting[idx]:
+                            aggregate(idx)
+                else:
+                    results[arg] = result
+
+            size = FIGHT_INFO_BATCH_SIZE if pool is not None else len(new_keys)
+            for i in range(0, len(new_keys), max(1, size)):
+                chunk = new_keys[i:i + size]
+                submit('metadata', chunk, fetch_fight_infos, token, chunk)
+            if specs_left == 0:
+                for key in wanted:
+                    if key in infos and key not in dispatched:
+                        download(key)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
 def main():
     import argparse
     ap = argparse.ArgumentParser(description='Generate Lorrgs timers from WCL')
@@ -601,9 +1330,23 @@ def main():
     ap.add_argument('--list-specs', action='store_true', help='Print all valid class/spec names from WCL and exit.')
     ap.add_argument('--list-specs-out', default=None, help='Write class/spec list to a markdown file and exit.')
     ap.add_argument('--top', type=int, default=None, help='Number of top public logs to aggregate (overrides config).')
+    ap.add_argument('--workers', type=int, default=None, help='Concurrent WCL requests (default 1 = serial; overrides config).')
+    ap.add_argument('--no-cache', action='store_true', help='Bypass the on-disk GraphQL response cache.')
+    ap.add_argument('--cache-dir', default=None, help='Directory for the GraphQL response cache (default WCL_Parser/.wcl_cache).')
+    ap.add_argument('--event-slices', type=int, default=None, help='Page long fights in this many concurrent time slices (default 1; overrides config).')
+    ap.add_argument('--full', action='store_true', help='Rebuild every cell even if its top logs are unchanged since the last run.')
+    ap.add_argument('--metrics-out', default=None, help='Write per-call-site GraphQL request telemetry (JSON) to this file.')
+    ap.add_argument('--base-url', default=None, help='WCL API host (default WCL_BASE_URL or https://www.warcraftlogs.com), e.g. a local wcl_stub_server.')
     args = ap.parse_args()
 
     cfg = load_config(args.config)
+    event_slices = args.event_slices or cfg.get('eventSlices')
+    client = wcl_client.configure(
+        use_cache=not args.no_cache,
+        cache_dir=args.cache_dir,
+        event_slices=int(event_slices) if event_slices else None,
+        base_url=args.base_url,
+    )
     token = get_token()
 
     if args.list_specs:
@@ -617,22 +1360,14 @@ def main():
             print(md)
         return
 
-    npc_map = load_boss_npc_map(os.path.join('common', 'lists', 'unitIsBossList.lua'))
+    npc_map = load_boss_npc_map(
+        os.path.join('common', 'lists', 'unitIsBossList.lua'), client.cache.root if client.cache else None,
+    )
 
     spec_filter = None
     if args.spec:
         spec_filter = {s.strip() for s in args.spec.split(',') if s.strip()}
 
-    difficulty_ids = cfg.get('difficultyIds')
-    if difficulty_ids is None:
-        difficulty_ids = [int(cfg.get('difficultyId', 4))]
-    difficulty_ids = [int(d) for d in difficulty_ids]
-    zones = cfg.get('zones', [])
-    specs_cfg = cfg.get('specs', {})
-    top_n = int(cfg.get('topN', 1))
-    if args.top is not None:
-        top_n = int(args.top)
-
     out_data_by_bucket: Dict[str, Dict[str, Dict[int, Dict[int, List[Dict[str, Any]]]]]] = {
         "dynamicTimers": {},
         "dynamicMythic": {},
@@ -642,138 +1377,32 @@ def main():
         "dynamicMythic": {},
     }
 
-    for spec_label, sc in specs_cfg.items():
-        if spec_filter and spec_label not in spec_filter:
-            continue
-        class_name = sc['className']
-        spec_name = sc['specName']
-        metric = sc.get('metric')
-        if not metric:
-            raise RuntimeError(f"Spec {spec_label} missing metric")
-        spec_top_n = int(sc.get('topN', top_n))
-        if args.top is not None:
-            spec_top_n = int(args.top)
-        cluster_window = float(sc.get('clusterWindowSeconds', cfg.get('clusterWindowSeconds', 10)))
-        toggle_sync_window = float(sc.get('toggleSyncWindowSeconds', cfg.get('toggleSyncWindowSeconds', 5)))
-        early_clamp_seconds = int(sc.get('earlyClampSeconds', cfg.get('earlyClampSeconds', 5)))
-        default_label = sc.get('label', 'Ramp')
-        default_mode = sc.get('mode', 'toggle')
-        spell_entries = normalize_spell_entries(sc.get('spells', []), default_label, default_mode)
-        if not spell_entries:
-            raise RuntimeError(f"Spec {spec_label} missing spells list")
-        spell_ids = sorted({e['id'] for e in spell_entries})
-        entry_by_id = {e['id']: e for e in spell_entries}
-
-        for z in zones:
-            zone_id = int(z['id'])
-            enc_entries = z.get('encounters', [])
-            if not enc_entries:
-                continue
-            for entry in enc_entries:
-                enc = resolve_encounter(token, zone_id, entry)
-                enc_name = enc['name']
-                enc_id = int(enc['id'])
-                npc_override = None
-                npc_overrides = None
-                if isinstance(entry, dict):
-                    npc_override = entry.get('npcId')
-                    npc_overrides = entry.get('npcIds')
-
-                npc_ids: List[int]
-                if npc_overrides:
-                    npc_ids = [int(x) for x in npc_overrides]
-                else:
-                    npc_ids = [resolve_npc_id(enc_name, npc_map, npc_override)]
-
-                for difficulty_id in difficulty_ids:
-                    bucket = "dynamicTimers" if difficulty_id == 4 else "dynamicMythic" if difficulty_id == 5 else "dynamicTimers"
-                    out_bucket = out_data_by_bucket[bucket]
-                    out_bucket.setdefault(spec_label, {})
-                    out_names_by_bucket[bucket].setdefault(spec_label, {})
-
-                    rankings = choose_rankings(token, enc_id, class_name, spec_name, difficulty_id, metric, spec_top_n)
-
-                    per_spell_times: Dict[int, List[List[float]]] = {sid: [] for sid in spell_ids}
-                    per_log_times: List[Dict[int, List[float]]] = []
-                    per_log_labels: List[str] = []
-                    used_reports = 0
-                    for ranking in rankings:
-                        report_code = ranking['report']['code']
-                        fight_id = int(ranking['report']['fightID'])
-                        player_name = ranking['name']
-
-                        report = get_fight_info(token, report_code, fight_id)
-                        fight = report['fights'][0]
-                        fight_start = fight['startTime']
-
-                        player_id = find_player_id(report, player_name, class_name)
-                        events = fetch_casts(token, report_code, fight_id, player_id, spell_ids)
-                        by_spell = format_times_by_spell(events, fight_start)
-                        per_log_times.append({sid: by_spell.get(sid, []) for sid in spell_ids})
-                        per_log_labels.append(f"{report_code}:{fight_id}:{player_name}")
-                        for sid in spell_ids:
-                            per_spell_times[sid].append(by_spell.get(sid, []))
-                        used_reports += 1
-
-                    consensus_by_spell: Dict[int, List[float]] = {}
-                    for sid, lists in per_spell_times.items():
-                        consensus_by_spell[sid] = aggregate_majority_cluster_per_index(lists, cluster_window)
-
-                    rep_idx = choose_representative_log_index(per_log_times, consensus_by_spell, cluster_window)
-                    representative_times: Dict[int, List[float]] = {}
-                    if rep_idx is not None:
-                        representative_times = per_log_times[rep_idx]
-                        if rep_idx < len(per_log_labels):
-                            eprint(
-                                f"{spec_label} | {enc_name} | diff {difficulty_id} -> representative {per_log_labels[rep_idx]}"
-                            )
-                    else:
-                        representative_times = {sid: consensus_by_spell.get(sid, []) for sid in spell_ids}
-
-                    actions: List[Tuple[int, Dict[str, Any]]] = []
-                    for sid in spell_ids:
-                        aggregated = representative_times.get(sid, [])
-                        entry = entry_by_id.get(sid)
-                        if not entry:
-                            continue
-                        for sec in aggregated:
-                            t_sec = int(round(sec))
-                            if entry['mode'] == 'spell':
-                                action = {
-                                    "method": None,
-                                    "ID": None,
-                                    "occurrence": None,
-                                    "spellId": int(sid),
-                                    "toggle": None,
-                                }
-                            else:
-                                action = {
-                                    "method": None,
-                                    "ID": None,
-                                    "occurrence": None,
-                                    "spellId": None,
-                                    "toggle": entry['label'],
-                                }
-                            actions.append((t_sec, action))
-
-                    if toggle_sync_window > 0:
-                        actions = snap_close_toggle_pairs(actions, toggle_sync_window)
-
-                    if early_clamp_seconds > 0:
-                        actions = clamp_early_action_times(actions, early_clamp_seconds, 0)
-
-                    dsl_tbl = build_dsl_table(actions)
-                    for npc_id in npc_ids:
-                        out_bucket[spec_label][npc_id] = dsl_tbl
-                        out_names_by_bucket[bucket][spec_label][npc_id] = enc_name
-
-                    ids_label = ",".join(str(i) for i in npc_ids)
-                    eprint(f"{spec_label} | {enc_name} | diff {difficulty_id} -> bossNpcIds {ids_label} | logs {used_reports}")
-
-    write_lua(args.out, out_data_by_bucket, out_names_by_bucket)
+    cells = plan_cells(token, cfg, spec_filter, args.top, npc_map)
+    manifest_file = manifest_path(args.out)
+    manifest = load_manifest(manifest_file)
+    results = run_cells(token, cells, max(1, int(args.workers or cfg.get('workers', 1))), None if args.full else manifest)
+
+    for cell, dsl_tbl in zip(cells, results):
+        bucket = cell['bucket']
+        spec_label = cell['spec_label']
+        out_bucket = out_data_by_bucket[bucket]
+        out_bucket.setdefault(spec_label, {})
+        out_names_by_bucket[bucket].setdefault(spec_label, {})
+        for npc_id in cell['npc_ids']:
+            out_bucket[spec_label][npc_id] = dsl_tbl
+            out_names_by_bucket[bucket][spec_label][npc_id] = cell['enc_name']
+
+    out_changed = write_lua(args.out, out_data_by_bucket, out_names_by_bucket)
+    # Cells from specs not built this run keep their entries for the next run.
+    for cell, dsl_tbl in zip(cells, results):
+        manifest[cell_key(cell)] = {'fingerprint': cell['fingerprint'], 'table': dsl_tbl}
+    save_manifest(manifest_file, manifest)
     if args.update_main and not args.no_update_main:
         upsert_specs_into_main(os.path.join("common", "LorrgsTimers.lua"), out_data_by_bucket, out_names_by_bucket)
-    print(f"Wrote {args.out}")
+    eprint(format_rate_report(rate_limit_report(token)))
+    if args.metrics_out:
+        eprint(format_metrics_report(write_metrics_report(args.metrics_out)))
+    print(f"Wrote {args.out}" if out_changed else f"{args.out} unchanged")
 
 
 if __name__ == '__main__':
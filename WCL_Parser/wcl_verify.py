@@ -0,0 +1,237 @@
+import argparse
+import random
+import sys
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import wcl_client
+from wcl_engine import nearest_batch
+from wcl_event_store import FightEvents
+from wcl_sequence_analysis import first_followup_after_trigger
+from wcl_timers import BossNpcMap, pick_majority_cluster, pick_majority_clusters
+
+# Seeded equivalence checks for the rewritten hot paths. Each one is compared with the
+# straightforward version it replaced, kept here as the reference, on random inputs
+# small enough to hit ties, duplicates and empty cases often.
+
+# A check runs `rounds` random cases and returns a description of the first mismatch.
+Check = Callable[[random.Random, int], Optional[str]]
+ROUNDS_DEFAULT = 2000
+
+
+def ref_pick_majority_cluster(values: List[float], window_seconds: float) -> List[float]:
+    # Every anchor scans every value.
+    if not values:
+        return []
+    sorted_vals = sorted(values)
+    best: List[float] = []
+    for anchor in sorted_vals:
+        members = [v for v in sorted_vals if abs(v - anchor) <= window_seconds]
+        if len(members) > len(best):
+            best = members
+            continue
+        if len(members) == len(best) and members:
+            best_range = (best[-1] - best[0]) if best else float("inf")
+            cur_range = members[-1] - members[0]
+            if cur_range < best_range:
+                best = members
+            elif cur_range == best_range and members[len(members) // 2] < best[len(best) // 2]:
+                best = members
+    return best or sorted_vals
+
+
+def ref_nearest(times: List[int], query: int) -> Tuple[int, int]:
+    # One bisect per lookup; min() keeps the first of equal distances, the later sample.
+    if not times:
+        return -1, -1
+    i = bisect_left(times, query)
+    candidates = []
+    if i < len(times):
+        candidates.append(i)
+    if i > 0:
+        candidates.append(i - 1)
+    best = min(candidates, key=lambda j: abs(times[j] - query))
+    return best, abs(times[best] - query)
+
+
+def ref_first_followup(
+    events: List[Dict[str, Any]],
+    trigger_spell_id: int,
+    followup_spell_ids: Optional[List[int]],
+    max_gap_ms: Optional[int],
+) -> Dict[str, Any]:
+    # Forward scan from every trigger.
+    counts: Counter[str] = Counter()
+    trigger_count = matched_count = unmatched_count = 0
+    for index, event in enumerate(events):
+        if event["abilityGameID"] != trigger_spell_id:
+            continue
+        trigger_count += 1
+        found = False
+        for next_event in events[index + 1:]:
+            if max_gap_ms is not None and next_event["timestamp"] - event["timestamp"] > max_gap_ms:
+                break
+            if followup_spell_ids is None or next_event["abilityGameID"] in followup_spell_ids:
+                counts[str(next_event["abilityGameID"])] += 1
+                matched_count += 1
+                found = True
+                break
+        if not found:
+            unmatched_count += 1
+    return {"counts": counts, "trigger_count": trigger_count, "matched_count": matched_count, "unmatched_count": unmatched_count}
+
+
+def ref_best_match(npc_map: Dict[str, List[int]], en: str) -> Optional[List[int]]:
+    # Exact name, else the longest name containing or contained in `en`, first on ties.
+    if en in npc_map:
+        return npc_map[en]
+    best = None
+    best_len = 0
+    for name, ids in npc_map.items():
+        if (name in en or en in name) and len(name) > best_len:
+            best, best_len = ids, len(name)
+    return best
+
+
+def check_majority_cluster(rng: random.Random, rounds: int) -> Optional[str]:
+    for _ in range(rounds):
+        values = [rng.choice([float(rng.randint(0, 40)), rng.uniform(0.0, 40.0)]) for _ in range(rng.randint(0, 12))]
+        window = rng.choice([-1.0, 0.0, 1.0, 2.5, 5.0, 10.0])
+        got, want = pick_majority_cluster(values, window), ref_pick_majority_cluster(values, window)
+        if got != want:
+            return f"values={values} window={window}: {got} != {want}"
+        time_lists = [rng.sample(values, rng.randint(0, len(values))) for _ in range(rng.randint(0, 5))]
+        max_len = max((len(lst) for lst in time_lists), default=0)
+        columns = [[lst[i] for lst in time_lists if len(lst) > i] for i in range(max_len)]
+        got, want = pick_majority_clusters(time_lists, window), [ref_pick_majority_cluster(col, window) for col in columns]
+        if got != want:
+            return f"time_lists={time_lists} window={window}: {got} != {want}"
+    return None
+
+
+def check_nearest_batch(rng: random.Random, rounds: int) -> Optional[str]:
+    for _ in range(rounds):
+        times = sorted(rng.randint(0, 60) for _ in range(rng.randint(0, 10)))
+        queries = [rng.randint(-10, 70) for _ in range(rng.randint(0, 10))]
+        got, want = nearest_batch(times, queries), [ref_nearest(times, q) for q in queries]
+        if got != want:
+            return f"times={times} queries={queries}: {got} != {want}"
+    return None
+
+
+def check_first_followup(rng: random.Random, rounds: int) -> Optional[str]:
+    for _ in range(rounds):
+        events = [{"timestamp": rng.randint(0, 50), "abilityGameID": rng.randint(1, 5)} for _ in range(rng.randint(0, 30))]
+        if rng.random() < 0.7:
+            events.sort(key=lambda e: e["timestamp"])
+        triggers = rng.sample(range(1, 6), rng.randint(1, 2))
+        followups = rng.choice([None, rng.sample(range(1, 6), rng.randint(0, 3))])
+        max_gap = rng.choice([None, 0, 3, 10])
+        got = first_followup_after_trigger(FightEvents.from_events(events), triggers, followups, max_gap)
+        by_trigger = got.pop("by_trigger")
+        want: Dict[str, Any] = {"counts": Counter(), "trigger_count": 0, "matched_count": 0, "unmatched_count": 0}
+        for trigger in triggers:
+            single = ref_first_followup(events, trigger, followups, max_gap)
+            if single["trigger_count"] and by_trigger.get(str(trigger)) != single:
+                return f"events={events} trigger={trigger} followups={followups} gap={max_gap}: {by_trigger} != {single}"
+            for key in ("trigger_count", "matched_count", "unmatched_count"):
+                want[key] += single[key]
+            want["counts"].update(single["counts"])
+        if got != want:
+            return f"events={events} triggers={triggers} followups={followups} gap={max_gap}: {got} != {want}"
+    return None
+
+
+def check_boss_match(rng: random.Random, rounds: int) -> Optional[str]:
+    def word(lo: int, hi: int) -> str:
+        return "".join(rng.choice("abc") for _ in range(rng.randint(lo, hi)))
+
+    for _ in range(rounds):
+        npc_map = {word(1, 8): [n] for n in range(rng.randint(0, 12))}
+        boss_map = BossNpcMap(npc_map)
+        for _ in range(10):
+            en = word(0, 9)
+            got, want = boss_map.best_match(en), ref_best_match(npc_map, en)
+            if got != want:
+                return f"names={list(npc_map)} query={en!r}: {got} != {want}"
+    return None
+
+
+@contextmanager
+def fake_event_pages(events: List[Dict[str, Any]], page_size: int) -> Iterator[None]:
+    # Serves wcl_client's events pages from a sorted list the way WCL pages them:
+    # [start, end] inclusive, equal timestamps never split across pages.
+    times = [e["timestamp"] for e in events]
+
+    def page(token: str, query: str, variables: Dict[str, Any], start: Optional[float]):
+        lo = bisect_left(times, start or 0)
+        end = bisect_right(times, variables.get("end", float("inf")))
+        stop = min(lo + page_size, end)
+        while lo < stop < end and times[stop] == times[stop - 1]:
+            stop += 1
+        return events[lo:stop], (times[stop] if stop < end else None)
+
+    original = wcl_client._events_page
+    wcl_client._events_page = page
+    try:
+        yield
+    finally:
+        wcl_client._events_page = original
+
+
+def check_paginate_slices(rng: random.Random, rounds: int) -> Optional[str]:
+    for _ in range(rounds):
+        times = sorted(1000 + rng.randint(0, 400) for _ in range(rng.randint(0, 120)))
+        events = [{"timestamp": ts, "abilityGameID": n} for n, ts in enumerate(times)]
+        start, end = 1000 + rng.randint(0, 50), 1000 + rng.randint(300, 450)
+        want = [e for e in events if start <= e["timestamp"] <= end]
+        slices, page_size = rng.randint(1, 6), rng.randint(1, 12)
+        with fake_event_pages(events, page_size):
+            got = wcl_client.paginate_events("", "", {}, start=start, end=end, slices=slices)
+            pages = wcl_client.paginate_events("", "", {}, start=start, end=end, slices=slices, decode=FightEvents.from_events)
+        if got != want:
+            return f"start={start} end={end} slices={slices} page_size={page_size}: {len(got)} events != {len(want)}"
+        columns = FightEvents.concat(pages)
+        if list(columns["abilityGameID"]) != [e["abilityGameID"] for e in want]:
+            return f"start={start} end={end} slices={slices} page_size={page_size}: decoded pages differ"
+    return None
+
+
+CHECKS: Dict[str, Check] = {
+    "pick_majority_cluster": check_majority_cluster,
+    "nearest_batch": check_nearest_batch,
+    "first_followup_after_trigger": check_first_followup,
+    "BossNpcMap.best_match": check_boss_match,
+    "paginate_events": check_paginate_slices,
+}
+
+
+def run_checks(seed: int, rounds: int, only: Optional[List[str]] = None) -> Dict[str, Optional[str]]:
+    # Check name -> first mismatch, or None when every case agreed.
+    return {name: check(random.Random(f"{seed}:{name}"), rounds) for name, check in CHECKS.items() if not only or name in only}
+
+
+def report_checks(results: Dict[str, Optional[str]]) -> bool:
+    for name, mismatch in results.items():
+        print(f"{name:32s} {'ok' if mismatch is None else 'MISMATCH ' + mismatch}", file=sys.stderr)
+    return all(mismatch is None for mismatch in results.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the rewritten hot paths with their reference versions")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the random cases")
+    parser.add_argument("--rounds", type=int, default=ROUNDS_DEFAULT, help="Random cases per check")
+    parser.add_argument("--only", default="", help=f"Comma-separated checks: {', '.join(CHECKS)}")
+    args = parser.parse_args()
+    only = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = [name for name in only if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)}")
+    if not report_checks(run_checks(args.seed, args.rounds, only)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()